@@ -801,13 +801,8 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
       sortedArray = np.zeros(len(files), dtype={'names':('filename', 'procdist'),'formats':('U50','f8')})
       sortedArray['filename']=files
       self.factorTableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Groups Table')
-      col1=self.factorTableNode.AddColumn()
-      col1.SetName('ID')
-      for i in range(len(files)):
-        self.factorTableNode.AddEmptyRow()
-        self.factorTableNode.SetCellText(i,0,sortedArray['filename'][i])
-      col2=self.factorTableNode.AddColumn()
-      col2.SetName('Group')
+      import Support.vtk_lib as vtk_lib
+      vtk_lib.setTableNodeColumns(self.factorTableNode, ['ID', 'Group'], [sortedArray['filename'], np.full(len(files), '')])
       #add table to new layout
       slicer.app.layoutManager().setLayout(503)
       slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveTableID(self.factorTableNode.GetID())
@@ -821,13 +816,8 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
     sortedArray = np.zeros(len(files), dtype={'names':('filename', 'procdist'),'formats':('U50','f8')})
     sortedArray['filename']=files
     self.factorTableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Groups Table')
-    col1=self.factorTableNode.AddColumn()
-    col1.SetName('ID')
-    for i in range(len(files)):
-      self.factorTableNode.AddEmptyRow()
-      self.factorTableNode.SetCellText(i,0,sortedArray['filename'][i])
-    col2=self.factorTableNode.AddColumn()
-    col2.SetName('Group')
+    import Support.vtk_lib as vtk_lib
+    vtk_lib.setTableNodeColumns(self.factorTableNode, ['ID', 'Group'], [sortedArray['filename'], np.full(len(files), '')])
     slicer.app.layoutManager().setLayout(503)
     slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveTableID(self.factorTableNode.GetID())
     slicer.app.applicationLogic().PropagateTableSelection()
@@ -947,14 +937,9 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
 
   def plotClustersWithFactors(self, files, groupFactors, templatesIndices):
     logic = ALPACALogic()
-    import Support.gpa_lib as gpa_lib
     #Set up scatter plot
     pcNumber = 2
-    shape = self.LM.lm.shape
-    scatterDataAll= np.zeros(shape=(shape[2], pcNumber))
-    for i in range(pcNumber):
-      data=gpa_lib.plotTanProj(self.LM.lm, self.LM.sortedEig,i,1)
-      scatterDataAll[:,i] = data[:,0]
+    scatterDataAll = self.LM.pcScores()[:,:pcNumber]
     factorNP = np.array(groupFactors)
     #import GPA
     logic.makeScatterPlotWithFactors(scatterDataAll, files, factorNP,
@@ -962,14 +947,9 @@ class ALPACAWidget(ScriptedLoadableModuleWidget):
 
   def plotClusters(self, files, templatesIndices):
     logic = ALPACALogic()
-    import Support.gpa_lib as gpa_lib
     #Set up scatter plot
     pcNumber = 2
-    shape = self.LM.lm.shape
-    scatterDataAll= np.zeros(shape=(shape[2], pcNumber))
-    for i in range(pcNumber):
-      data=gpa_lib.plotTanProj(self.LM.lm, self.LM.sortedEig,i,1)
-      scatterDataAll[:,i] = data[:,0]
+    scatterDataAll = self.LM.pcScores()[:,:pcNumber]
     logic.makeScatterPlot(scatterDataAll, files,
       'PCA Scatter Plots',"PC1","PC2", pcNumber, templatesIndices)
 
@@ -1153,9 +1133,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
         maxProjection = (targetModelNode.GetPolyData().GetLength()) * projectionFactor
         projectedPoints = self.projectPointsPolydata(deformedModelNode.GetPolyData(), targetModelNode.GetPolyData(), outputPoints_vtk, maxProjection)
         projectedLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"Refined Predicted Landmarks")
-        for i in range(projectedPoints.GetNumberOfPoints()):
-            point = projectedPoints.GetPoint(i)
-            projectedLMNode.AddControlPoint(point)
+        import Support.vtk_lib as vtk_lib
+        vtk_lib.vtkPointsToMarkups(projectedLMNode, projectedPoints.GetPoints())
         self.propagateLandmarkTypes(sourceLMNode, projectedLMNode)
         projectedLMNode.SetLocked(True)
         projectedLMNode.SetFixedNumberOfControlPoints(True)
@@ -1173,9 +1152,9 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
 
 
   def exportPointCloud(self, pointCloud, nodeName):
+    import Support.vtk_lib as vtk_lib
     fiducialNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',nodeName)
-    for point in pointCloud:
-      fiducialNode.AddControlPoint(point)
+    vtk_lib.numpyToMarkups(fiducialNode, np.asarray(pointCloud))
     fiducialNode.SetLocked(True)
     fiducialNode.SetFixedNumberOfControlPoints(True)
     return fiducialNode
@@ -1282,9 +1261,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     return transformFilter.GetOutput()
 
   def convertPointsToVTK(self, points):
-    array_vtk = vtk_np.numpy_to_vtk(points, deep=True, array_type=vtk.VTK_FLOAT)
-    points_vtk = vtk.vtkPoints()
-    points_vtk.SetData(array_vtk)
+    import Support.vtk_lib as vtk_lib
+    points_vtk = vtk_lib.numpyToVTKPoints(points)
     polydata_vtk = vtk.vtkPolyData()
     polydata_vtk.SetPoints(points_vtk)
     return polydata_vtk
@@ -1364,10 +1342,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
       itemIDToClone = shNode.GetItemByDataNode(fiducial)
       clonedItemID = slicer.modules.subjecthierarchy.logic().CloneSubjectHierarchyItem(shNode, itemIDToClone)
       sourceLandmarkNode = shNode.GetItemDataNode(clonedItemID)
-    sourceLandmarks = np.zeros(shape=(sourceLandmarkNode.GetNumberOfControlPoints(),3))
-    for i in range(sourceLandmarkNode.GetNumberOfControlPoints()):
-      point = sourceLandmarkNode.GetNthControlPointPosition(i)
-      sourceLandmarks[i,:] = point
+    import Support.vtk_lib as vtk_lib
+    sourceLandmarks = vtk_lib.markupsToNumpy(sourceLandmarkNode)
     cloud = geometry.PointCloud()
     cloud.points = utility.Vector3dVector(sourceLandmarks)
     cloud.scale(scaling, center = (0,0,0))
@@ -1376,23 +1352,21 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     return cloud, sourceLandmarkNode
 
   def propagateLandmarkTypes(self,sourceNode, targetNode):
+     wasModifying = targetNode.StartModify()
      for i in range(sourceNode.GetNumberOfControlPoints()):
        pointDescription = sourceNode.GetNthControlPointDescription(i)
        targetNode.SetNthControlPointDescription(i,pointDescription)
        pointLabel = sourceNode.GetNthControlPointLabel(i)
        targetNode.SetNthControlPointLabel(i, pointLabel)
+     targetNode.EndModify(wasModifying)
 
   def distanceMatrix(self, a):
     """
     Computes the euclidean distance matrix for n points in a 3D space
     Returns a nXn matrix
      """
-    id,jd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1))
-    dx=fnx(a[:,0])
-    dy=fnx(a[:,1])
-    dz=fnx(a[:,2])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
+    import Support.gpa_lib as gpa_lib
+    return gpa_lib.distanceMatrix(a)
 
   def preprocess_point_cloud(self, pcd, voxel_size, radius_normal_factor, radius_feature_factor):
     from open3d import geometry
@@ -1469,12 +1443,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     return output
 
   def getFiducialPoints(self,fiducialNode):
-    points = vtk.vtkPoints()
-    for i in range(fiducialNode.GetNumberOfControlPoints()):
-      point = fiducialNode.GetNthControlPointPosition(i)
-      points.InsertNextPoint(point)
-
-    return points
+    import Support.vtk_lib as vtk_lib
+    return vtk_lib.markupsToVTKPoints(fiducialNode)
 
   def runPointProjection(self, template, model, templateLandmarks, maxProjectionFactor):
     maxProjection = (model.GetPolyData().GetLength()) * maxProjectionFactor
@@ -1484,9 +1454,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     # project landmarks from template to model
     projectedPoints = self.projectPointsPolydata(template.GetPolyData(), model.GetPolyData(), templatePoints, maxProjection)
     projectedLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"Refined Predicted Landmarks")
-    for i in range(projectedPoints.GetNumberOfPoints()):
-      point = projectedPoints.GetPoint(i)
-      projectedLMNode.AddControlPoint(point)
+    import Support.vtk_lib as vtk_lib
+    vtk_lib.vtkPointsToMarkups(projectedLMNode, projectedPoints.GetPoints())
     projectedLMNode.SetLocked(True)
     projectedLMNode.SetFixedNumberOfControlPoints(True)
     return projectedLMNode
@@ -1633,6 +1602,7 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     return sparseTemplate, template_density, targetModelNode
 
   def matchingPCD(self, modelsDir, sparseTemplate, targetModelNode, pcdOutputDir, spacingFactor, useJSONFormat, parameterDictionary):
+    import Support.vtk_lib as vtk_lib
     if useJSONFormat:
       extensionLM = ".mrk.json"
     else:
@@ -1657,8 +1627,7 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
       ID, correspondingSubjectPoints = self.GetCorrespondingPoints(sparseTemplate, alignedSubjectPolydata)
       ID_list.append(ID)
       subjectFiducial = slicer.vtkMRMLMarkupsFiducialNode()
-      for i in range(correspondingSubjectPoints.GetNumberOfPoints()):
-        subjectFiducial.AddControlPoint(correspondingSubjectPoints.GetPoint(i))
+      vtk_lib.vtkPointsToMarkups(subjectFiducial, correspondingSubjectPoints)
       slicer.mrmlScene.AddNode(subjectFiducial)
       subjectFiducial.SetLocked(True)
       subjectFiducial.SetFixedNumberOfControlPoints(True)
@@ -1689,10 +1658,7 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     except ValueError:
       print("Point clouds may not have been generated correctly. Please re-run the point cloud generation step.")
     LM.calcEigen()
-    import Support.gpa_lib as gpa_lib
-    twoDcoors=gpa_lib.makeTwoDim(LM.lmOrig)
-    scores=np.dot(np.transpose(twoDcoors),LM.vec)
-    scores=np.real(scores)
+    scores = LM.pcScores()
     size = scores.shape[0]-1
     scores = scores[:, 0:size]
     return scores, LM
@@ -1760,14 +1726,15 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
   def makeScatterPlotWithFactors(self, data, files, factors, title, xAxis, yAxis, pcNumber, templatesIndices):
     #create two tables for the first two factors and then check for a third
     #check if there is a table node has been created
-    numPoints = len(data)
-    uniqueFactors, factorCounts = np.unique(factors, return_counts=True)
-    factorNumber = len(uniqueFactors)
+    import Support.vtk_lib as vtk_lib
+    files = np.asarray(files)
+    factors = np.asarray(factors)
+    uniqueFactors = np.unique(factors)
 
     #Set up chart
-    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov_with_groups" + xAxis + "v" +yAxis)
+    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov_with_groups")
     if plotChartNode is None:
-      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov_with_groups" + xAxis + "v" +yAxis)
+      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov_with_groups")
     else:
       plotChartNode.RemoveAllPlotSeriesNodeIDs()
 
@@ -1777,29 +1744,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
       tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table Group ' + factor)
       if tableNode is None:
         tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table Group ' + factor)
-      else:
-        tableNode.RemoveAllColumns()    #clear previous data from columns
-
-      # Set up columns for X,Y, and labels
-      labels=tableNode.AddColumn()
-      labels.SetName('Subject ID')
-      tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-      for i in range(pcNumber):
-        pc=tableNode.AddColumn()
-        colName="PC" + str(i+1)
-        pc.SetName(colName)
-        tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-      factorCounter=0
-      table = tableNode.GetTable()
-      table.SetNumberOfRows(factorCounts[factorIndex])
-      for i in range(numPoints):
-        if (factors[i] == factor):
-          table.SetValue(factorCounter, 0,files[i])
-          for j in range(pcNumber):
-            table.SetValue(factorCounter, j+1, data[i,j])
-          factorCounter+=1
+      factorMembers = factors == factor
+      vtk_lib.setScoreTable(tableNode, files[factorMembers], data[factorMembers], pcNumber)
 
       plotSeriesNode=slicer.mrmlScene.GetFirstNodeByName(factor)
       if plotSeriesNode is None:
@@ -1821,26 +1767,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table Templates with group input')
     if tableNode is None:
       tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table Templates with group input')
-    else:
-      tableNode.RemoveAllColumns()    #clear previous data from columns
-
-    labels=tableNode.AddColumn()
-    labels.SetName('Subject ID')
-    tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-    for i in range(pcNumber):
-      pc=tableNode.AddColumn()
-      colName="PC" + str(i+1)
-      pc.SetName(colName)
-      tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-    table = tableNode.GetTable()
-    table.SetNumberOfRows(len(templatesIndices))
-    for i in range(len(templatesIndices)):
-      tempIndex = templatesIndices[i]
-      table.SetValue(i, 0, files[tempIndex])
-      for j in range(pcNumber):
-        table.SetValue(i, j+1, data[tempIndex, j])
+    templatesIndices = np.asarray(templatesIndices, dtype=int)
+    vtk_lib.setScoreTable(tableNode, np.asarray(files)[templatesIndices], data[templatesIndices], pcNumber)
 
     plotSeriesNode=slicer.mrmlScene.GetFirstNodeByName("Templates_with_group_input")
     if plotSeriesNode is None:
@@ -1872,36 +1800,18 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
 
 
   def makeScatterPlot(self, data, files, title, xAxis, yAxis, pcNumber, templatesIndices):
-    numPoints = len(data)
     #Scatter plot for all specimens with no group input
-    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov" + xAxis + "v" +yAxis)
+    import Support.vtk_lib as vtk_lib
+    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov_no_group_input")
     if plotChartNode is None:
-      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov" + xAxis + "v" +yAxis)
+      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov_no_group_input")
     else:
       plotChartNode.RemoveAllPlotSeriesNodeIDs()
 
     tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table without group input')
     if tableNode is None:
       tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table without group input')
-    else:
-      tableNode.RemoveAllColumns()    #clear previous data from columns
-
-    labels=tableNode.AddColumn()
-    labels.SetName('Subject ID')
-    tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-    for i in range(pcNumber):
-      pc=tableNode.AddColumn()
-      colName="PC" + str(i+1)
-      pc.SetName(colName)
-      tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-    table = tableNode.GetTable()
-    table.SetNumberOfRows(numPoints)
-    for i in range(len(files)):
-      table.SetValue(i, 0, files[i])
-      for j in range(pcNumber):
-        table.SetValue(i, j+1, data[i, j])
+    vtk_lib.setScoreTable(tableNode, files, data, pcNumber)
 
     plotSeriesNode1=slicer.mrmlScene.GetFirstNodeByName("Specimens_no_group_input")
     if plotSeriesNode1 is None:
@@ -1922,26 +1832,8 @@ class ALPACALogic(ScriptedLoadableModuleLogic):
     tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA_Scatter_Plot_Table_Templates_no_group')
     if tableNode is None:
       tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA_Scatter_Plot_Table_Templates_no_group')
-    else:
-      tableNode.RemoveAllColumns()    #clear previous data from columns
-
-    labels=tableNode.AddColumn()
-    labels.SetName('Subject ID')
-    tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-    for i in range(pcNumber):
-      pc=tableNode.AddColumn()
-      colName="PC" + str(i+1)
-      pc.SetName(colName)
-      tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-    table = tableNode.GetTable()
-    table.SetNumberOfRows(len(templatesIndices))
-    for i in range(len(templatesIndices)):
-      tempIndex = templatesIndices[i]
-      table.SetValue(i, 0, files[tempIndex])
-      for j in range(pcNumber):
-        table.SetValue(i, j+1, data[tempIndex, j])
+    templatesIndices = np.asarray(templatesIndices, dtype=int)
+    vtk_lib.setScoreTable(tableNode, np.asarray(files)[templatesIndices], data[templatesIndices], pcNumber)
 
     plotSeriesNode1=slicer.mrmlScene.GetFirstNodeByName("Templates_no_group_input")
     if plotSeriesNode1 is None:
@@ -319,6 +319,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
     return True
 
   def applyPatch(self, meshNode, LMNode, gridLandmarks, sampleRate, polydataNormalArray, maximumProjectionDistance=.25):
+    import Support.vtk_lib as vtk_lib
     surfacePolydata = meshNode.GetPolyData()
 
     gridPoints = vtk.vtkPoints()
@@ -411,12 +412,15 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
     d3 = math.sqrt(vtk.vtkMath().Distance2BetweenPoints(m1, m3))
     sampleDistance = (d1 + d2 + d3)
 
-    # set initial three grid points
+    # set initial three grid points, the remaining points get default labels
+    patchPoints=[]
+    patchLabels=[]
     for index in range(0,3):
       origLMPoint=resampledPolydata.GetPoint(index)
       #landmarkLabel = LMNode.GetNthFiducialLabel(gridLandmarks[index]-1)
       landmarkLabel = str(gridLandmarks[index])
-      semilandmarkPoints.AddFiducialFromArray(origLMPoint, landmarkLabel)
+      patchPoints.append(origLMPoint)
+      patchLabels.append(landmarkLabel)
 
     # calculate maximum projection distance
     projectionTolerance = maximumProjectionDistance/.25
@@ -452,7 +456,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       #if there are intersections, update the point to most external one.
       if intersectionPoints.GetNumberOfPoints()>0:
         exteriorPoint = intersectionPoints.GetPoint(intersectionPoints.GetNumberOfPoints()-1)
-        semilandmarkPoints.AddFiducialFromArray(exteriorPoint)
+        patchPoints.append(exteriorPoint)
       #if there are no intersections, reverse the normal vector
       else:
         for dim in range(len(rayEndPoint)):
@@ -460,12 +464,13 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
         obbTree.IntersectWithLine(modelPoint,rayEndPoint,intersectionPoints,intersectionIds)
         if intersectionPoints.GetNumberOfPoints()>0:
           exteriorPoint = intersectionPoints.GetPoint(0)
-          semilandmarkPoints.AddFiducialFromArray(exteriorPoint)
+          patchPoints.append(exteriorPoint)
         else:
           print("No intersection, using closest point")
           closestPointId = pointLocator.FindClosestPoint(modelPoint)
           rayOrigin = surfacePolydata.GetPoint(closestPointId)
-          semilandmarkPoints.AddFiducialFromArray(rayOrigin)
+          patchPoints.append(rayOrigin)
+    vtk_lib.setMarkupsControlPoints(semilandmarkPoints, patchPoints, patchLabels)
 
     # update lock status and color
     semilandmarkPoints.SetLocked(True)
@@ -535,8 +540,10 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
     landmarkDescription = "Semi"
     if setToSemiType is False:
       landmarkDescription = "Fixed"
+    wasModifying = landmarkNode.StartModify()
     for controlPointIndex in range(landmarkNode.GetNumberOfControlPoints()):
       landmarkNode.SetNthControlPointDescription(controlPointIndex, landmarkDescription)
+    landmarkNode.EndModify(wasModifying)
 
   def mergeTree(self, treeWidget, landmarkNode, modelNode,rowColNumber):
     nodeIDs=treeWidget.selectedIndexes()
@@ -551,18 +558,18 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
     return True
 
   def mergeList(self, nodeList, landmarkNode, modelNode,rowColNumber,mergedNode):
-    pt=[0,0,0]
+    import Support.vtk_lib as vtk_lib
     triangleList=[]
     lineSegmentList=[]
     pointList=[]
+    mergedPoints=[]
+    mergedLabels=[]
 
     # Add semi-landmark points within triangle patches
     for currentNode in nodeList:
       if currentNode != landmarkNode:
-        for index in range(3,currentNode.GetNumberOfFiducials()):
-          currentNode.GetNthFiducialPosition(index,pt)
-          fiducialLabel = currentNode.GetNthFiducialLabel(index)
-          mergedNode.AddFiducialFromArray(pt,fiducialLabel)
+        mergedPoints.append(vtk_lib.markupsToNumpy(currentNode)[3:])
+        mergedLabels += [currentNode.GetNthControlPointLabel(index) for index in range(3,currentNode.GetNumberOfControlPoints())]
         p1=currentNode.GetNthFiducialLabel(0)
         p2=currentNode.GetNthFiducialLabel(1)
         p3=currentNode.GetNthFiducialLabel(2)
@@ -609,8 +616,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       tempCurve.SetAndObserveSurfaceConstraintNode(modelNode)
       tempCurve.ResampleCurveWorld(sampleDist)
       tempCurve.GetControlPointPositionsWorld(edgePoints)
-      for i in range(1,edgePoints.GetNumberOfPoints()-1):
-        mergedNode.AddFiducialFromArray(edgePoints.GetPoint(i))
+      mergedPoints.append(np.array(vtk_lib.vtkPointsToNumpy(edgePoints)[1:-1]))
       tempCurve.RemoveAllControlPoints()
 
     # ------ removing manual points from SL set, leaving this as a placeholder while testing
@@ -620,13 +626,14 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
     #  landmarkNode.GetMarkupPoint(0,int(landmarkIndex-1),controlPoint)
     #  mergedNode.AddFiducialFromArray(controlPoint)
 
+    # curve points follow the patch points and get default labels
+    vtk_lib.setMarkupsControlPoints(mergedNode, np.concatenate(mergedPoints) if mergedPoints else None, mergedLabels, "Semi")
+
     # update lock status and color of merged node
     mergedNode.SetLocked(True)
     mergedNode.GetDisplayNode().SetColor(random.random(), random.random(), random.random())
     mergedNode.GetDisplayNode().SetSelectedColor(random.random(), random.random(), random.random())
     mergedNode.GetDisplayNode().PointLabelsVisibilityOff()
-    landmarkTypeSemi=True
-    self.setAllLandmarksType(mergedNode, landmarkTypeSemi)
 
     # clean up
     slicer.mrmlScene.RemoveNode(tempCurve)
@@ -682,6 +689,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       if(not normalArray):
         print("Error: no normal array")
 
+    wasModifying = projectedPoints.StartModify()
     for index in range(originalPoints.GetNumberOfMarkups()):
       originalPoint=[0,0,0]
       originalPoints.GetMarkupPoint(0,index,originalPoint)
@@ -711,6 +719,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
           closestPointId = targetPointLocator.FindClosestPoint(originalPoint)
           rayOrigin = targetPolydata.GetPoint(closestPointId)
           projectedPoints.AddFiducialFromArray(rayOrigin)
+    projectedPoints.EndModify(wasModifying)
     return True
 
   def projectPointsOut(self, sourcePolydata, targetPolydata, originalPoints, projectedPoints, rayLength):
@@ -743,6 +752,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       if(not normalArray):
         print("Error: no normal array")
 
+    wasModifying = projectedPoints.StartModify()
     for index in range(originalPoints.GetNumberOfMarkups()):
       originalPoint=[0,0,0]
       originalPoints.GetMarkupPoint(0,index,originalPoint)
@@ -759,6 +769,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       if intersectionPoints.GetNumberOfPoints() > 0:
         exteriorPoint = intersectionPoints.GetPoint(intersectionPoints.GetNumberOfPoints()-1)
         projectedPoints.AddFiducialFromArray(exteriorPoint)
+    projectedPoints.EndModify(wasModifying)
     return True
 
   def projectPointsOutIn(self, sourcePolydata, targetPolydata, originalPoints, projectedPoints, rayLength):
@@ -788,6 +799,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
       if(not normalArray):
         print("Error: no normal array")
 
+    wasModifying = projectedPoints.StartModify()
     for index in range(originalPoints.GetNumberOfMarkups()):
       originalPoint=[0,0,0]
       originalPoints.GetMarkupPoint(0,index,originalPoint)
@@ -812,6 +824,7 @@ class CreateSemiLMPatchesLogic(ScriptedLoadableModuleLogic):
         if intersectionPoints.GetNumberOfPoints()>0:
           exteriorPoint = intersectionPoints.GetPoint(0)
           projectedPoints.AddFiducialFromArray(exteriorPoint)
+    projectedPoints.EndModify(wasModifying)
     return True
 
   def takeScreenshot(self,name,description,type=-1):
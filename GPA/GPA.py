@@ -12,6 +12,7 @@ import fnmatch
 
 import Support.vtk_lib as vtk_lib
 import Support.gpa_lib as gpa_lib
+import Support.tps_lib as tps_lib
 import  numpy as np
 from datetime import datetime
 import scipy.linalg as sp
@@ -232,6 +233,77 @@ class LMData:
     self.tangentCoord=0
     self.shift=0
     self.centriodSize=0
+    self.gpaMode='batch' # 'batch' aligns all specimens at once, 'loop' is the per-specimen reference engine,
+                         # 'streaming' reads chunkSize specimens at a time on every iteration (see doStreamingGpa),
+                         # 'distributed' maps the iterations over shards of specimens (see doDistributedGpa)
+    self.gpaExecutor=None # executor of the distributed GPA, see gpa_distributed.makeExecutor
+    self.shardSize=None # specimens per shard of the distributed GPA, chunkSize by default
+    self.gpaTolerance=0.0001 # stop refining the mean shape when it changes less than this between iterations
+    self.gpaMaxIterations=5
+    self.gpaCallback=None # optional callback(iteration, meanShapeDelta, meanShape)
+    self.convergence=None
+    self.pcaMethod='auto' # 'eigh' of the covariance matrix, 'svd' of the centered data, 'randomized' truncated svd,
+                          # 'chunked' scatter matrix accumulated over specimen chunks, 'auto' uses randomized when
+                          # pcaComponents is set, chunked for memory-mapped data, otherwise svd when samples < 3 x landmarks
+    self.pcaComponents=None # number of leading components to compute, None computes the full spectrum
+    self.pcaPowerIterations=4 # accuracy of the randomized solver, more iterations give more accurate components
+    self.totalVariance=None
+    self.chunkSize=None # number of specimens processed at a time, set when the landmark array is memory-mapped
+    self.driftThreshold=0.001 # mean shape change above which adding specimens re-runs the full GPA + PCA
+    self.scores=None # cached PC scores, see pcScores
+    self.scatter=None # scatter matrix of the aligned coordinates from the streaming GPA, used by the chunked PCA
+    self.semiLandmarks=None # zero based indices of the semi-landmarks, slid during GPA when slidingCriterion is set
+    self.slidingCriterion=None # None, 'bendingEnergy' or 'procrustesDistance' (see gpa_sliding)
+    self.slidingTangents='curve' # 'curve', 'surface' or a function(specimen, semiLandmarks) returning the directions
+    self.slidingWorkers=None
+
+  bundleFileName = 'GPAResults.npz'
+
+  def initializeFromBundle(self, bundlePath):
+    """
+    Restore an analysis from the binary results bundle written by writeResultsBundle
+    """
+    try:
+      bundle = np.load(bundlePath)
+      if 'alignedFile' in bundle.files:
+        # aligned coordinates are in the memory-mapped landmark array of the analysis
+        alignedPath = os.path.join(os.path.dirname(bundlePath), str(bundle['alignedFile']))
+        self.lm = np.load(alignedPath, mmap_mode='r')
+        self.chunkSize = int(bundle['chunkSize'])
+      else:
+        self.lm = bundle['aligned']
+      self.lmOrig = self.lm
+      self.mShape = bundle['meanShape']
+      self.val = bundle['eigenValues']
+      self.vec = bundle['eigenVectors']
+      self.totalVariance = float(bundle['totalVariance'])
+      self.centriodSize = bundle['centroidSize'].reshape(-1,1)
+      self.procdist = bundle['procrustesDistance'].reshape(-1,1)
+      self.scores = bundle['pcScores']
+      self.files = bundle['files'].tolist()
+      self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+      return 1
+    except:
+      print("Error loading results")
+      return 0
+
+  def writeResultsBundle(self, outputFolder, files, scores):
+    """
+    Write aligned coordinates, mean shape, eigenvectors, eigenvalues, PC scores, centroid sizes and Procrustes
+    distances to a binary .npz bundle at full precision. Memory-mapped aligned coordinates already stored in the
+    output folder are referenced by file name instead of being copied.
+    """
+    arrays = dict(meanShape=self.mShape, eigenVectors=np.real(self.vec), eigenValues=np.real(self.val),
+      totalVariance=self.totalVariance if self.totalVariance is not None else np.real(self.val).sum(),
+      pcScores=scores, centroidSize=np.ravel(self.centriodSize), procrustesDistance=np.ravel(self.procdist),
+      files=np.array(files, dtype=str))
+    if isinstance(self.lm, np.memmap) and os.path.dirname(os.path.abspath(self.lm.filename)) == os.path.abspath(outputFolder):
+      self.lm.flush()
+      arrays['alignedFile'] = os.path.basename(self.lm.filename)
+      arrays['chunkSize'] = self.chunkSize or self.lm.shape[2]
+    else:
+      arrays['aligned'] = self.lm
+    np.savez(os.path.join(outputFolder, self.bundleFileName), **arrays)
 
   def initializeFromDataFrame(self, outputData, meanShape, eigenVectors, eigenValues):
     try:
@@ -239,13 +311,15 @@ class LMData:
       self.centriodSize=self.centriodSize.reshape(-1,1)
       LMHeaders = [name for name in outputData.columns if 'LM ' in name]
       points = outputData[LMHeaders].to_numpy().transpose()
-      self.lm = points.reshape(int(points.shape[0]/3), 3, -1, order='F')
+      # coordinate columns are ordered LM 1_X, LM 1_Y, LM 1_Z, LM 2_X, ...
+      self.lm = np.ascontiguousarray(points).reshape(int(points.shape[0]/3), 3, -1)
       self.lmOrig = self.lm
       self.mShape = meanShape[['X','Y','Z']].to_numpy()
       self.val = eigenValues.Scores.to_numpy()
       vectors = [name for name in eigenVectors.columns if 'PC ' in name]
       self.vec = eigenVectors[vectors].to_numpy()
       self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+      self.scores = None
       self.procdist=gpa_lib.procDist(self.lm, self.mShape)
       self.procdist=self.procdist.reshape(-1,1)
       return 1
@@ -257,9 +331,9 @@ class LMData:
   def calcLMVariation(self, SampleScaleFactor, skipScalingCheckBox):
     i,j,k=self.lmOrig.shape
     varianceMat=np.zeros((i,j))
-    for subject in range(k):
-      tmp=pow((self.lmOrig[:,:,subject]-self.mShape),2)
-      varianceMat=varianceMat+tmp
+    for chunk in gpa_lib.specimenChunks(k, self.chunkSize):
+      difference=self.lmOrig[:,:,chunk]-self.mShape[:,:,np.newaxis]
+      varianceMat+=np.einsum('ijk,ijk->ij',difference,difference)
     # if GPA scaling has been skipped, don't apply image size scaling factor
     if(skipScalingCheckBox):
       varianceMat = np.sqrt(varianceMat/(k-1))
@@ -268,119 +342,250 @@ class LMData:
     return varianceMat
 
   def doGpa(self,skipScalingCheckBox):
-    i,j,k=self.lmOrig.shape
-    self.centriodSize=np.zeros(k)
-    for i in range(k):
-      self.centriodSize[i]=np.linalg.norm(self.lmOrig[:,:,i]-self.lmOrig[:,:,i].mean(axis=0))
+    import time
+    self.scores=None
+    self.scatter=None
+    if self.gpaMode == 'streaming':
+      self.doStreamingGpa(skipScalingCheckBox)
+      return
+    if self.gpaMode == 'distributed':
+      self.doDistributedGpa(skipScalingCheckBox)
+      return
+    startTime = time.perf_counter()
+    self.centriodSize=gpa_lib.centroidSizes(self.lmOrig, self.chunkSize)
+    centroidTime = time.perf_counter() - startTime
+    options = dict(mode=self.gpaMode, tolerance=self.gpaTolerance, maxIterations=self.gpaMaxIterations,
+      callback=self.gpaCallback, chunkSize=self.chunkSize)
+    if self.slidingCriterion is not None and self.semiLandmarks is not None and len(self.semiLandmarks):
+      import Support.gpa_sliding as gpa_sliding
+      options['slide'] = lambda meanShape, allLandmarkSets: gpa_sliding.slideSemiLandmarks(allLandmarkSets, meanShape,
+        self.semiLandmarks, self.slidingCriterion, self.slidingTangents, workers=self.slidingWorkers, chunkSize=self.chunkSize)
     if skipScalingCheckBox:
       print("Skipping Scaling")
-      self.lm, self.mShape=gpa_lib.runGPANoScale(self.lmOrig)
+      self.lm, self.mShape, self.convergence=gpa_lib.runGPANoScale(self.lmOrig, **options)
     else:
-      self.lm, self.mShape=gpa_lib.runGPA(self.lmOrig)
+      self.lm, self.mShape, self.convergence=gpa_lib.runGPA(self.lmOrig, **options)
+    self.convergence['phaseTimes']['centroidSize'] = centroidTime
+    print(gpa_lib.convergenceSummary(self.convergence))
+
+  def doStreamingGpa(self, skipScalingCheckBox, readChunks=None):
+    """
+    GPA that only holds chunkSize specimens in memory at a time (see gpa_lib.streamingProcrustes). Specimens are read
+    from lmOrig, or from readChunks (e.g. landmark_io.landmarkFileChunks) with lmOrig a preallocated (e.g.
+    memory-mapped) array receiving the aligned coordinates. The scatter matrix of the aligned coordinates is kept
+    for calcEigen, so the PCA needs no further pass over the data.
+    """
+    if self.slidingCriterion is not None and self.semiLandmarks is not None and len(self.semiLandmarks):
+      raise ValueError("Sliding semi-landmarks is not supported by the streaming GPA")
+    if readChunks is None:
+      readChunks = gpa_lib.arrayChunks(self.lmOrig, self.chunkSize)
+    self.lm, self.mShape, self.scatter, self.centriodSize, self.convergence = gpa_lib.streamingProcrustes(readChunks,
+      not skipScalingCheckBox, self.gpaTolerance, self.gpaMaxIterations, self.gpaCallback, output=self.lmOrig)
+    self.scores=None
+    print(gpa_lib.convergenceSummary(self.convergence))
+
+  def doDistributedGpa(self, skipScalingCheckBox, shards=None):
+    """
+    Streaming GPA with every pass mapped over shards of specimens by gpaExecutor (see gpa_distributed). By default
+    the shards are shardSize specimens of lmOrig, which workers on other hosts open by path when it is memory-mapped.
+    The aligned coordinates are written to lmOrig and the reduced scatter matrix is kept for calcEigen.
+    """
+    import Support.gpa_distributed as gpa_distributed
+    if self.slidingCriterion is not None and self.semiLandmarks is not None and len(self.semiLandmarks):
+      raise ValueError("Sliding semi-landmarks is not supported by the distributed GPA")
+    if shards is None:
+      shards = gpa_distributed.arrayShards(self.lmOrig, self.shardSize or self.chunkSize or self.lmOrig.shape[2])
+    self.lm, self.mShape, self.scatter, self.centriodSize, self.convergence = gpa_distributed.distributedProcrustes(shards,
+      not skipScalingCheckBox, self.gpaExecutor, self.gpaTolerance, self.gpaMaxIterations, self.gpaCallback,
+      self.chunkSize, output=self.lmOrig)
+    self.scores=None
+    print(gpa_lib.convergenceSummary(self.convergence))
+
+  def addSpecimens(self, newLandmarks, skipScalingCheckBox, landmarkArray=None):
+    """
+    Add specimens to an existing analysis without a full recompute. The new (landmarks x 3 x specimens) array is
+    aligned to the current mean shape and the mean shape and PCA are updated incrementally. If the mean shape
+    moves by more than driftThreshold, GPA and PCA are re-run for all specimens instead.
+    landmarkArray is an optional preallocated (e.g. memory-mapped) array for all specimens.
+    Returns a dictionary reporting the mean shape drift, whether the analysis was recomputed and the change in
+    coordinates and PC scores of every existing specimen.
+    """
+    i, j, k = self.lm.shape
+    newNumber = newLandmarks.shape[2]
+    oldLm, oldVec = self.lm, np.real(self.vec)
+    oldScores = self.pcScores()
+    centroidSize = np.concatenate((np.ravel(self.centriodSize), gpa_lib.centroidSizes(newLandmarks, self.chunkSize)))
+    gpa_lib.alignToMeanShape(self.mShape, newLandmarks, not skipScalingCheckBox, self.chunkSize)
+    newMeanShape = (k*self.mShape + newNumber*gpa_lib.meanShape(newLandmarks, self.chunkSize))/float(k+newNumber)
+    drift = np.linalg.norm(newMeanShape - self.mShape)
+    if landmarkArray is None:
+      landmarkArray = np.zeros((i, j, k+newNumber))
+    for chunk in gpa_lib.specimenChunks(k, self.chunkSize):
+      landmarkArray[:,:,chunk] = oldLm[:,:,chunk]
+    landmarkArray[:,:,k:] = newLandmarks
+    recomputed = bool(drift > self.driftThreshold)
+    if recomputed:
+      # existing specimens are already centered and scaled, so the GPA can start from their aligned coordinates
+      self.lmOrig = landmarkArray
+      self.doGpa(skipScalingCheckBox)
+      self.calcEigen()
+    else:
+      meanVec = gpa_lib.makeTwoDim(self.mShape.reshape(i, j, 1))[:,0]
+      newVec = gpa_lib.makeTwoDim(landmarkArray[:,:,k:])
+      meanVec, self.val, self.vec, self.totalVariance = gpa_lib.updateEigen(meanVec, self.val, oldVec, k, newVec, self.totalVariance)
+      self.lm = self.lmOrig = landmarkArray
+      self.mShape = newMeanShape
+      self.scatter = None
+    self.centriodSize = centroidSize
+    self.vec = gpa_lib.matchEigenvectorSigns(oldVec, self.vec)
+    self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+    self.scores = None
+    components = min(oldVec.shape[1], self.vec.shape[1])
+    scores = self.pcScores()[:k,:components]
+    return {'added': newNumber, 'meanShapeDrift': drift, 'recomputed': recomputed,
+      'coordinateChange': gpa_lib.specimenDisplacements(self.lm, oldLm, self.chunkSize),
+      'scoreChange': np.linalg.norm(scores - oldScores[:,:components], axis=1)}
+
+  def bootstrap(self, replicates, outputFolder, skipScalingCheckBox, components=5, seed=0, workers=None, executor='thread'):
+    """
+    Bootstrap confidence intervals of the mean shape and the leading PCs (see gpa_resampling.runBootstrap).
+    The intervals of the mean shape and eigenvalues are also written to bootstrapMeanShape.csv and
+    bootstrapEigenvalues.csv in outputFolder.
+    """
+    import Support.gpa_resampling as gpa_resampling
+    components = min(components, self.vec.shape[1])
+    intervals = gpa_resampling.runBootstrap(self.lm, self.mShape, np.real(self.vec[:,:components]), replicates, outputFolder,
+      not skipScalingCheckBox, seed, workers, executor=executor, tolerance=self.gpaTolerance, maxIterations=self.gpaMaxIterations)
+    lower, upper = intervals['meanShape']
+    with open(os.path.join(outputFolder, "bootstrapMeanShape.csv"), "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ["", "X", "Y", "Z", "lower_X", "lower_Y", "lower_Z", "upper_X", "upper_Y", "upper_Z"])
+      gpa_lib.writeCSVRows(outputFile, np.column_stack((self.mShape, lower, upper)), ["LM " + str(i + 1) for i in range(len(self.mShape))])
+    lower, upper = intervals['eigenvalues']
+    with open(os.path.join(outputFolder, "bootstrapEigenvalues.csv"), "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ["", "eigenvalue", "lower", "upper"])
+      gpa_lib.writeCSVRows(outputFile, np.column_stack((np.real(self.val[:components]), lower, upper)), ["PC " + str(i + 1) for i in range(components)])
+    return intervals
+
+  def permutationTest(self, groups, replicates, outputFolder, seed=0, workers=None, executor='thread'):
+    """
+    Permutation test of the Procrustes distance between the mean shapes of every pair of groups
+    (see gpa_resampling.runPermutationTest). The results are also written to permutationTest.csv in outputFolder.
+    """
+    import Support.gpa_resampling as gpa_resampling
+    pairs, observed, pValues = gpa_resampling.runPermutationTest(self.lm, groups, replicates, outputFolder, seed, workers,
+      executor=executor)
+    with open(os.path.join(outputFolder, "permutationTest.csv"), "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ["group_1", "group_2", "proc_dist", "p_value"])
+      gpa_lib.writeCSVRows(outputFile, np.column_stack((observed, pValues)), [first + "," + second for first, second in pairs])
+    return pairs, observed, pValues
 
   def calcEigen(self):
     i, j, k = self.lmOrig.shape
+    method = self.pcaMethod
+    if method == 'auto':
+      if self.pcaComponents is not None:
+        method = 'randomized'
+      elif isinstance(self.lm, np.memmap) or self.scatter is not None:
+        method = 'chunked'
+      else:
+        method = 'svd' if k < i*j else 'eigh'
+    self.totalVariance=None
+    if method == 'chunked':
+      if self.scatter is not None:
+        self.val, self.vec = gpa_lib.eigenFromScatter(self.scatter, k)
+      else:
+        self.val, self.vec = gpa_lib.calcEigenChunked(self.lm, self.chunkSize or k)
+      self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+      self.totalVariance = np.real(self.val).sum()
+      self.scores=None
+      return
     twoDim=gpa_lib.makeTwoDim(self.lm)
-    covMatrix=gpa_lib.calcCov(twoDim)
-    if k>i*j: # limit results returned if sample number is less than observations
-      self.val, self.vec = sp.eigh(covMatrix)
+    if method == 'randomized':
+      components = self.pcaComponents if self.pcaComponents is not None else min(i*j, k)
+      self.val, self.vec, self.totalVariance = gpa_lib.calcEigenRandomized(twoDim, components, self.pcaPowerIterations)
+    elif method == 'svd':
+      self.val, self.vec = gpa_lib.calcEigenSVD(twoDim)
+    elif method == 'eigh':
+      covMatrix=gpa_lib.calcCov(twoDim)
+      if k>i*j: # limit results returned if sample number is less than observations
+        self.val, self.vec = sp.eigh(covMatrix)
+      else:
+        self.val, self.vec=sp.eigh(covMatrix, subset_by_index=(i * j - k, i * j - 1))
+      self.val=self.val[::-1]
+      self.vec=self.vec[:, ::-1]
     else:
-      self.val, self.vec=sp.eigh(covMatrix, eigvals=(i * j - k, i * j - 1))
-    self.val=self.val[::-1]
-    self.vec=self.vec[:, ::-1]
+      raise ValueError(f"Unknown PCA method '{self.pcaMethod}'")
+    if self.totalVariance is None:
+      self.totalVariance = np.real(self.val).sum()
     self.sortedEig = gpa_lib.pairEig(self.val, self.vec)
+    self.scores=None
+
+  def pcScores(self):
+    """
+    PC scores of every specimen (specimens x components). They are computed once, as a single product of the
+    flattened aligned coordinates and the eigenvectors, and cached until the GPA or PCA is recomputed.
+    """
+    if self.scores is None:
+      self.scores = gpa_lib.projectScores(self.lm, np.real(self.vec), self.chunkSize)
+    return self.scores
+
+  def percentVariance(self):
+    # use the total variance from the trace so truncated spectra still report correct fractions
+    totalVariance = self.totalVariance if self.totalVariance is not None else np.real(self.val).sum()
+    return np.real(self.val)/totalVariance
 
   def ExpandAlongPCs(self, numVec,scaleFactor,SampleScaleFactor):
-    b=0
     i,j,k=self.lm.shape
     tmp=np.zeros((i,j))
-    points=np.zeros((i,j))
     self.vec=np.real(self.vec)
     # scale eigenvector
     for y in range(len(numVec)):
       if numVec[y] != 0:
-        pcComponent = numVec[y] - 1
-        tmp[:,0]=tmp[:,0]+float(scaleFactor[y])*self.vec[0:i,pcComponent]*SampleScaleFactor/3
-        tmp[:,1]=tmp[:,1]+float(scaleFactor[y])*self.vec[i:2*i,pcComponent]*SampleScaleFactor/3
-        tmp[:,2]=tmp[:,2]+float(scaleFactor[y])*self.vec[2*i:3*i,pcComponent]*SampleScaleFactor/3
+        tmp=tmp+float(scaleFactor[y])*self.pcShift(numVec[y],SampleScaleFactor)
 
     self.shift=tmp
 
+  def pcShift(self, pcNumber, SampleScaleFactor):
+    """
+    Landmark displacement (landmarks x 3) along PC pcNumber (starting at 1) for a slider scale factor of 1
+    """
+    i=self.lm.shape[0]
+    return np.real(self.vec[:,pcNumber-1]).reshape(3,i).T*SampleScaleFactor/3
+
   def writeOutData(self, outputFolder, files):
-    # make headers for eigenvector matrix
-    headerPC = []
-    headerLM = [""]
-    for i in range(self.vec.shape[1]):
-      headerPC.append("PC " + str(i + 1))
-    for i in range(int(self.vec.shape[0] / 3)):
-      headerLM.append("LM " + str(i + 1) + "_X")
-      headerLM.append("LM " + str(i + 1) + "_Y")
-      headerLM.append("LM " + str(i + 1) + "_Z")
-    r,c=self.vec.shape
-    temp=np.empty(shape=(r+1,c), dtype = object)
-    temp[0,:] = np.array(headerPC)
-    for currentRow in range(r):
-      temp[currentRow+1,:] = self.vec[currentRow,:]
-    #temp = np.vstack((np.array(headerPC), self.vec))
-    temp = np.column_stack((np.array(headerLM), temp))
-    np.savetxt(outputFolder + os.sep + "eigenvector.csv", temp, delimiter=",", fmt='%s')
-    temp = np.column_stack((np.array(headerPC), self.val))
-    np.savetxt(outputFolder + os.sep + "eigenvalues.csv", temp, delimiter=",", fmt='%s')
-
-    headerLM = []
-    headerCoordinate = ["", "X", "Y", "Z"]
-    for i in range(len(self.mShape)):
-      headerLM.append("LM " + str(i + 1))
-    temp = np.column_stack((np.array(headerLM), self.mShape))
-    temp = np.vstack((np.array(headerCoordinate), temp))
-    np.savetxt(outputFolder + os.sep + "MeanShape.csv", temp, delimiter=",", fmt='%s')
-
-    percentVar = self.val / self.val.sum()
+    headerPC = ["PC " + str(i + 1) for i in range(self.vec.shape[1])]
+    headerLM = gpa_lib.landmarkCoordinateHeader(int(self.vec.shape[0] / 3))
+    with open(outputFolder + os.sep + "eigenvector.csv", "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, [""] + headerPC)
+      gpa_lib.writeCSVRows(outputFile, np.real(self.vec), headerLM)
+    with open(outputFolder + os.sep + "eigenvalues.csv", "w") as outputFile:
+      gpa_lib.writeCSVRows(outputFile, np.real(self.val).reshape(-1, 1), headerPC)
+
+    with open(outputFolder + os.sep + "MeanShape.csv", "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ["", "X", "Y", "Z"])
+      gpa_lib.writeCSVRows(outputFile, self.mShape, ["LM " + str(i + 1) for i in range(len(self.mShape))])
+
     print("lm shape", self.lm.shape)
     print("mShape shape", self.mShape.shape)
-    self.procdist = gpa_lib.procDist(self.lm, self.mShape)
-    files = np.array(files)
-    i = files.shape
-    files = files.reshape(i[0], 1)
+    self.procdist = gpa_lib.procDist(self.lm, self.mShape, self.chunkSize)
+    files = [str(file) for file in files]
     k, j, i = self.lmOrig.shape
 
-    coords = self.flattenArray(self.lm)
     self.procdist = self.procdist.reshape(i, 1)
     self.centriodSize = self.centriodSize.reshape(i, 1)
-    tmp = np.column_stack((files, self.procdist, self.centriodSize, np.transpose(coords)))
-    header = np.array(['Sample_name', 'proc_dist', 'centeroid'])
-    i1, j = tmp.shape
-    coodrsL = (j - 3) / 3.0
-    l = np.zeros(int(3 * coodrsL))
-
-    l = list(l)
-
-    for x in range(int(coodrsL)):
-      loc = x + 1
-      l[3 * x] = "LM " + str(loc) + "_X"
-      l[3 * x + 1] = "LM " + str(loc) + "_Y"
-      l[3 * x + 2] = "LM " + str(loc) + "_Z"
-    l = np.array(l)
-    header = np.column_stack((header.reshape(1, 3), l.reshape(1, int(3 * coodrsL))))
-    tmp1 = np.vstack((header, tmp))
-    np.savetxt(outputFolder + os.sep + "OutputData.csv", tmp1, fmt="%s", delimiter=",")
-
-    # calc PC scores
-    twoDcoors = gpa_lib.makeTwoDim(self.lm)
-    scores = np.dot(np.transpose(twoDcoors), self.vec)
-    scores = np.real(scores)
-    headerPC.insert(0, "Sample_name")
-    temp = np.column_stack((files.reshape(i, 1), scores))
-    temp = np.vstack((headerPC, temp))
-    np.savetxt(outputFolder + os.sep + "pcScores.csv", temp, fmt="%s", delimiter=",")
-
-  def flattenArray(self, dataArray):
-    i,j,k=dataArray.shape
-    tmp=np.zeros((i*j,k))
-    for x in range(k):
-        vec=np.reshape(dataArray[:,:,x],(i*j),order='A')
-        tmp[:,x]=vec
-    return tmp
+    # write the coordinates in specimen chunks so memory-mapped landmark data is never fully loaded
+    with open(outputFolder + os.sep + "OutputData.csv", "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ['Sample_name', 'proc_dist', 'centeroid'] + gpa_lib.landmarkCoordinateHeader(k))
+      for chunk in gpa_lib.specimenChunks(i, self.chunkSize):
+        rows = np.column_stack((self.procdist[chunk], self.centriodSize[chunk], gpa_lib.landmarkRows(self.lm[:,:,chunk])))
+        gpa_lib.writeCSVRows(outputFile, rows, files[chunk])
+
+    scores = self.pcScores()
+    with open(outputFolder + os.sep + "pcScores.csv", "w") as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ["Sample_name"] + headerPC)
+      gpa_lib.writeCSVRows(outputFile, scores, files)
+
+    self.writeResultsBundle(outputFolder, files, scores)
 
   def closestSample(self,files):
     import operator
@@ -396,6 +601,23 @@ class LMData:
     tmp[:,2]=self.vec[2*i:3*i,pc]
     return LM+tmp*scaleFactor/3.0
 
+class GPAAnalysisResults:
+  """
+  Results of GPALogic.runAnalysis: the LMData holding the GPA + PCA, the analysis options used, the output
+  folder (None if the output could not be written) and the wall time in seconds of each phase
+  """
+  def __init__(self):
+    self.LM=None
+    self.files=[]
+    self.extension=''
+    self.landmarkTypeArray=[]
+    self.excludedLandmarks=[]
+    self.skipScaling=False
+    self.outputFolder=None
+    self.rawMeanLandmarks=None
+    self.sampleSizeScaleFactor=None
+    self.phaseTimes={}
+
 class GPAWidget(ScriptedLoadableModuleWidget):
   """Uses ScriptedLoadableModuleWidget base class, available at: https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
@@ -448,6 +670,13 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     fileViewerLayout.addRow(self.clearButton)
     self.clearButton.connect('clicked(bool)', self.onClearButton)
 
+    # Clear cache Button
+    #
+    self.clearCacheButton = qt.QPushButton("Clear landmark file cache")
+    self.clearCacheButton.toolTip = "Remove all parsed landmark files from the landmark cache"
+    fileViewerLayout.addRow(self.clearCacheButton)
+    self.clearCacheButton.connect('clicked(bool)', self.onClearCacheButton)
+
     # Select output directory
     self.outText, outLabel, self.outbutton=self.textIn('Select output directory: ','', '')
     inputLayout.addWidget(self.outText,3,2)
@@ -468,10 +697,51 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.skipScalingCheckBox.setToolTip("If checked, GPA will skip scaling.")
     inputLayout.addWidget(self.skipScalingCheckBox, 5,2)
 
+    self.gpaToleranceLabel=qt.QLabel('GPA convergence tolerance')
+    inputLayout.addWidget(self.gpaToleranceLabel,6,1)
+    self.gpaToleranceSpinBox=qt.QDoubleSpinBox()
+    self.gpaToleranceSpinBox.setDecimals(8)
+    self.gpaToleranceSpinBox.setRange(0, 1)
+    self.gpaToleranceSpinBox.setSingleStep(0.00001)
+    self.gpaToleranceSpinBox.value = 0.0001
+    self.gpaToleranceSpinBox.setToolTip("Mean shape refinement stops when the mean shape changes less than this between iterations.")
+    inputLayout.addWidget(self.gpaToleranceSpinBox,6,2,1,2)
+
+    self.gpaMaxIterationsLabel=qt.QLabel('GPA maximum iterations')
+    inputLayout.addWidget(self.gpaMaxIterationsLabel,7,1)
+    self.gpaMaxIterationsSpinBox=qt.QSpinBox()
+    self.gpaMaxIterationsSpinBox.setRange(1, 1000)
+    self.gpaMaxIterationsSpinBox.value = 5
+    self.gpaMaxIterationsSpinBox.setToolTip("Maximum number of mean shape refinement iterations.")
+    inputLayout.addWidget(self.gpaMaxIterationsSpinBox,7,2,1,2)
+
+    self.memmapCheckBox = qt.QCheckBox()
+    self.memmapCheckBox.setText("Store landmark data on disk")
+    self.memmapCheckBox.checked = 0
+    self.memmapCheckBox.setToolTip("If checked, the landmark array is memory-mapped from a file in the output folder and processed in chunks of specimens. Use for datasets that do not fit in memory.")
+    inputLayout.addWidget(self.memmapCheckBox, 8,2)
+
+    self.useCacheCheckBox = qt.QCheckBox()
+    self.useCacheCheckBox.setText("Cache parsed landmark files")
+    self.useCacheCheckBox.checked = 1
+    self.useCacheCheckBox.setToolTip("If checked, parsed landmark files are cached so repeated analyses of unchanged files skip parsing.")
+    inputLayout.addWidget(self.useCacheCheckBox, 8,3)
+
+    self.slidingLabel=qt.QLabel('Slide semi-landmarks')
+    inputLayout.addWidget(self.slidingLabel,9,1)
+    self.slidingComboBox=qt.QComboBox()
+    self.slidingComboBox.addItems(["None", "Bending energy", "Procrustes distance"])
+    self.slidingComboBox.setToolTip("Slide the landmarks described as 'Semi' along their tangents during GPA, minimizing the thin plate spline bending energy or the Procrustes distance to the mean shape.")
+    inputLayout.addWidget(self.slidingComboBox,9,2)
+    self.slidingTangentsComboBox=qt.QComboBox()
+    self.slidingTangentsComboBox.addItems(["Curve", "Surface"])
+    self.slidingTangentsComboBox.setToolTip("Curve semi-landmarks slide along the line through the landmarks before and after them, surface semi-landmarks in the plane fitted to their nearest landmarks.")
+    inputLayout.addWidget(self.slidingTangentsComboBox,9,3)
+
     #Load Button
     self.loadButton = qt.QPushButton("Execute GPA + PCA")
     self.loadButton.checkable = True
-    inputLayout.addWidget(self.loadButton,6,1,1,3)
+    inputLayout.addWidget(self.loadButton,10,1,1,3)
     self.loadButton.toolTip = "Push to start the program. Make sure you have filled in all the data."
     self.loadButton.enabled = False
     self.loadButton.connect('clicked(bool)', self.onLoad)
@@ -479,7 +749,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     #Open Results
     self.openResultsButton = qt.QPushButton("View output files")
     self.openResultsButton.checkable = True
-    inputLayout.addWidget(self.openResultsButton,7,1,1,3)
+    inputLayout.addWidget(self.openResultsButton,11,1,1,3)
     self.openResultsButton.toolTip = "Push to open the folder where the GPA + PCA results are stored"
     self.openResultsButton.enabled = False
     self.openResultsButton.connect('clicked(bool)', self.onOpenResults)
@@ -506,6 +776,14 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.loadResultsButton.enabled = False
     self.loadResultsButton.connect('clicked(bool)', self.onLoadFromFile)
 
+    #Add Specimens Button
+    self.addSpecimensButton = qt.QPushButton("Add selected landmark files to analysis")
+    self.addSpecimensButton.checkable = True
+    loadFromFileLayout.addWidget(self.addSpecimensButton,6,1,1,3)
+    self.addSpecimensButton.toolTip = "Align the selected landmark files to the previous analysis and update its mean shape and PCA. The updated analysis is written to the output directory."
+    self.addSpecimensButton.enabled = False
+    self.addSpecimensButton.connect('clicked(bool)', self.onAddSpecimens)
+
     ################################### Explore Tab ###################################
     #Mean Shape display section
     meanShapeFrame = ctk.ctkCollapsibleButton()
@@ -575,6 +853,16 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     noneTypeLabel=qt.QLabel("None")
     distributionLayout.addWidget(noneTypeLabel,5,1)
     distributionLayout.addWidget(self.NoneType,5,2,1,2)
+    self.cloudSpecimenLimit=qt.QSpinBox()
+    self.cloudSpecimenLimit.minimum = 0
+    self.cloudSpecimenLimit.maximum = 100000
+    self.cloudSpecimenLimit.value = 0
+    self.cloudSpecimenLimit.specialValueText = "All"
+    self.cloudSpecimenLimit.setToolTip("Maximum number of specimens shown in the point cloud. Larger samples are subsampled evenly for interactive display")
+    cloudSpecimenLimitLabel=qt.QLabel("Point cloud specimens")
+    distributionLayout.addWidget(cloudSpecimenLimitLabel,6,1)
+    distributionLayout.addWidget(self.cloudSpecimenLimit,6,2,1,2)
+    self.cloudSpecimenLimit.connect('valueChanged(int)', self.onCloudSpecimenLimitChanged)
 
     self.scaleSlider = ctk.ctkSliderWidget()
     self.scaleSlider.singleStep = .1
@@ -764,6 +1052,38 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     animateLayout.addWidget(self.stopRecordButton,1,5,1,2)
     self.stopRecordButton.connect('clicked(bool)', self.onStopRecording)
 
+    # Generate PC warp sequences offline
+    sequencePCLabel=qt.QLabel("Sequence PC")
+    animateLayout.addWidget(sequencePCLabel,2,1)
+    self.sequencePCComboBox=qt.QComboBox()
+    animateLayout.addWidget(self.sequencePCComboBox,2,2,1,5)
+    sequenceRangeLabel=qt.QLabel("Scale range")
+    animateLayout.addWidget(sequenceRangeLabel,3,1)
+    self.sequenceMinScale=qt.QSpinBox()
+    self.sequenceMinScale.setRange(-100, 100)
+    self.sequenceMinScale.value = -100
+    animateLayout.addWidget(self.sequenceMinScale,3,2,1,2)
+    self.sequenceMaxScale=qt.QSpinBox()
+    self.sequenceMaxScale.setRange(-100, 100)
+    self.sequenceMaxScale.value = 100
+    animateLayout.addWidget(self.sequenceMaxScale,3,4,1,2)
+    sequenceFramesLabel=qt.QLabel("Frames")
+    animateLayout.addWidget(sequenceFramesLabel,4,1)
+    self.sequenceFrameCount=qt.QSpinBox()
+    self.sequenceFrameCount.setRange(2, 1000)
+    self.sequenceFrameCount.value = 60
+    animateLayout.addWidget(self.sequenceFrameCount,4,2,1,2)
+    self.generateSequenceButton = qt.QPushButton("Generate sequence")
+    self.generateSequenceButton.toolTip = "Generate the PC warping over the scale range as a sequence, without recording slider changes. Only the landmarks of every frame are stored, the model is warped from the precomputed PC displacement during playback."
+    self.generateSequenceButton.enabled = False
+    animateLayout.addWidget(self.generateSequenceButton,4,4,1,3)
+    self.generateSequenceButton.connect('clicked(bool)', self.onGeneratePCSequence)
+    self.exportVideoButton = qt.QPushButton("Export sequence video")
+    self.exportVideoButton.toolTip = "Render every frame of the generated sequence in the 3D view and save it as a video."
+    self.exportVideoButton.enabled = False
+    animateLayout.addWidget(self.exportVideoButton,5,1,1,6)
+    self.exportVideoButton.connect('clicked(bool)', self.onExportPCSequenceVideo)
+
     # Reset button
     resetButton = qt.QPushButton("Reset Scene")
     resetButton.checkable = True
@@ -856,7 +1176,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.slider2.populateComboBox(self.PCList)
     self.PCList.append('None')
     self.LM.val=np.real(self.LM.val)
-    percentVar=self.LM.val/self.LM.val.sum()
+    percentVar=self.LM.percentVariance()
     self.vectorOne.clear()
     self.vectorTwo.clear()
     self.vectorThree.clear()
@@ -893,18 +1213,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
     tableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Procrustes Distance Table')
     GPANodeCollection.AddItem(tableNode)
-    col1=tableNode.AddColumn()
-    col1.SetName('ID')
-
-    col2=tableNode.AddColumn()
-    col2.SetName('Procrustes Distance')
-    tableNode.SetColumnType('ID',vtk.VTK_STRING)
-    tableNode.SetColumnType('Procrustes Distance',vtk.VTK_FLOAT)
-
-    for i in range(len(files)):
-      tableNode.AddEmptyRow()
-      tableNode.SetCellText(i,0,sortedArray['filename'][i])
-      tableNode.SetCellText(i,1,str(sortedArray['procdist'][i]))
+    vtk_lib.setTableNodeColumns(tableNode, ['ID', 'Procrustes Distance'],
+      [sortedArray['filename'], sortedArray['procdist'].astype(np.float32)])
 
     barPlot = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLPlotSeriesNode', 'Distances')
     GPANodeCollection.AddItem(barPlot)
@@ -940,14 +1250,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
 
     self.factorTableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', 'Factor Table')
     GPANodeCollection.AddItem(self.factorTableNode)
-    col1=self.factorTableNode.AddColumn()
-    col1.SetName('ID')
-    for i in range(len(self.files)):
-      self.factorTableNode.AddEmptyRow()
-      self.factorTableNode.SetCellText(i,0,sortedArray['filename'][i])
-
-    col2=self.factorTableNode.AddColumn()
-    col2.SetName(self.factorName.text)
+    vtk_lib.setTableNodeColumns(self.factorTableNode, ['ID', self.factorName.text],
+      [sortedArray['filename'], np.full(len(self.files), '')])
     self.selectFactor.addItem(self.factorName.text)
 
     #add table to new layout
@@ -1003,6 +1307,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.selectorButton.enabled = False
     self.stopRecordButton.enabled = False
     self.startRecordButton.enabled = False
+    self.generateSequenceButton.enabled = False
+    self.exportVideoButton.enabled = False
 
     #delete data from previous runs
     self.nodeCleanUp()
@@ -1037,6 +1343,10 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.inputFilePaths = []
     self.clearButton.enabled = False
 
+  def onClearCacheButton(self):
+    GPALogic().clearLandmarkCache()
+    print("Landmark file cache cleared")
+
   def onSelectLandmarkFiles(self):
     self.inputFileTable.clear()
     self.inputFilePaths = []
@@ -1047,6 +1357,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     #enable load button if required fields are complete
     filePathsExist = bool(self.inputFilePaths is not [] )
     self.loadButton.enabled = bool (filePathsExist and hasattr(self, 'outputDirectory'))
+    self.updateAddSpecimensButton()
     if filePathsExist:
       self.LM_dir_name = os.path.dirname(self.inputFilePaths[0])
       basename, self.extension = os.path.splitext(self.inputFilePaths[0])
@@ -1066,6 +1377,7 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       self.loadButton.enabled = bool (filePathsExist and self.outputDirectory)
     except AttributeError:
       self.loadButton.enabled = False
+    self.updateAddSpecimensButton()
 
   def onSelectResultsDirectory(self):
     self.resultsDirectory=qt.QFileDialog().getExistingDirectory()
@@ -1074,6 +1386,11 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       self.loadResultsButton.enabled = bool (self.resultsDirectory)
     except AttributeError:
       self.loadResultsButton.enabled = False
+    self.updateAddSpecimensButton()
+
+  def updateAddSpecimensButton(self):
+    self.addSpecimensButton.enabled = bool(getattr(self, 'inputFilePaths', []) and getattr(self, 'outputDirectory', '')
+      and getattr(self, 'resultsDirectory', ''))
 
   def onOpenResults(self):
     qpath = qt.QUrl.fromLocalFile(os.path.dirname(self.outputFolder+os.path.sep))
@@ -1084,48 +1401,38 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     logic = GPALogic()
     import pandas
 
-    # Load data
-    outputDataPath = os.path.join(self.resultsDirectory, 'OutputData.csv')
-    meanShapePath = os.path.join(self.resultsDirectory, 'MeanShape.csv')
-    eigenVectorPath = os.path.join(self.resultsDirectory, 'eigenvector.csv')
-    eigenValuePath = os.path.join(self.resultsDirectory, 'eigenvalues.csv')
-    eigenValueNames = ['Index', 'Scores']
-    try:
-      eigenValues = pandas.read_csv(eigenValuePath, names=eigenValueNames)
-      eigenVector = pandas.read_csv(eigenVectorPath)
-      meanShape = pandas.read_csv(meanShapePath)
-      outputData = pandas.read_csv(outputDataPath)
-    except:
-      logging.debug('Result import failed: Missing file')
-      return
-
     # Try to load skip scaling and skip LM options from log file, if present
-    self.skipScalingOption = False
-    self.LMExclusionList=[]
-    logFilePath = os.path.join(self.resultsDirectory, 'analysis.log')
-    try:
-      with open(logFilePath) as f:
-        for search in f:
-          if 'Scale=False' in search:
-            self.skipScalingOption = True
-          if 'ExcludedLM' in search:
-            line = search.rstrip()
-            header, skippedText = line.split('=')
-            if skippedText != '':
-              self.LMExclusionList = [int(i) for i in skippedText.split(',')]
-    except:
-      logging.debug('Log import failed: Cannot read scaling option from log file')
-      logging.debug('Log import failed: Cannot read skipped landmarks from log file')
+    self.skipScalingOption, self.LMExclusionList = logic.readAnalysisLogOptions(self.resultsDirectory)
     print("Skip Scale option: ", self.skipScalingOption)
     print("Skipped Landmarks: ", self.LMExclusionList)
 
-    # Initialize variables
+    # Initialize variables, preferring the binary results bundle over the CSV files
     self.LM=LMData()
-    success = self.LM.initializeFromDataFrame(outputData, meanShape, eigenVector, eigenValues)
-    if not success:
-      return
+    bundlePath = os.path.join(self.resultsDirectory, LMData.bundleFileName)
+    if os.path.exists(bundlePath):
+      success = self.LM.initializeFromBundle(bundlePath)
+      if not success:
+        return
+      self.files = self.LM.files
+    else:
+      outputDataPath = os.path.join(self.resultsDirectory, 'OutputData.csv')
+      meanShapePath = os.path.join(self.resultsDirectory, 'MeanShape.csv')
+      eigenVectorPath = os.path.join(self.resultsDirectory, 'eigenvector.csv')
+      eigenValuePath = os.path.join(self.resultsDirectory, 'eigenvalues.csv')
+      eigenValueNames = ['Index', 'Scores']
+      try:
+        eigenValues = pandas.read_csv(eigenValuePath, names=eigenValueNames)
+        eigenVector = pandas.read_csv(eigenVectorPath)
+        meanShape = pandas.read_csv(meanShapePath)
+        outputData = pandas.read_csv(outputDataPath)
+      except:
+        logging.debug('Result import failed: Missing file')
+        return
+      success = self.LM.initializeFromDataFrame(outputData, meanShape, eigenVector, eigenValues)
+      if not success:
+        return
+      self.files = outputData.Sample_name.tolist()
 
-    self.files = outputData.Sample_name.tolist()
     shape = self.LM.lmOrig.shape
     print('Loaded ' + str(shape[2]) + ' subjects with ' + str(shape[0]) + ' landmark points.')
 
@@ -1146,9 +1453,9 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.meanLandmarkNode.GetDisplayNode().SetSliceProjectionOpacity(1)
 
     #set scaling factor using mean of landmarks
-    self.rawMeanLandmarks = self.LM.lmOrig.mean(2)
+    self.rawMeanLandmarks = gpa_lib.meanShape(self.LM.lmOrig, self.LM.chunkSize)
     logic = GPALogic()
-    self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks).max()
+    self.sampleSizeScaleFactor = gpa_lib.maximumDistance(self.rawMeanLandmarks)
     print("Scale Factor: " + str(self.sampleSizeScaleFactor))
 
     # get mean landmarks as a fiducial node
@@ -1161,9 +1468,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       modelDisplayNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelDisplayNode')
       GPANodeCollection.AddItem(modelDisplayNode)
 
-    for landmarkNumber in range (shape[0]):
-      name = str(landmarkNumber+1) #start numbering at 1
-      self.meanLandmarkNode.AddFiducialFromArray(self.rawMeanLandmarks[landmarkNumber,:], name)
+    landmarkLabels = [str(landmarkNumber+1) for landmarkNumber in range(shape[0])] #start numbering at 1
+    vtk_lib.setMarkupsControlPoints(self.meanLandmarkNode, self.rawMeanLandmarks, landmarkLabels)
     self.meanLandmarkNode.SetDisplayVisibility(1)
     self.meanLandmarkNode.LockedOn() #lock position so when displayed they cannot be moved
     #initialize mean LM display
@@ -1183,13 +1489,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.populateDistanceTable(self.files)
     print("Closest sample to mean:" + filename)
 
-    #Setup for scatter plots
-    shape = self.LM.lm.shape
-    self.LM.calcEigen()
-    self.scatterDataAll= np.zeros(shape=(shape[2],self.pcNumber))
-    for i in range(self.pcNumber):
-      data=gpa_lib.plotTanProj(self.LM.lm,self.LM.sortedEig,i,1)
-      self.scatterDataAll[:,i] = data[:,0]
+    #Setup for scatter plots, from the eigenvectors and PC scores of the results
+    self.scatterDataAll = self.LM.pcScores()[:,:self.pcNumber]
 
     # Set up layout
     self.assignLayoutDescription()
@@ -1214,41 +1515,55 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.landmarkVisualizationType.enabled = True
     self.modelVisualizationType.enabled = True
 
+  def onAddSpecimens(self):
+    logic = GPALogic()
+    skipScalingOption, LMExclusionList = logic.readAnalysisLogOptions(self.resultsDirectory)
+    dateTimeStamp = datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
+    outputFolder = os.path.join(self.outputDirectory, dateTimeStamp)
+    memmapPath = os.path.join(outputFolder, 'landmarks.npy') if self.memmapCheckBox.checked else None
+    result = logic.addSpecimensToAnalysis(self.resultsDirectory, self.inputFilePaths, LMExclusionList, skipScalingOption,
+      outputFolder, memmapPath, self.useCacheCheckBox.checked)
+    if result is None:
+      return
+    self.LM, self.landmarkTypeArray, report = result
+    self.skipScalingOption, self.LMExclusionList, self.outputFolder = skipScalingOption, LMExclusionList, outputFolder
+    logic.writeAnalysisLogFile(self.LM_dir_name, self.outputFolder, self.LM.files, self.LM, self.extension,
+      self.LMExclusionList, self.skipScalingOption, self.landmarkTypeArray)
+    self.openResultsButton.enabled = True
+    # restore the updated analysis for exploration
+    self.resultsDirectory = self.outputFolder
+    self.resultsText.setText(self.outputFolder)
+    self.onLoadFromFile()
+
   def onLoad(self):
     self.initializeOnLoad() #clean up module from previous runs
     logic = GPALogic()
 
-    # get landmarks
-    self.LM=LMData()
-    lmToExclude=self.excludeLMText.text
-    if len(lmToExclude) != 0:
-      self.LMExclusionList=lmToExclude.split(",")
-      print("Excluded landmarks: ", self.LMExclusionList)
-      self.LMExclusionList=[np.int(x) for x in self.LMExclusionList]
-      lmNP=np.asarray(self.LMExclusionList)
-    else:
-      self.LMExclusionList=[]
+    # Run GPA + PCA and write output
+    options = dict(excludedLandmarks=self.excludeLMText.text, skipScaling=self.skipScalingCheckBox.checked,
+      tolerance=self.gpaToleranceSpinBox.value, maxIterations=self.gpaMaxIterationsSpinBox.value,
+      memmap=self.memmapCheckBox.checked, useCache=self.useCacheCheckBox.checked,
+      slideSemiLandmarks=(None, 'bendingEnergy', 'procrustesDistance')[self.slidingComboBox.currentIndex],
+      slidingTangents=('curve', 'surface')[self.slidingTangentsComboBox.currentIndex])
     try:
-      self.LM.lmOrig, self.landmarkTypeArray = logic.loadLandmarks(self.inputFilePaths, self.LMExclusionList, self.extension)
-    except:
-      logging.debug('Load landmark data failed: Could not create an array from landmark files')
+      results = logic.runAnalysis(self.inputFilePaths, self.outputDirectory, options)
+    except ValueError as error:
+      slicer.util.errorDisplay(str(error))
       return
+    self.LM = results.LM
+    self.files = results.files
+    self.landmarkTypeArray = results.landmarkTypeArray
+    self.LMExclusionList = results.excludedLandmarks
+    self.skipScalingOption = results.skipScaling
+    self.rawMeanLandmarks = results.rawMeanLandmarks
+    self.sampleSizeScaleFactor = results.sampleSizeScaleFactor
+    if results.outputFolder is not None:
+      self.outputFolder = results.outputFolder
+      self.openResultsButton.enabled = True
     shape = self.LM.lmOrig.shape
-    print('Loaded ' + str(shape[2]) + ' subjects with ' + str(shape[0]) + ' landmark points.')
-
-    # Do GPA
-    self.skipScalingOption=self.skipScalingCheckBox.checked
-    self.LM.doGpa(self.skipScalingOption)
-    self.LM.calcEigen()
     self.pcNumber=10
     self.updateList()
 
-    #set scaling factor using mean of landmarks
-    self.rawMeanLandmarks = self.LM.lmOrig.mean(2)
-    logic = GPALogic()
-    self.sampleSizeScaleFactor = logic.dist2(self.rawMeanLandmarks).max()
-    print("Scale Factor: " + str(self.sampleSizeScaleFactor))
-
     # get mean landmarks as a fiducial node
     self.meanLandmarkNode=slicer.mrmlScene.GetFirstNodeByName('Mean Landmark Node')
     if self.meanLandmarkNode is None:
@@ -1260,11 +1575,8 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       GPANodeCollection.AddItem(modelDisplayNode)
     self.meanLandmarkNode.GetDisplayNode().SetSliceProjection(True)
     self.meanLandmarkNode.GetDisplayNode().SetSliceProjectionOpacity(1)
-    self.meanLandmarkNode.StartModify()
-    for landmarkNumber in range(shape[0]):
-      name = str(landmarkNumber+1) #start numbering at 1
-      self.meanLandmarkNode.AddControlPoint(vtk.vtkVector3d(self.rawMeanLandmarks[landmarkNumber,:]), name)
-    self.meanLandmarkNode.EndModify(True)
+    landmarkLabels = [str(landmarkNumber+1) for landmarkNumber in range(shape[0])] #start numbering at 1
+    vtk_lib.setMarkupsControlPoints(self.meanLandmarkNode, self.rawMeanLandmarks, landmarkLabels)
     self.meanLandmarkNode.SetDisplayVisibility(1)
     self.meanLandmarkNode.GetDisplayNode().SetPointLabelsVisibility(1)
     self.meanLandmarkNode.GetDisplayNode().SetTextScale(3)
@@ -1279,29 +1591,13 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.copyLandmarkNode.SetName('PC Warped Landmarks')
     self.copyLandmarkNode.SetDisplayVisibility(0)
 
-    # Set up output
-    dateTimeStamp = datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
-    self.outputFolder = os.path.join(self.outputDirectory, dateTimeStamp)
-    try:
-      os.makedirs(self.outputFolder)
-      self.LM.writeOutData(self.outputFolder, self.files)
-      self.writeAnalysisLogFile(self.LM_dir_name, self.outputFolder, self.files)
-      self.openResultsButton.enabled = True
-    except:
-      logging.debug('Result directory failed: Could not access output folder')
-      print("Error creating result directory")
-
     # Get closest sample to mean
     filename=self.LM.closestSample(self.files)
     self.populateDistanceTable(self.files)
     print("Closest sample to mean:" + filename)
 
     #Setup for scatter plots
-    shape = self.LM.lm.shape
-    self.scatterDataAll= np.zeros(shape=(shape[2],self.pcNumber))
-    for i in range(self.pcNumber):
-      data=gpa_lib.plotTanProj(self.LM.lm,self.LM.sortedEig,i,1)
-      self.scatterDataAll[:,i] = data[:,0]
+    self.scatterDataAll = self.LM.pcScores()[:,:self.pcNumber]
 
     # Set up layout
     self.assignLayoutDescription()
@@ -1357,35 +1653,6 @@ class GPAWidget(ScriptedLoadableModuleWidget):
         camera.GetCamera().Zoom(1/self.widgetZoomFactor)
       self.widgetZoomFactor = 0
 
-  def writeAnalysisLogFile(self, inputPath, outputPath, files):
-    # generate log file
-    logFile = open(outputPath+os.sep+"analysis.log","w")
-    logFile.write("Date=" + datetime.now().strftime('%Y-%m-%d') + "\n")
-    logFile.write("Time=" + datetime.now().strftime('%H:%M:%S') + "\n")
-    logFile.write("InputPath=" + inputPath + "\n")
-    logFile.write("OutputPath=" + outputPath.replace("\\","/") + "\n")
-    logFile.write("Files=")
-    for i in range(len(files)-1):
-      logFile.write(files[i] + self.extension + ",")
-    logFile.write(files[len(files)-1] + self.extension + "\n")
-    logFile.write("LM_format="  + self.extension + "\n")
-    [pointNumber, dim, subjectNumber] = self.LM.lmOrig.shape
-    totalLandmarks = pointNumber + len(self.LMExclusionList)
-    logFile.write("NumberLM=" + str(totalLandmarks) + "\n")
-    logFile.write("ExcludedLM=")
-    exclusions = ",".join(map(str, self.LMExclusionList))
-    logFile.write(exclusions + "\n")
-    logFile.write("Scale=" + str(not self.skipScalingOption) + "\n")
-    logFile.write("MeanShape=MeanShape.csv"+ "\n")
-    logFile.write("eigenvalues=eigenvalues.csv" + "\n")
-    logFile.write("eigenvectors=eigenvectors.csv" + "\n")
-    logFile.write("OutputData=OutputData.csv" + "\n")
-    logFile.write("pcScores=pcScores.csv" + "\n")
-    landmarkType_list = ",".join(self.landmarkTypeArray)
-    logFile.write("SemiLandmarks= " + landmarkType_list)
-    logFile.close()
-
-
   # Explore Data callbacks and helpers
   def plot(self):
     logic = GPALogic()
@@ -1492,6 +1759,11 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     else:
       self.plotDistributionGlyph(2*self.scaleSlider.value)
 
+  def onCloudSpecimenLimitChanged(self):
+    # only redraw a point cloud that is already displayed
+    if slicer.mrmlScene.GetFirstNodeByName('Landmark Point Cloud'):
+      self.plotDistributionCloud()
+
   def unplotDistributions(self):
     modelNode=slicer.mrmlScene.GetFirstNodeByName('Landmark Point Cloud')
     if modelNode:
@@ -1506,20 +1778,15 @@ class GPAWidget(ScriptedLoadableModuleWidget):
   def plotDistributionCloud(self):
     self.unplotDistributions()
     i,j,k=self.LM.lmOrig.shape
-    pt=[0,0,0]
-    #set up vtk point array for each landmark point
-    points = vtk.vtkPoints()
-    points.SetNumberOfPoints(i*k)
-    indexes = vtk.vtkDoubleArray()
-    indexes.SetName('LM Index')
-    pointCounter = 0
-
-    for subject in range(0,k):
-      for landmark in range(0,i):
-        pt=self.LM.lmOrig[landmark,:,subject]
-        points.SetPoint(pointCounter,pt)
-        indexes.InsertNextValue(landmark+1)
-        pointCounter+=1
+    specimens = np.arange(k)
+    specimenLimit = self.cloudSpecimenLimit.value
+    if 0 < specimenLimit < k:
+      # level of detail: display an evenly spaced subset of the specimens
+      specimens = np.unique(np.linspace(0, k-1, specimenLimit).round().astype(int))
+    #set up vtk point array with the landmarks of every specimen, specimen by specimen
+    cloud = np.moveaxis(self.LM.lmOrig[:,:,specimens], 2, 0).reshape(-1,3)
+    points = vtk_lib.numpyToVTKPoints(cloud)
+    indexes = vtk_lib.numpyToVTKArray(np.tile(np.arange(1, i+1, dtype=np.float64), len(specimens)), 'LM Index')
 
     #add points to polydata
     polydata=vtk.vtkPolyData()
@@ -1559,30 +1826,19 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     self.unplotDistributions()
     varianceMat = self.LM.calcLMVariation(self.sampleSizeScaleFactor,self.skipScalingOption)
     i,j,k=self.LM.lmOrig.shape
-    pt=[0,0,0]
     #set up vtk point array for each landmark point
-    points = vtk.vtkPoints()
-    points.SetNumberOfPoints(i)
-    scales = vtk.vtkDoubleArray()
-    scales.SetName("Scales")
-    index = vtk.vtkDoubleArray()
-    index.SetName("Index")
-
-    #set up tensor array to scale ellipses
-    tensors = vtk.vtkDoubleArray()
-    tensors.SetNumberOfTuples(i)
-    tensors.SetNumberOfComponents(9)
-    tensors.SetName("Tensors")
+    points = vtk_lib.numpyToVTKPoints(self.rawMeanLandmarks)
+    scales = vtk_lib.numpyToVTKArray(sliderScale*varianceMat.mean(axis=1), "Scales")
+    index = vtk_lib.numpyToVTKArray(np.arange(1, i+1, dtype=np.float64), "Index")
+
+    #set up tensor array to scale ellipses, diagonal tensors of the coordinate variances
+    tensorArray = np.zeros((i,3,3))
+    tensorArray[:,[0,1,2],[0,1,2]] = sliderScale*varianceMat
+    tensors = vtk_lib.numpyToVTKArray(tensorArray.reshape(i,9), "Tensors")
 
     # get fiducial node for mean landmarks, make just labels visible
     self.meanLandmarkNode.SetDisplayVisibility(1)
     self.scaleMeanShapeSlider.value=0
-    for landmark in range(i):
-      pt=self.rawMeanLandmarks[landmark,:]
-      points.SetPoint(landmark,pt)
-      scales.InsertNextValue(sliderScale*(varianceMat[landmark,0]+varianceMat[landmark,1]+varianceMat[landmark,2])/3)
-      tensors.InsertTuple9(landmark,sliderScale*varianceMat[landmark,0],0,0,0,sliderScale*varianceMat[landmark,1],0,0,0,sliderScale*varianceMat[landmark,2])
-      index.InsertNextValue(landmark+1)
 
     polydata=vtk.vtkPolyData()
     polydata.SetPoints(points)
@@ -1657,25 +1913,11 @@ class GPAWidget(ScriptedLoadableModuleWidget):
           indexToRemove.append(self.LMExclusionList[i]-1)
         self.sourceLMnumpy=np.delete(self.sourceLMnumpy,indexToRemove,axis=0)
 
-      # set up transform
-      targetLMVTK=logic.convertNumpyToVTK(self.rawMeanLandmarks)
-      sourceLMVTK=logic.convertNumpyToVTK(self.sourceLMnumpy)
-      VTKTPSMean = vtk.vtkThinPlateSplineTransform()
-      VTKTPSMean.SetSourceLandmarks( sourceLMVTK )
-      VTKTPSMean.SetTargetLandmarks( targetLMVTK )
-      VTKTPSMean.SetBasisToR()  # for 3D transform
-
-      # transform from selected to mean
-      self.transformMeanNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'Mean TPS Transform')
-      GPANodeCollection.AddItem(self.transformMeanNode)
-      self.transformMeanNode.SetAndObserveTransformToParent( VTKTPSMean )
-
-      # load model node
+      # load model node and warp it from the selected landmarks to the mean
       self.modelNode=slicer.util.loadModel(self.grayscaleSelector.currentPath)
       GPANodeCollection.AddItem(self.modelNode)
       self.modelDisplayNode = self.modelNode.GetDisplayNode()
-      self.modelNode.SetAndObserveTransformNodeID(self.transformMeanNode.GetID())
-      slicer.vtkSlicerTransformLogic().hardenTransform(self.modelNode)
+      logic.warpModel(self.modelNode, self.sourceLMnumpy, self.rawMeanLandmarks)
 
       # create a PC warped model as clone of the selected model node
       shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
@@ -1687,6 +1929,12 @@ class GPAWidget(ScriptedLoadableModuleWidget):
       self.cloneModelDisplayNode.SetColor([0,0,1])
       GPANodeCollection.AddItem(self.cloneModelNode)
       visibility = self.meanLandmarkNode.GetDisplayVisibility()
+
+      # precompute the model displacement of every PC, so slider changes only combine them
+      self.meanModelPoints = np.array(slicer.util.arrayFromModelPoints(self.cloneModelNode))
+      pcWarpSpline = tps_lib.ThinPlateSpline(self.rawMeanLandmarks)
+      pcShifts = [self.LM.pcShift(pcNumber, self.sampleSizeScaleFactor) for pcNumber in range(1, self.pcNumber+1)]
+      self.pcWarpFields = pcWarpSpline.displacementBasis(self.meanModelPoints, pcShifts).astype(self.meanModelPoints.dtype)
       self.cloneLandmarkNode.SetDisplayVisibility(visibility)
 
       #Clean up
@@ -1712,15 +1960,14 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     #apply custom layout
     self.assignLayoutDescription()
 
-    # Set up transform for PCA warping
-    self.transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'PC TPS Transform')
-    GPANodeCollection.AddItem(self.transformNode)
-
     # Enable PCA warping and recording
     self.slider1.populateComboBox(self.PCList)
     self.slider2.populateComboBox(self.PCList)
     self.applyEnabled = True
     self.startRecordButton.enabled = True
+    self.sequencePCComboBox.clear()
+    self.sequencePCComboBox.addItems(self.PCList[1:])
+    self.generateSequenceButton.enabled = True
 
   def onApply(self):
     pc1=self.slider1.boxValue()
@@ -1746,58 +1993,82 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     target=self.rawMeanLandmarks+self.LM.shift
 
     if hasattr(self, 'cloneModelNode'):
-      targetLMVTK=logic.convertNumpyToVTK(target)
-      sourceLMVTK=logic.convertNumpyToVTK(self.rawMeanLandmarks)
+      # the TPS warp from the mean landmarks is linear in the landmark shift, so the warped model is the mean
+      # model plus the scaled precomputed displacement of each selected PC, written in place. The model no longer
+      # follows the transform of a generated PC sequence.
+      self.cloneModelNode.SetAndObserveTransformNodeID(None)
+      modelPoints = slicer.util.arrayFromModelPoints(self.cloneModelNode)
+      np.copyto(modelPoints, self.meanModelPoints)
+      for pcNumber, scaleFactor in zip(pcSelected, scaleFactors):
+        if pcNumber != 0 and scaleFactor != 0:
+          modelPoints += float(scaleFactor)*self.pcWarpFields[pcNumber-1]
+      slicer.util.arrayFromModelPointsModified(self.cloneModelNode)
 
-      #Set up TPS
-      VTKTPS = vtk.vtkThinPlateSplineTransform()
-      VTKTPS.SetSourceLandmarks( sourceLMVTK )
-      VTKTPS.SetTargetLandmarks( targetLMVTK )
-      VTKTPS.SetBasisToR()  # for 3D transform
-
-      #Connect transform to model
-      self.transformNode.SetAndObserveTransformToParent( VTKTPS )
-      self.cloneLandmarkNode.SetAndObserveTransformNodeID(self.transformNode.GetID())
-      self.cloneModelNode.SetAndObserveTransformNodeID(self.transformNode.GetID())
-
-    else:
-      index = 0
-      for targetLandmark in target:
-        self.cloneLandmarkNode.SetNthControlPointPositionFromArray(index,targetLandmark)
-        index+=1
+    slicer.util.updateMarkupsControlPointsFromArray(self.cloneLandmarkNode, target)
 
 
   def onStartRecording(self):
-    #set up sequences for template model and PC TPS transform
+    #set up sequences for the warped model and landmarks
     self.modelSequence=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode","GPAModelSequence")
     self.modelSequence.SetHideFromEditors(0)
     GPANodeCollection.AddItem(self.modelSequence)
-    self.transformSequence = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode","GPATFSequence")
-    self.transformSequence.SetHideFromEditors(0)
-    GPANodeCollection.AddItem(self.transformSequence)
+    self.landmarkSequence=slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode","GPALandmarkSequence")
+    self.landmarkSequence.SetHideFromEditors(0)
+    GPANodeCollection.AddItem(self.landmarkSequence)
 
     #Set up a new sequence browser and add sequences
     browserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", "GPASequenceBrowser")
     browserLogic=slicer.modules.sequences.logic()
     browserLogic.AddSynchronizedNode(self.modelSequence,self.cloneModelNode,browserNode)
-    browserLogic.AddSynchronizedNode(self.modelSequence,self.cloneLandmarkNode,browserNode)
-    browserLogic.AddSynchronizedNode(self.transformSequence,self.transformNode,browserNode)
-    browserNode.SetRecording(self.transformSequence,'true')
+    browserLogic.AddSynchronizedNode(self.landmarkSequence,self.cloneLandmarkNode,browserNode)
     browserNode.SetRecording(self.modelSequence,'true')
+    browserNode.SetRecording(self.landmarkSequence,'true')
 
     #Set up widget to record
     browserWidget=slicer.modules.sequences.widgetRepresentation()
     browserWidget.setActiveBrowserNode(browserNode)
     recordWidget = browserWidget.findChild('qMRMLSequenceBrowserPlayWidget')
     recordWidget.setRecordingEnabled(1)
-    GPANodeCollection.AddItem(self.modelSequence)
-    GPANodeCollection.AddItem(self.transformSequence)
     GPANodeCollection.AddItem(browserNode)
 
     #enable stop recording
     self.stopRecordButton.enabled = True
     self.startRecordButton.enabled = False
 
+  def onGeneratePCSequence(self):
+    pcNumber = self.sequencePCComboBox.currentIndex + 1
+    if pcNumber == 0:
+      return
+    for nodeName in ['GPA PC Sequence', 'GPA PC Sequence Landmarks', 'GPA PC Sequence Transforms', 'GPA PC Sequence Transform']:
+      temporaryNode=slicer.mrmlScene.GetFirstNodeByName(nodeName)
+      if(temporaryNode):
+        GPANodeCollection.RemoveItem(temporaryNode)
+        slicer.mrmlScene.RemoveNode(temporaryNode)
+    logic = GPALogic()
+    scaleRange = (self.sequenceMinScale.value/100.0, self.sequenceMaxScale.value/100.0)
+    pcShift = self.LM.pcShift(pcNumber, self.sampleSizeScaleFactor)
+    options = {}
+    if hasattr(self, 'cloneModelNode'):
+      options = dict(modelNode=self.cloneModelNode, meanModelPoints=self.meanModelPoints)
+    self.pcSequenceBrowserNode = logic.createPCWarpSequence('GPA PC Sequence', self.cloneLandmarkNode, self.rawMeanLandmarks,
+      pcShift, scaleRange, self.sequenceFrameCount.value, **options)
+    slicer.modules.sequences.widgetRepresentation().setActiveBrowserNode(self.pcSequenceBrowserNode)
+    self.exportVideoButton.enabled = True
+
+  def onExportPCSequenceVideo(self):
+    logic = GPALogic()
+    extensions = logic.videoFileExtensions()
+    fileFilter = ";;".join(f"{extension.upper()} (*.{extension})" for extension in extensions)
+    outputPath = qt.QFileDialog.getSaveFileName(None, "Export sequence video", "", fileFilter)
+    if not outputPath:
+      return
+    if not os.path.splitext(outputPath)[1]:
+      outputPath += "." + extensions[0]
+    try:
+      logic.exportSequenceVideo(self.pcSequenceBrowserNode, outputPath)
+    except ValueError as error:
+      slicer.util.errorDisplay(str(error))
+
   def onStopRecording(self):
     browserWidget=slicer.modules.sequences.widgetRepresentation()
     recordWidget = browserWidget.findChild('qMRMLSequenceBrowserPlayWidget')
@@ -1817,11 +2088,6 @@ class GPAWidget(ScriptedLoadableModuleWidget):
     if(temporaryNode):
       GPANodeCollection.RemoveItem(temporaryNode)
       slicer.mrmlScene.RemoveNode(temporaryNode)
-
-    temporaryNode=slicer.mrmlScene.GetFirstNodeByName('PC TPS Transform')
-    if(temporaryNode):
-      GPANodeCollection.RemoveItem(temporaryNode)
-      slicer.mrmlScene.RemoveNode(temporaryNode)
 #
 # GPALogic
 #
@@ -1872,70 +2138,325 @@ class GPALogic(ScriptedLoadableModuleLogic):
     annotationLogic = slicer.modules.annotations.logic()
     annotationLogic.CreateSnapShot(name, description, type, 1, imageData)
 
-  def loadLandmarks(self, filePathList, lmToRemove, extension):
-    # initial data array
-    if 'json' in extension:
-      import pandas
-      tempTable = pandas.DataFrame.from_dict(pandas.read_json(filePathList[0])['markups'][0]['controlPoints'])
-      landmarkNumber = len(tempTable)
-      landmarkTypeArray=[]
-      for i in range(landmarkNumber):
-        if tempTable['description'][i]=='Semi':
-          landmarkTypeArray.append(str(i+1))
-      landmarks=np.zeros(shape=(landmarkNumber,3,len(filePathList)))
-      for i in range(len(filePathList)):
-        try:
-          tmp1=pandas.DataFrame.from_dict(pandas.read_json(filePathList[i])['markups'][0]['controlPoints'])
-        except:
-          slicer.util.messageBox(f"Error: Load file {filePathList[i]} failed:.")
-          logging.debug(f"Error: Load file {filePathList[i]} failed:.")
-        if len(tmp1) == landmarkNumber:
-          lmArray = tmp1['position'].to_numpy()
-          for j in range(landmarkNumber):
-            landmarks[j,:,i]=lmArray[j]
-        else:
-          warning = f"Error: Load file {filePathList[i]} failed. There are {len(tmp1)} landmarks instead of the expected {landmarkNumber}."
-          slicer.util.messageBox(warning)
-          return
+  analysisDefaults = dict(excludedLandmarks=[], skipScaling=False, gpaMode='batch', tolerance=0.0001, maxIterations=5,
+    pcaMethod='auto', pcaComponents=None, memmap=False, chunkSize=256, useCache=False, outputFolderName=None,
+    slideSemiLandmarks=None, slidingTangents='curve', executor='thread', workers=None, workerAddresses=None,
+    authkey=None)
+
+  def runAnalysis(self, inputPaths, outputDir, options=None):
+    """
+    Run GPA + PCA on the landmark files and write the results to a new folder in outputDir, without using any
+    widgets or scene nodes. options is a dictionary overriding analysisDefaults:
+      excludedLandmarks: landmark numbers to exclude, as a list or comma separated string
+      skipScaling: do not scale specimens to unit centroid size
+      gpaMode, tolerance, maxIterations: GPA engine and convergence settings (see gpa_lib.runGPA). The 'streaming'
+        engine reads chunkSize specimens at a time on every iteration (see LMData.doStreamingGpa), the
+        'distributed' engine maps every iteration over shards of chunkSize specimens (see LMData.doDistributedGpa)
+      executor, workers, workerAddresses, authkey: executor of the distributed GPA, 'inprocess', 'thread' with
+        workers threads, 'process' with workers local processes (they must be able to import the Support package,
+        which processes spawned by Slicer cannot), or 'socket' with workers listening at the (host, port)
+        workerAddresses. Socket workers on other hosts read the landmarks from the memory-mapped array, so set
+        memmap and write the output to a shared folder. They only read it, their aligned shards are sent back and
+        written here (see gpa_distributed.distributedProcrustes)
+      pcaMethod, pcaComponents: PCA solver and number of components (see LMData.calcEigen)
+      memmap, chunkSize: store the landmark array as a memory-mapped file in the output folder and process it
+        chunkSize specimens at a time
+      useCache: use the landmark file cache
+      slideSemiLandmarks, slidingTangents: slide the semi-landmarks of the landmark files during GPA, minimizing
+        'bendingEnergy' or 'procrustesDistance' along 'curve' or 'surface' tangents (see gpa_sliding)
+      outputFolderName: name of the output folder, a date/time stamp by default. Set it when several analyses
+        are started in parallel.
+    Returns a GPAAnalysisResults. Raises ValueError if the landmark files cannot be loaded.
+    """
+    import time
+    options = dict(self.analysisDefaults, **(options or {}))
+    results = GPAAnalysisResults()
+    phaseTimes = results.phaseTimes
+    startTime = time.perf_counter()
+
+    excludedLandmarks = options['excludedLandmarks']
+    if isinstance(excludedLandmarks, str):
+      excludedLandmarks = [int(x) for x in excludedLandmarks.split(",") if x.strip()]
+    results.excludedLandmarks = list(excludedLandmarks)
+    results.skipScaling = bool(options['skipScaling'])
+    results.files = [os.path.basename(path).partition('.')[0] for path in inputPaths]
+    basename, results.extension = os.path.splitext(inputPaths[0])
+    if results.extension == '.json':
+      results.extension = os.path.splitext(basename)[1] + results.extension
+
+    # Set up output
+    folderName = options['outputFolderName'] or datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
+    outputFolder = os.path.join(outputDir, folderName)
+    LM = LMData()
+    LM.gpaMode = options['gpaMode']
+    LM.gpaTolerance = options['tolerance']
+    LM.gpaMaxIterations = options['maxIterations']
+    LM.pcaMethod = options['pcaMethod']
+    LM.pcaComponents = options['pcaComponents']
+    memmapPath = None
+    if options['memmap']:
+      os.makedirs(outputFolder, exist_ok=True)
+      memmapPath = os.path.join(outputFolder, 'landmarks.npy')
+    if options['memmap'] or LM.gpaMode in ('streaming', 'distributed'):
+      LM.chunkSize = options['chunkSize']
+
+    # Load landmarks
+    phaseStart = time.perf_counter()
+    cache = self.getLandmarkCache() if options['useCache'] else None
+    try:
+      LM.lmOrig, results.landmarkTypeArray, errors, landmarkNumber = self.readLandmarkArray(inputPaths,
+        results.excludedLandmarks, memmapPath, cache=cache)
+    finally:
+      if cache is not None:
+        cache.close()
+    if errors:
+      details = "\n".join(f"{path}: {error}" for path, error in errors)
+      raise ValueError(f"Error: {len(errors)} of {len(inputPaths)} landmark files could not be loaded.\n{details}")
+    phaseTimes['loading'] = time.perf_counter() - phaseStart
+    shape = LM.lmOrig.shape
+    print('Loaded ' + str(shape[2]) + ' subjects with ' + str(shape[0]) + ' landmark points.')
+    LM.slidingCriterion = options['slideSemiLandmarks']
+    LM.slidingTangents = options['slidingTangents']
+    LM.semiLandmarks = self.semiLandmarkIndex(results.landmarkTypeArray, landmarkNumber, results.excludedLandmarks)
+
+    # Do GPA + PCA
+    phaseStart = time.perf_counter()
+    if LM.gpaMode == 'distributed':
+      import Support.gpa_distributed as gpa_distributed
+      with gpa_distributed.makeExecutor(options['executor'], options['workers'], options['workerAddresses'],
+        options['authkey']) as LM.gpaExecutor:
+        LM.doGpa(results.skipScaling)
+      LM.gpaExecutor = None
     else:
-      landmarks, landmarkTypeArray = self.initDataArray(filePathList)
-      landmarkNumber = landmarks.shape[0]
-      for i in range(len(filePathList)):
-        tmp1=self.importLandMarks(filePathList[i])
-        if len(tmp1) == landmarkNumber:
-          landmarks[:,:,i] = tmp1
-        else:
-          warning = f"Error: Load file {filePathList[i]} failed. There are {len(tmp1)} landmarks instead of the expected {landmarkNumber}."
-          slicer.util.messageBox(warning)
-          return
-    if len(lmToRemove)>0:
-      indexToRemove=[]
-      for i in range(len(lmToRemove)):
-        indexToRemove.append(lmToRemove[i]-1)
-      landmarks=np.delete(landmarks,indexToRemove,axis=0)
+      LM.doGpa(results.skipScaling)
+    phaseTimes['gpa'] = time.perf_counter() - phaseStart
+    phaseStart = time.perf_counter()
+    LM.calcEigen()
+    phaseTimes['pca'] = time.perf_counter() - phaseStart
+    results.LM = LM
+
+    #set scaling factor using mean of landmarks
+    results.rawMeanLandmarks = gpa_lib.meanShape(LM.lmOrig, LM.chunkSize)
+    results.sampleSizeScaleFactor = gpa_lib.maximumDistance(results.rawMeanLandmarks)
+    print("Scale Factor: " + str(results.sampleSizeScaleFactor))
+
+    # Write output
+    phaseStart = time.perf_counter()
+    try:
+      os.makedirs(outputFolder, exist_ok=True)
+      LM.writeOutData(outputFolder, results.files)
+      phaseTimes['output'] = time.perf_counter() - phaseStart
+      phaseTimes['total'] = time.perf_counter() - startTime
+      inputPath = os.path.dirname(inputPaths[0])
+      self.writeAnalysisLogFile(inputPath, outputFolder, results.files, LM, results.extension, results.excludedLandmarks,
+        results.skipScaling, results.landmarkTypeArray, phaseTimes)
+      results.outputFolder = outputFolder
+    except OSError:
+      logging.debug('Result directory failed: Could not access output folder')
+      print("Error creating result directory")
+      phaseTimes['total'] = time.perf_counter() - startTime
+    return results
+
+  def writeAnalysisLogFile(self, inputPath, outputPath, files, LM, extension, excludedLandmarks, skipScaling,
+    landmarkTypeArray, phaseTimes=None):
+    # generate log file
+    logFile = open(outputPath+os.sep+"analysis.log","w")
+    logFile.write("Date=" + datetime.now().strftime('%Y-%m-%d') + "\n")
+    logFile.write("Time=" + datetime.now().strftime('%H:%M:%S') + "\n")
+    logFile.write("InputPath=" + inputPath + "\n")
+    logFile.write("OutputPath=" + outputPath.replace("\\","/") + "\n")
+    logFile.write("Files=")
+    for i in range(len(files)-1):
+      logFile.write(files[i] + extension + ",")
+    logFile.write(files[len(files)-1] + extension + "\n")
+    logFile.write("LM_format="  + extension + "\n")
+    [pointNumber, dim, subjectNumber] = LM.lmOrig.shape
+    totalLandmarks = pointNumber + len(excludedLandmarks)
+    logFile.write("NumberLM=" + str(totalLandmarks) + "\n")
+    logFile.write("ExcludedLM=")
+    exclusions = ",".join(map(str, excludedLandmarks))
+    logFile.write(exclusions + "\n")
+    logFile.write("Scale=" + str(not skipScaling) + "\n")
+    logFile.write("SlideSemiLandmarks=" + str(LM.slidingCriterion) + "\n")
+    convergence = LM.convergence
+    if convergence is not None:
+      logFile.write("GPAMode=" + convergence['mode'] + "\n")
+      logFile.write("GPATolerance=" + str(convergence['tolerance']) + "\n")
+      logFile.write("GPAMaxIterations=" + str(convergence['maxIterations']) + "\n")
+      logFile.write("GPAIterations=" + str(convergence['iterations']) + "\n")
+      logFile.write("GPAConverged=" + str(convergence['converged']) + "\n")
+      logFile.write("GPAMeanShapeDelta=" + ",".join(map(str, convergence['meanShapeDelta'])) + "\n")
+      times = [f"{phase}:{seconds:.4f}" for phase, seconds in convergence['phaseTimes'].items()]
+      logFile.write("GPAPhaseTimes=" + ",".join(times) + "\n")
+    if phaseTimes:
+      times = [f"{phase}:{seconds:.4f}" for phase, seconds in phaseTimes.items()]
+      logFile.write("AnalysisPhaseTimes=" + ",".join(times) + "\n")
+    logFile.write("MeanShape=MeanShape.csv"+ "\n")
+    logFile.write("eigenvalues=eigenvalues.csv" + "\n")
+    logFile.write("eigenvectors=eigenvectors.csv" + "\n")
+    logFile.write("OutputData=OutputData.csv" + "\n")
+    logFile.write("pcScores=pcScores.csv" + "\n")
+    logFile.write("ResultsBundle=" + LMData.bundleFileName + "\n")
+    landmarkType_list = ",".join(landmarkTypeArray)
+    logFile.write("SemiLandmarks= " + landmarkType_list)
+    logFile.close()
+
+  def loadLandmarks(self, filePathList, lmToRemove, extension, memmapPath=None, useCache=False):
+    """
+    Returns a landmarks x 3 x subjects array of the landmark files and the list of semi-landmark numbers.
+    If memmapPath is set, the array is stored as a memory-mapped .npy file at that path instead of in memory.
+    If useCache is set, parsed files are kept in the landmark cache so they are not parsed again.
+    Files that cannot be read are reported together in a single message and None is returned.
+    """
+    cache = self.getLandmarkCache() if useCache else None
+    try:
+      landmarks, landmarkTypeArray, errors, landmarkNumber = self.readLandmarkArray(filePathList, lmToRemove, memmapPath,
+        cache=cache)
+    finally:
+      if cache is not None:
+        cache.close()
+    if errors:
+      message = f"Error: {len(errors)} of {len(filePathList)} landmark files could not be loaded."
+      details = "\n".join(f"{path}: {error}" for path, error in errors)
+      logging.debug(message + "\n" + details)
+      slicer.util.errorDisplay(message, detailedText=details)
+      return
     return landmarks, landmarkTypeArray
 
-  def importLandMarks(self, filePath):
-    """Imports the landmarks from file. Does not import sample if a  landmark is -1000
-    Adjusts the resolution is log(nhrd) file is found returns kXd array of landmark data. k=# of landmarks d=dimension
+  def readLandmarkArray(self, filePathList, lmToRemove, memmapPath=None, workers=None, cache=None):
     """
-    # import data file
-    datafile=open(filePath)
-    data=[]
-    for row in datafile:
-      if not fnmatch.fnmatch(row[0],"#*"):
-        data.append(row.strip().split(','))
-    # Make Landmark array
-    dataArray=np.zeros(shape=(len(data),3))
-    j=0
-    sorter=[]
-    for i in data:
-      tmp=np.array(i)[1:4]
-      dataArray[j,0:3]=tmp
+    Parse the landmark files in a thread pool and fill the landmarks x 3 x subjects array.
+    Does not require the GUI. Returns the array, the list of semi-landmark numbers, a list of
+    (file path, error message) for every file that could not be loaded and the number of landmarks in the files
+    before removing lmToRemove.
+    """
+    import Support.landmark_io as landmark_io
+    errors = []
+    landmarks = None
+    for index, points, descriptions, error in landmark_io.iterLandmarkFiles(filePathList, workers, cache=cache):
+      if error is None and landmarks is None:
+        # the first readable file defines the landmark number and types
+        landmarkNumber = len(points)
+        landmarkTypeArray = landmark_io.semiLandmarkNumbers(descriptions)
+        keepIndex = self.keptLandmarkIndex(landmarkNumber, lmToRemove)
+        landmarks = self.allocateLandmarkArray((len(keepIndex),3,len(filePathList)), memmapPath)
+      if error is not None:
+        errors.append((filePathList[index], error))
+      elif len(points) != landmarkNumber:
+        errors.append((filePathList[index], f"There are {len(points)} landmarks instead of the expected {landmarkNumber}."))
+      else:
+        landmarks[:,:,index] = points[keepIndex]
+    if landmarks is None:
+      return None, [], errors, 0
+    if isinstance(landmarks, np.memmap):
+      landmarks.flush()
+    return landmarks, landmarkTypeArray, errors, landmarkNumber
+
+  def readAnalysisLogOptions(self, resultsDirectory):
+    """
+    Returns the skip scaling option and the list of excluded landmarks recorded in the analysis.log of a results
+    directory, or the defaults if the log cannot be read
+    """
+    skipScaling = False
+    excludedLandmarks = []
+    logFilePath = os.path.join(resultsDirectory, 'analysis.log')
+    try:
+      with open(logFilePath) as f:
+        for search in f:
+          if 'Scale=False' in search:
+            skipScaling = True
+          if 'ExcludedLM' in search:
+            line = search.rstrip()
+            header, skippedText = line.split('=')
+            if skippedText != '':
+              excludedLandmarks = [int(i) for i in skippedText.split(',')]
+    except:
+      logging.debug('Log import failed: Cannot read scaling option from log file')
+      logging.debug('Log import failed: Cannot read skipped landmarks from log file')
+    return skipScaling, excludedLandmarks
 
-      x=np.array(i).shape
-      j=j+1
-    slicer.app.processEvents()
+  def addSpecimensToAnalysis(self, resultsDirectory, filePathList, lmToRemove, skipScaling, outputFolder, memmapPath=None,
+    useCache=False, driftThreshold=None):
+    """
+    Add the landmark files to the analysis stored in the results bundle of resultsDirectory without re-running it
+    (see LMData.addSpecimens) and write the updated analysis to outputFolder, together with specimenChanges.csv
+    listing the coordinate and PC score change of every existing specimen.
+    Returns the updated LMData, the list of semi-landmark numbers and the change report, or None on failure.
+    """
+    bundlePath = os.path.join(resultsDirectory, LMData.bundleFileName)
+    LM = LMData()
+    if not os.path.exists(bundlePath) or not LM.initializeFromBundle(bundlePath):
+      slicer.util.errorDisplay(f"Adding specimens requires the {LMData.bundleFileName} results bundle of the previous analysis.")
+      return
+    os.makedirs(outputFolder, exist_ok=True)
+    loaded = self.loadLandmarks(filePathList, lmToRemove, None, useCache=useCache)
+    if loaded is None:
+      return
+    newLandmarks, landmarkTypeArray = loaded
+    i, j, k = LM.lm.shape
+    if newLandmarks.shape[0] != i:
+      slicer.util.errorDisplay(f"Error: The landmark files have {newLandmarks.shape[0]} landmarks instead of the expected {i}.")
+      return
+    if driftThreshold is not None:
+      LM.driftThreshold = driftThreshold
+    landmarkArray = None
+    if memmapPath is not None:
+      LM.chunkSize = LM.chunkSize or 256
+      landmarkArray = self.allocateLandmarkArray((i, j, k+newLandmarks.shape[2]), memmapPath)
+    report = LM.addSpecimens(newLandmarks, skipScaling, landmarkArray)
+    existingFiles = LM.files
+    LM.files = existingFiles + [os.path.basename(path).partition('.')[0] for path in filePathList]
+    LM.writeOutData(outputFolder, LM.files)
+    with open(os.path.join(outputFolder, 'specimenChanges.csv'), 'w') as outputFile:
+      gpa_lib.writeCSVHeader(outputFile, ['Sample_name', 'coordinate_change', 'score_change'])
+      gpa_lib.writeCSVRows(outputFile, np.column_stack((report['coordinateChange'], report['scoreChange'])), existingFiles)
+    action = "re-ran GPA + PCA" if report['recomputed'] else "updated mean shape and PCA incrementally"
+    print(f"Added {report['added']} specimens, mean shape drift {report['meanShapeDrift']:.3g}, {action}")
+    print(f"Largest change of an existing specimen: coordinates {report['coordinateChange'].max():.3g}, "
+      f"PC scores {report['scoreChange'].max():.3g}")
+    return LM, landmarkTypeArray, report
+
+  def getLandmarkCache(self):
+    """
+    Returns the cache of parsed landmark files, stored in the Slicer cache directory.
+    The maximum size in MB is read from the SlicerMorph/GPALandmarkCacheMaxSizeMB application setting.
+    """
+    import Support.landmark_cache as landmark_cache
+    cachePath = os.path.join(slicer.app.cachePath, 'SlicerMorph', 'GPALandmarkCache.sqlite')
+    maxSizeMB = int(qt.QSettings().value('SlicerMorph/GPALandmarkCacheMaxSizeMB', 512))
+    return landmark_cache.LandmarkCache(cachePath, maxSizeMB*1024*1024)
+
+  def clearLandmarkCache(self):
+    cache = self.getLandmarkCache()
+    cache.clear()
+    cache.close()
+
+  def keptLandmarkIndex(self, landmarkNumber, lmToRemove):
+    """
+    Zero based indices of the landmarks remaining after removing the (one based) landmark numbers in lmToRemove
+    """
+    indexToRemove = [lm-1 for lm in lmToRemove]
+    return np.setdiff1d(np.arange(landmarkNumber), indexToRemove)
+
+  def semiLandmarkIndex(self, landmarkTypeArray, landmarkNumber, lmToRemove):
+    """
+    Zero based indices, into the landmarks remaining after removing lmToRemove from the landmarkNumber landmarks of
+    the files, of the (one based) semi-landmark numbers in landmarkTypeArray. Removed semi-landmarks are skipped.
+    """
+    keepIndex = self.keptLandmarkIndex(landmarkNumber, lmToRemove)
+    semiIndex = [int(number)-1 for number in landmarkTypeArray]
+    return np.flatnonzero(np.isin(keepIndex, semiIndex))
+
+  def allocateLandmarkArray(self, shape, memmapPath=None):
+    if memmapPath is None:
+      return np.zeros(shape=shape)
+    return np.lib.format.open_memmap(memmapPath, mode='w+', dtype=np.float64, shape=shape)
+
+  def importLandMarks(self, filePath):
+    """Imports the landmarks from a .fcsv file, returns kXd array of landmark data. k=# of landmarks d=dimension
+    """
+    import Support.landmark_io as landmark_io
+    dataArray, descriptions = landmark_io.readFCSV(filePath)
     return dataArray
 
   def initDataArray(self, files):
@@ -1964,73 +2485,44 @@ class GPALogic(ScriptedLoadableModuleLogic):
     Returns a nXnXk matrix
     """
     id,jd,kd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1,kd))
-    dx=fnx(a[:,0,:])
-    dy=fnx(a[:,1,:])
-    dz=fnx(a[:,2,:])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
+    distances=np.zeros((id,id,kd))
+    for x in range(kd):
+      distances[:,:,x]=gpa_lib.distanceMatrix(a[:,:,x])
+    return distances
 
   def dist2(self, a):
     """
     Computes the euclidean distance matrix for n points in a 3D space
     Returns a nXn matrix
      """
-    id,jd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1))
-    dx=fnx(a[:,0])
-    dy=fnx(a[:,1])
-    dz=fnx(a[:,2])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
+    return gpa_lib.distanceMatrix(a)
 
   #plotting functions
 
   def makeScatterPlotWithFactors(self, data, files, factors,title,xAxis,yAxis,pcNumber):
-    #create two tables for the first two factors and then check for a third
-    #check if there is a table node has been created
-    numPoints = len(data)
-    uniqueFactors, factorCounts = np.unique(factors, return_counts=True)
-    factorNumber = len(uniqueFactors)
+    # one table per factor level holding the scores of all PCs, the series only select the X and Y columns
+    uniqueFactors, factorIndices = np.unique(factors, return_inverse=True)
 
     #Set up chart
-    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov" + xAxis + "v" +yAxis)
+    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA_cov")
     if plotChartNode is None:
-      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov" + xAxis + "v" +yAxis)
+      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA_cov")
       GPANodeCollection.AddItem(plotChartNode)
     else:
       plotChartNode.RemoveAllPlotSeriesNodeIDs()
 
     # Plot all series
+    files = np.asarray(files)
     for factorIndex in range(len(uniqueFactors)):
       factor = uniqueFactors[factorIndex]
       tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table Factor ' + factor)
       if tableNode is None:
         tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table Factor ' + factor)
         GPANodeCollection.AddItem(tableNode)
-      else:
-        tableNode.RemoveAllColumns()    #clear previous data from columns
-
-      # Set up columns for X,Y, and labels
-      labels=tableNode.AddColumn()
-      labels.SetName('Subject ID')
-      tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-      for i in range(pcNumber):
-        pc=tableNode.AddColumn()
-        colName="PC" + str(i+1)
-        pc.SetName(colName)
-        tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-      factorCounter=0
-      table = tableNode.GetTable()
-      table.SetNumberOfRows(factorCounts[factorIndex])
-      for i in range(numPoints):
-        if (factors[i] == factor):
-          table.SetValue(factorCounter, 0,files[i])
-          for j in range(pcNumber):
-            table.SetValue(factorCounter, j+1, data[i,j])
-          factorCounter+=1
-
-      plotSeriesNode=slicer.mrmlScene.GetFirstNodeByName("Series_PCA_" + factor + "_" + xAxis + "v" +yAxis)
+      factorMembers = factorIndices == factorIndex
+      vtk_lib.setScoreTable(tableNode, files[factorMembers], data[factorMembers], pcNumber)
+
+      plotSeriesNode=slicer.mrmlScene.GetFirstNode(factor, "vtkMRMLPlotSeriesNode")
       if plotSeriesNode is None:
         plotSeriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode", factor)
         GPANodeCollection.AddItem(plotSeriesNode)
@@ -2066,34 +2558,17 @@ class GPALogic(ScriptedLoadableModuleLogic):
     plotViewNode.SetPlotChartNodeID(plotChartNode.GetID())
 
   def makeScatterPlot(self, data, files, title,xAxis,yAxis,pcNumber):
-    numPoints = len(data)
-    #check if there is a table node has been created
+    # the table holds the scores of all PCs, the series only selects the X and Y columns
     tableNode=slicer.mrmlScene.GetFirstNodeByName('PCA Scatter Plot Table')
     if tableNode is None:
       tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'PCA Scatter Plot Table')
       GPANodeCollection.AddItem(tableNode)
+    vtk_lib.setScoreTable(tableNode, files, data, pcNumber)
 
-      #set up columns for X,Y, and labels
-      labels=tableNode.AddColumn()
-      labels.SetName('Subject ID')
-      tableNode.SetColumnType('Subject ID',vtk.VTK_STRING)
-
-      for i in range(pcNumber):
-        pc=tableNode.AddColumn()
-        colName="PC" + str(i+1)
-        pc.SetName(colName)
-        tableNode.SetColumnType(colName, vtk.VTK_FLOAT)
-
-      table = tableNode.GetTable()
-      table.SetNumberOfRows(numPoints)
-      for i in range(numPoints):
-        table.SetValue(i, 0,files[i])
-        for j in range(pcNumber):
-            table.SetValue(i, j+1, data[i,j])
-
-    plotSeriesNode1=slicer.mrmlScene.GetFirstNodeByName("Series_PCA" + xAxis + "v" +yAxis)
+    plotSeriesNode1=slicer.mrmlScene.GetFirstNodeByName("Series_PCA")
     if plotSeriesNode1 is None:
-      plotSeriesNode1 = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode", "Series_PCA" + xAxis + "v" +yAxis)
+      plotSeriesNode1 = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode", "Series_PCA")
+      plotSeriesNode1.SetUniqueColor()
       GPANodeCollection.AddItem(plotSeriesNode1)
 
     plotSeriesNode1.SetAndObserveTableNodeID(tableNode.GetID())
@@ -2103,12 +2578,13 @@ class GPALogic(ScriptedLoadableModuleLogic):
     plotSeriesNode1.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
     plotSeriesNode1.SetLineStyle(slicer.vtkMRMLPlotSeriesNode.LineStyleNone)
     plotSeriesNode1.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleSquare)
-    plotSeriesNode1.SetUniqueColor()
 
-    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA" + xAxis + "v" +yAxis)
+    plotChartNode=slicer.mrmlScene.GetFirstNodeByName("Chart_PCA")
     if plotChartNode is None:
-      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_" + xAxis + "v" +yAxis)
+      plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode", "Chart_PCA")
       GPANodeCollection.AddItem(plotChartNode)
+    else:
+      plotChartNode.RemoveAllPlotSeriesNodeIDs()
 
     plotChartNode.AddAndObservePlotSeriesNodeID(plotSeriesNode1.GetID())
     plotChartNode.SetTitle('PCA Scatter Plot ')
@@ -2212,37 +2688,210 @@ class GPALogic(ScriptedLoadableModuleLogic):
     return LM+tmp*scaleFactor/3.0
 
   def convertFudicialToVTKPoint(self, fnode):
-    import numpy as np
-    numberOfLM=fnode.GetNumberOfFiducials()
-    x=y=z=0
-    loc=[x,y,z]
-    lmData=np.zeros((numberOfLM,3))
-    for i in range(numberOfLM):
-      fnode.GetNthFiducialPosition(i,loc)
-      lmData[i,:]=np.asarray(loc)
-    points=vtk.vtkPoints()
-    for i in range(numberOfLM):
-      points.InsertNextPoint(lmData[i,0], lmData[i,1], lmData[i,2])
-    return points
+    return vtk_lib.markupsToVTKPoints(fnode)
 
   def convertFudicialToNP(self, fnode):
-    import numpy as np
-    numberOfLM=fnode.GetNumberOfFiducials()
-    x=y=z=0
-    loc=[x,y,z]
-    lmData=np.zeros((numberOfLM,3))
-
-    for i in range(numberOfLM):
-      fnode.GetNthFiducialPosition(i,loc)
-      lmData[i,:]=np.asarray(loc)
-    return lmData
+    return vtk_lib.markupsToNumpy(fnode)
 
   def convertNumpyToVTK(self, A):
-    x,y=A.shape
-    points=vtk.vtkPoints()
-    for i in range(x):
-      points.InsertNextPoint(A[i,0], A[i,1], A[i,2])
-    return points
+    return vtk_lib.numpyToVTKPoints(A)
+
+  def warpModel(self, modelNode, sourceLandmarks, targetLandmarks):
+    """
+    Warp the model points in place with the thin plate spline from the source to the target landmarks (see
+    tps_lib), the equivalent of hardening a vtkThinPlateSplineTransform with SetBasisToR. Point normals, if any,
+    are recomputed for the warped surface without splitting points, so the point order is kept.
+    """
+    modelPoints = slicer.util.arrayFromModelPoints(modelNode)
+    spline = tps_lib.ThinPlateSpline(sourceLandmarks)
+    modelPoints[:] = spline.transformPoints(modelPoints, targetLandmarks)
+    slicer.util.arrayFromModelPointsModified(modelNode)
+    polyData = modelNode.GetPolyData()
+    if polyData.GetPointData().GetNormals() is not None:
+      normals = vtk.vtkPolyDataNormals()
+      normals.SetInputData(polyData)
+      normals.SplittingOff()
+      normals.ConsistencyOff()
+      normals.Update()
+      polyData.GetPointData().SetNormals(normals.GetOutput().GetPointData().GetNormals())
+      modelNode.Modified()
+
+  def pcWarpFrames(self, meanLandmarks, pcShift, scaleRange, frameCount):
+    """
+    Scale factors of frameCount frames spanning scaleRange and the landmarks warped along the PC landmark shift
+    (see LMData.pcShift) for every frame, as a (frames x landmarks x 3) array
+    """
+    scaleFactors = np.linspace(scaleRange[0], scaleRange[1], frameCount)
+    return scaleFactors, meanLandmarks[np.newaxis] + scaleFactors[:,np.newaxis,np.newaxis]*pcShift[np.newaxis]
+
+  def createPCWarpSequence(self, name, landmarkNode, meanLandmarks, pcShift, scaleRange, frameCount, modelNode=None,
+    meanModelPoints=None):
+    """
+    Sequence of the landmarks warped along a PC, generated offline, with a browser node playing it on landmarkNode.
+    The sequence index is the PC scale factor of each frame. If a model node is given, its points are reset to the
+    mean model points and it observes the proxy of a second synchronized sequence holding, for every frame, the thin
+    plate spline transform from the mean landmarks to the warped landmarks. Only landmarks are stored per frame, the
+    model is never copied, and the sequences replay on their own in a saved scene or another browser.
+    Returns the browser node.
+    """
+    scaleFactors, landmarkFrames = self.pcWarpFrames(meanLandmarks, pcShift, scaleRange, frameCount)
+    sequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", name + " Landmarks")
+    sequenceNode.SetIndexName("PC scale")
+    sequenceNode.SetIndexType(slicer.vtkMRMLSequenceNode.NumericIndex)
+    labels = [landmarkNode.GetNthControlPointLabel(index) for index in range(landmarkNode.GetNumberOfControlPoints())]
+    frameNode = slicer.vtkMRMLMarkupsFiducialNode()
+    for scaleFactor, landmarks in zip(scaleFactors, landmarkFrames):
+      vtk_lib.setMarkupsControlPoints(frameNode, landmarks, labels)
+      sequenceNode.SetDataNodeAtValue(frameNode, f"{scaleFactor:g}")
+
+    browserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", name)
+    sequencesLogic = slicer.modules.sequences.logic()
+    sequencesLogic.AddSynchronizedNode(sequenceNode, landmarkNode, browserNode)
+    browserNode.SetSaveChanges(sequenceNode, False)
+    browserNode.SetPlaybackRateFps(30)
+    browserNode.SetPlaybackItemSkippingEnabled(False)
+    browserNode.SetPlaybackLooped(True)
+    GPANodeCollection.AddItem(sequenceNode)
+    GPANodeCollection.AddItem(browserNode)
+
+    if modelNode is not None:
+      if meanModelPoints is not None:
+        modelPoints = slicer.util.arrayFromModelPoints(modelNode)
+        np.copyto(modelPoints, meanModelPoints)
+        slicer.util.arrayFromModelPointsModified(modelNode)
+      transformSequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", name + " Transforms")
+      transformSequenceNode.SetIndexName("PC scale")
+      transformSequenceNode.SetIndexType(slicer.vtkMRMLSequenceNode.NumericIndex)
+      sourceLandmarks = vtk_lib.numpyToVTKPoints(meanLandmarks)
+      frameTransformNode = slicer.vtkMRMLTransformNode()
+      for scaleFactor, landmarks in zip(scaleFactors, landmarkFrames):
+        transform = vtk.vtkThinPlateSplineTransform()
+        transform.SetBasisToR()
+        transform.SetSourceLandmarks(sourceLandmarks)
+        transform.SetTargetLandmarks(vtk_lib.numpyToVTKPoints(landmarks))
+        frameTransformNode.SetAndObserveTransformToParent(transform)
+        transformSequenceNode.SetDataNodeAtValue(frameTransformNode, f"{scaleFactor:g}")
+      transformNode = sequencesLogic.AddSynchronizedNode(transformSequenceNode, None, browserNode)
+      transformNode.SetName(name + " Transform")
+      browserNode.SetSaveChanges(transformSequenceNode, False)
+      modelNode.SetAndObserveTransformNodeID(transformNode.GetID())
+      GPANodeCollection.AddItem(transformSequenceNode)
+      GPANodeCollection.AddItem(transformNode)
+    browserNode.SetSelectedItemNumber(0)
+    return browserNode
+
+  def videoFileExtensions(self):
+    """
+    File extensions of the ScreenCapture video format presets, in preset order
+    """
+    from ScreenCapture import ScreenCaptureLogic
+    extensions = []
+    for videoFormatPreset in ScreenCaptureLogic().videoFormatPresets:
+      if videoFormatPreset["fileExtension"] not in extensions:
+        extensions.append(videoFormatPreset["fileExtension"])
+    return extensions
+
+  def renderSequenceFrames(self, browserNode, outputFolder, filePattern, size=(1024, 768)):
+    """
+    Render every item of the sequence browser offscreen to PNG files named filePattern % item in outputFolder,
+    without any view widget, so it also works without a main window. Rendered are the markups proxy nodes of the
+    browser and the visible model nodes that are proxies of the browser or observe one of its transform proxies.
+    The camera is fit to the first item and kept for all items.
+    """
+    proxyCollection = vtk.vtkCollection()
+    browserNode.GetAllProxyNodes(proxyCollection)
+    proxyNodes = [proxyCollection.GetItemAsObject(index) for index in range(proxyCollection.GetNumberOfItems())]
+    proxyIDs = set(node.GetID() for node in proxyNodes)
+    modelNodes = [node for node in slicer.util.getNodesByClass('vtkMRMLModelNode') if node.GetDisplayVisibility()
+      and node.GetPolyData() is not None and (node.GetID() in proxyIDs or node.GetTransformNodeID() in proxyIDs)]
+    markupsNodes = [node for node in proxyNodes if node.IsA('vtkMRMLMarkupsNode')]
+
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(1, 1, 1)
+    renderWindow = vtk.vtkRenderWindow()
+    renderWindow.SetOffScreenRendering(1)
+    renderWindow.SetSize(*size)
+    renderWindow.AddRenderer(renderer)
+    def addActor(algorithm, color):
+      mapper = vtk.vtkPolyDataMapper()
+      mapper.SetInputConnection(algorithm.GetOutputPort())
+      actor = vtk.vtkActor()
+      actor.SetMapper(mapper)
+      actor.GetProperty().SetColor(color)
+      renderer.AddActor(actor)
+    modelTransforms = []
+    for modelNode in modelNodes:
+      transform = vtk.vtkGeneralTransform()
+      transformFilter = vtk.vtkTransformPolyDataFilter()
+      transformFilter.SetInputData(modelNode.GetPolyData())
+      transformFilter.SetTransform(transform)
+      addActor(transformFilter, modelNode.GetDisplayNode().GetColor() if modelNode.GetDisplayNode() else (0.8, 0.8, 0.8))
+      modelTransforms.append((modelNode, transform, transformFilter))
+    landmarkPolyData = []
+    for markupsNode in markupsNodes:
+      polyData = vtk.vtkPolyData()
+      sphere = vtk.vtkSphereSource()
+      glyphs = vtk.vtkGlyph3D()
+      glyphs.SetInputData(polyData)
+      glyphs.SetSourceConnection(sphere.GetOutputPort())
+      addActor(glyphs, markupsNode.GetDisplayNode().GetSelectedColor() if markupsNode.GetDisplayNode() else (1, 0, 0))
+      landmarkPolyData.append((markupsNode, polyData, sphere))
+
+    windowToImage = vtk.vtkWindowToImageFilter()
+    windowToImage.SetInput(renderWindow)
+    writer = vtk.vtkPNGWriter()
+    writer.SetInputConnection(windowToImage.GetOutputPort())
+    for item in range(browserNode.GetNumberOfItems()):
+      browserNode.SetSelectedItemNumber(item)
+      for modelNode, transform, transformFilter in modelTransforms:
+        transform.Identity()
+        slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(modelNode.GetParentTransformNode(), None, transform)
+        transformFilter.Modified()
+      for markupsNode, polyData, sphere in landmarkPolyData:
+        points = vtk_lib.markupsToNumpy(markupsNode)
+        polyData.SetPoints(vtk_lib.numpyToVTKPoints(points))
+        if item == 0 and len(points):
+          sphere.SetRadius(0.01*np.linalg.norm(points.max(axis=0) - points.min(axis=0)))
+        polyData.Modified()
+      if item == 0:
+        renderer.ResetCamera()
+      renderWindow.Render()
+      windowToImage.Modified()
+      writer.SetFileName(os.path.join(outputFolder, filePattern % item))
+      writer.Write()
+    renderWindow.Finalize()
+
+  def exportSequenceVideo(self, browserNode, outputPath, frameRate=30, viewNode=None):
+    """
+    Render every item of the sequence browser and encode them as a video with ScreenCapture. Items are captured
+    from a 3D view (the first one by default) when Slicer has a main window, otherwise they are rendered offscreen
+    (see renderSequenceFrames), so this can run from a script with --no-main-window.
+    The video format is the first ScreenCapture preset with the extension of outputPath.
+    Raises ValueError if no preset has that extension or ffmpeg is not configured.
+    """
+    from ScreenCapture import ScreenCaptureLogic
+    captureLogic = ScreenCaptureLogic()
+    videoFormat = None
+    for videoFormatPreset in captureLogic.videoFormatPresets:
+      if outputPath.endswith("." + videoFormatPreset["fileExtension"]):
+        videoFormat = videoFormatPreset
+        break
+    if videoFormat is None:
+      extensions = ", ".join("." + extension for extension in self.videoFileExtensions())
+      raise ValueError(f"Unsupported video file extension of {outputPath}, expected one of {extensions}")
+    if not captureLogic.isFfmpegPathValid():
+      raise ValueError("ffmpeg was not found. Set the ffmpeg executable path in the Screen Capture module to export videos.")
+    frameCount = browserNode.GetNumberOfItems()
+    tempDir = qt.QTemporaryDir()
+    filePattern = "GPA-%04d.png"
+    layoutManager = slicer.app.layoutManager()
+    if viewNode is None and layoutManager is None:
+      self.renderSequenceFrames(browserNode, tempDir.path(), filePattern)
+    else:
+      if viewNode is None:
+        viewNode = layoutManager.threeDWidget(0).threeDView().mrmlViewNode()
+      captureLogic.captureSequence(viewNode, browserNode, 0, frameCount-1, frameCount, tempDir.path(), filePattern)
+    captureLogic.createVideo(frameRate, videoFormat["extraVideoOptions"], tempDir.path(), filePattern, outputPath)
 
   def convertNumpyToVTKmatrix44(self, A):
     x,y=A.shape
@@ -2309,6 +2958,42 @@ class GPATest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_GPA1()
+    self.setUp()
+    self.test_BatchGPA()
+    self.setUp()
+    self.test_SVDPCA()
+    self.setUp()
+    self.test_RandomizedPCA()
+    self.setUp()
+    self.test_ResultsBundle()
+    self.setUp()
+    self.test_AddSpecimens()
+    self.setUp()
+    self.test_VectorizedStatistics()
+    self.setUp()
+    self.test_StreamingGPA()
+    self.setUp()
+    self.test_PointConversion()
+    self.setUp()
+    self.test_DistributedGPA()
+    self.setUp()
+    self.test_ResamplingExecutors()
+    self.setUp()
+    self.test_TPSWarp()
+    self.setUp()
+    self.test_SemiLandmarkSliding()
+    self.setUp()
+    self.test_PCWarpSequence()
+    self.setUp()
+    self.test_LandmarkLoader()
+    self.setUp()
+    self.test_LandmarkCache()
+    self.setUp()
+    self.test_RunAnalysis()
+    self.setUp()
+    self.test_DistanceFunctions()
+    self.setUp()
+    self.test_CSVOutput()
 
   def test_GPA1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -2355,3 +3040,854 @@ class GPATest(ScriptedLoadableModuleTest):
     self.assertEqual(outputScalarRange[1], inputScalarRange[1])
 
     self.delayDisplay('Test passed')
+
+  def test_BatchGPA(self):
+    """ Compare the batched Procrustes engine with the per-specimen loop, with and without scaling and chunking.
+    """
+    self.delayDisplay("Starting the batch GPA test")
+    import time
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(50,3,1))*10 + rng.normal(size=(50,3,300))
+    for scale in (True, False):
+      runGPA = gpa_lib.runGPA if scale else gpa_lib.runGPANoScale
+      startTime = time.time()
+      loopAligned, loopMeanShape, loopConvergence = runGPA(np.array(landmarks), mode='loop', maxIterations=10)
+      loopTime = time.time() - startTime
+      for chunkSize in (None, 64):
+        startTime = time.time()
+        aligned, meanShape, convergence = runGPA(np.array(landmarks), mode='batch', maxIterations=10, chunkSize=chunkSize)
+        logging.info(f'GPA scale={scale} chunkSize={chunkSize}: {loopTime:.3f}s loop, {time.time() - startTime:.3f}s batch')
+        np.testing.assert_allclose(aligned, loopAligned, atol=1e-14)
+        np.testing.assert_allclose(meanShape, loopMeanShape, atol=1e-14)
+        self.assertEqual(convergence['iterations'], loopConvergence['iterations'])
+    self.delayDisplay('Test passed')
+
+  def test_SVDPCA(self):
+    """ Compare the thin SVD PCA of LMData.calcEigen with the eigendecomposition of the covariance matrix, for fewer
+    and for more specimens than coordinates.
+    """
+    self.delayDisplay("Starting the SVD PCA test")
+    import time
+    rng = np.random.default_rng(0)
+    for specimenNumber in (50, 200):
+      landmarks = rng.normal(size=(30,3,1))*10 + rng.normal(size=(30,3,specimenNumber))*rng.uniform(0.1, 2, (30,3,1))
+      LM = LMData()
+      LM.lm, meanShape, convergence = gpa_lib.runGPA(landmarks, maxIterations=10)
+      LM.lmOrig = LM.lm
+      results = {}
+      for method in ('eigh', 'svd'):
+        LM.pcaMethod = method
+        startTime = time.time()
+        LM.calcEigen()
+        logging.info(f'{method} PCA of {specimenNumber} specimens: {time.time() - startTime:.3f}s')
+        results[method] = (np.real(LM.val), np.real(LM.vec), LM.totalVariance)
+      (eighVal, eighVec, eighTotal), (svdVal, svdVec, svdTotal) = results['eigh'], results['svd']
+      self.assertEqual(svdVec.shape, eighVec.shape)
+      # the aligned coordinates span at most specimens-1 and coordinates-7 dimensions, compare the leading components
+      components = 20
+      np.testing.assert_allclose(svdVal[:components], eighVal[:components], rtol=1e-10)
+      np.testing.assert_allclose(gpa_lib.matchEigenvectorSigns(eighVec, svdVec)[:,:components], eighVec[:,:components], atol=1e-8)
+      np.testing.assert_allclose(svdTotal, eighTotal, rtol=1e-10)
+    self.delayDisplay('Test passed')
+
+  def test_RandomizedPCA(self):
+    """ Compare the leading components of the randomized truncated PCA with the full SVD PCA, and the percent
+    variance computed from the truncated spectrum.
+    """
+    self.delayDisplay("Starting the randomized PCA test")
+    import time
+    rng = np.random.default_rng(0)
+    # a few dominant modes of variation on top of isotropic noise
+    modes = rng.normal(size=(30,3,5))
+    landmarks = rng.normal(size=(30,3,1))*10 + np.einsum('ijm,mk->ijk', modes, rng.normal(size=(5,400))*[[5],[4],[3],[2],[1]]) \
+      + rng.normal(scale=0.1, size=(30,3,400))
+    LM = LMData()
+    LM.lm, meanShape, convergence = gpa_lib.runGPA(landmarks, maxIterations=10)
+    LM.lmOrig = LM.lm
+    LM.pcaMethod = 'svd'
+    LM.calcEigen()
+    val, vec, percentVariance = np.real(LM.val), np.real(LM.vec), LM.percentVariance()
+    LM.pcaMethod = 'auto'
+    LM.pcaComponents = 5
+    startTime = time.time()
+    LM.calcEigen()
+    logging.info(f'randomized PCA of 5 components: {time.time() - startTime:.3f}s')
+    self.assertEqual(LM.vec.shape, (90, 5))
+    np.testing.assert_allclose(LM.val, val[:5], rtol=1e-8)
+    np.testing.assert_allclose(gpa_lib.matchEigenvectorSigns(vec, LM.vec), vec[:,:5], atol=1e-6)
+    np.testing.assert_allclose(LM.percentVariance(), percentVariance[:5], rtol=1e-8)
+    self.delayDisplay('Test passed')
+
+  def test_ResultsBundle(self):
+    """ Write the results of an analysis and restore them from the binary results bundle, with the aligned
+    coordinates stored in the bundle and referenced from a memory-mapped array in the output folder.
+    """
+    self.delayDisplay("Starting the results bundle test")
+    import tempfile
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(20,3,1))*10 + rng.normal(size=(20,3,40))
+    files = [f'specimen_{index}' for index in range(landmarks.shape[2])]
+    for memmap in (False, True):
+      outputFolder = tempfile.mkdtemp()
+      LM = LMData()
+      if memmap:
+        LM.chunkSize = 16
+        LM.lmOrig = np.lib.format.open_memmap(os.path.join(outputFolder, 'landmarks.npy'), mode='w+', dtype=np.float64,
+          shape=landmarks.shape)
+        LM.lmOrig[:] = landmarks
+      else:
+        LM.lmOrig = np.array(landmarks)
+      LM.doGpa(False)
+      LM.calcEigen()
+      LM.writeOutData(outputFolder, files)
+      self.assertEqual('alignedFile' in np.load(os.path.join(outputFolder, LMData.bundleFileName)).files, memmap)
+
+      restored = LMData()
+      self.assertTrue(restored.initializeFromBundle(os.path.join(outputFolder, LMData.bundleFileName)))
+      np.testing.assert_array_equal(restored.lm, LM.lm)
+      np.testing.assert_array_equal(restored.mShape, LM.mShape)
+      np.testing.assert_array_equal(restored.val, np.real(LM.val))
+      np.testing.assert_array_equal(restored.vec, np.real(LM.vec))
+      np.testing.assert_array_equal(restored.centriodSize, LM.centriodSize)
+      np.testing.assert_array_equal(restored.procdist, LM.procdist)
+      np.testing.assert_array_equal(restored.pcScores(), LM.pcScores())
+      self.assertEqual(restored.totalVariance, LM.totalVariance)
+      self.assertEqual(restored.files, files)
+    self.delayDisplay('Test passed')
+
+  def test_AddSpecimens(self):
+    """ Compare the incremental PCA update with a full recompute, and adding specimens to an analysis with a full
+    GPA + PCA of all specimens.
+    """
+    self.delayDisplay("Starting the add specimens test")
+    import time
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(20,3,1))*10 + rng.normal(size=(20,3,80))*rng.uniform(0.1, 2, (20,3,1))
+    aligned, meanShape, convergence = gpa_lib.runGPA(np.array(landmarks), tolerance=1e-12, maxIterations=100)
+    twoDim = gpa_lib.makeTwoDim(aligned)
+    val, vec = gpa_lib.calcEigenSVD(twoDim)
+    oldVal, oldVec = gpa_lib.calcEigenSVD(twoDim[:,:50])
+    startTime = time.time()
+    updatedMean, updatedVal, updatedVec, totalVariance = gpa_lib.updateEigen(gpa_lib.calcMean(twoDim[:,:50]), oldVal, oldVec,
+      50, twoDim[:,50:])
+    logging.info(f'incremental PCA update: {time.time() - startTime:.3f}s')
+    # the aligned coordinates span at most coordinates-7 dimensions, compare the leading components
+    components = 20
+    np.testing.assert_allclose(updatedMean, gpa_lib.calcMean(twoDim), atol=1e-14)
+    np.testing.assert_allclose(updatedVal[:components], val[:components], rtol=1e-10)
+    np.testing.assert_allclose(gpa_lib.matchEigenvectorSigns(vec, updatedVec)[:,:components], vec[:,:components], atol=1e-8)
+    np.testing.assert_allclose(totalVariance, val.sum(), rtol=1e-10)
+
+    for driftThreshold in (np.inf, 0):
+      LM = LMData()
+      LM.gpaTolerance, LM.gpaMaxIterations, LM.driftThreshold = 1e-12, 100, driftThreshold
+      LM.lmOrig = np.array(landmarks[:,:,:50])
+      LM.doGpa(False)
+      LM.calcEigen()
+      report = LM.addSpecimens(np.array(landmarks[:,:,50:]), False)
+      self.assertEqual(report['added'], 30)
+      self.assertEqual(report['recomputed'], driftThreshold == 0)
+      self.assertEqual(LM.lm.shape, landmarks.shape)
+      np.testing.assert_allclose(np.ravel(LM.centriodSize), gpa_lib.centroidSizes(landmarks))
+      if report['recomputed']:
+        # a full GPA of all specimens, up to the orientation of the mean shape
+        np.testing.assert_allclose(gpa_lib.procDist(LM.lm, LM.mShape), gpa_lib.procDist(aligned, meanShape), atol=1e-8)
+        np.testing.assert_allclose(np.real(LM.val)[:components], val[:components], rtol=1e-6)
+      else:
+        # the existing specimens keep their coordinates and the PCA is the one of all aligned coordinates
+        np.testing.assert_array_equal(report['coordinateChange'], 0)
+        np.testing.assert_allclose(LM.mShape, LM.lm.mean(axis=2), atol=1e-14)
+        allVal, allVec = gpa_lib.calcEigenSVD(gpa_lib.makeTwoDim(LM.lm))
+        np.testing.assert_allclose(np.real(LM.val)[:components], allVal[:components], rtol=1e-10)
+        np.testing.assert_allclose(gpa_lib.matchEigenvectorSigns(allVec, LM.vec)[:,:components], allVec[:,:components], atol=1e-8)
+    self.delayDisplay('Test passed')
+
+  def test_VectorizedStatistics(self):
+    """ Compare the vectorized procDist, calcLMVariation and makeTwoDim with the loops they replace, with and without
+    chunking, on small shapes far from the origin and on 2000 specimens of 3000 landmarks.
+    """
+    self.delayDisplay("Starting the vectorized statistics test")
+    import time
+    rng = np.random.default_rng(0)
+
+    def loopStatistics(landmarks, meanShape):
+      i, j, k = landmarks.shape
+      loopDistances = np.array([np.linalg.norm(landmarks[:,:,index] - meanShape, 'fro') for index in range(k)])
+      loopVariation = np.zeros((i,j))
+      for index in range(k):
+        loopVariation += (landmarks[:,:,index] - meanShape)**2
+      return loopDistances, np.sqrt(loopVariation/(k-1))
+
+    # an offset of 1e4 loses all significant digits of the variation in |shape|^2 - 2 shape.mean + |mean|^2
+    for offset in (0, 1e4):
+      landmarks = offset + rng.normal(size=(40,3,1))*10 + rng.normal(size=(40,3,150))*1e-3
+      meanShape = landmarks.mean(axis=2)
+      loopDistances, loopVariation = loopStatistics(landmarks, meanShape)
+      for chunkSize in (None, 32):
+        np.testing.assert_allclose(gpa_lib.procDist(landmarks, meanShape, chunkSize), loopDistances, rtol=1e-12)
+        LM = LMData()
+        LM.lmOrig, LM.mShape, LM.chunkSize = landmarks, meanShape, chunkSize
+        np.testing.assert_allclose(LM.calcLMVariation(1, True), loopVariation, rtol=1e-12)
+        np.testing.assert_allclose(LM.calcLMVariation(2.5, False), 2.5*loopVariation, rtol=1e-12)
+
+    i, j, k = landmarks.shape
+    for array in (landmarks, np.asfortranarray(landmarks)):
+      loopTwoDim = np.column_stack([np.reshape(array[:,:,index], i*j, order='F') for index in range(k)])
+      np.testing.assert_array_equal(gpa_lib.makeTwoDim(array), loopTwoDim)
+
+    landmarks = rng.normal(size=(3000,3,1))*10 + rng.normal(size=(3000,3,2000))
+    meanShape = landmarks.mean(axis=2)
+    startTime = time.time()
+    loopDistances, loopVariation = loopStatistics(landmarks, meanShape)
+    loopTime = time.time() - startTime
+    LM = LMData()
+    LM.lmOrig, LM.mShape, LM.chunkSize = landmarks, meanShape, 256
+    startTime = time.time()
+    distances = gpa_lib.procDist(landmarks, meanShape, LM.chunkSize)
+    variation = LM.calcLMVariation(1, True)
+    vectorizedTime = time.time() - startTime
+    logging.info(f'procDist and calcLMVariation of 3000 landmarks x 2000 specimens: {loopTime:.3f}s loop, '
+      f'{vectorizedTime:.3f}s vectorized')
+    np.testing.assert_allclose(distances, loopDistances, rtol=1e-12)
+    np.testing.assert_allclose(variation, loopVariation, rtol=1e-12)
+    self.delayDisplay('Test passed')
+
+  def test_StreamingGPA(self):
+    """ Compare the streaming GPA and the PCA from its scatter matrix with the batch GPA and SVD PCA, writing the
+    aligned coordinates to a memory-mapped array.
+    """
+    self.delayDisplay("Starting the streaming GPA test")
+    import tempfile
+    import time
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(30,3,1))*10 + rng.normal(size=(30,3,500))*rng.uniform(0.1, 2, (30,3,1))
+    for skipScaling in (False, True):
+      batch = LMData()
+      batch.lmOrig, batch.gpaMaxIterations, batch.pcaMethod = np.array(landmarks), 10, 'svd'
+      startTime = time.time()
+      batch.doGpa(skipScaling)
+      batch.calcEigen()
+      batchTime = time.time() - startTime
+
+      streaming = LMData()
+      streaming.gpaMode, streaming.gpaMaxIterations, streaming.chunkSize = 'streaming', 10, 64
+      streaming.lmOrig = np.lib.format.open_memmap(os.path.join(tempfile.mkdtemp(), 'landmarks.npy'), mode='w+',
+        dtype=np.float64, shape=landmarks.shape)
+      streaming.lmOrig[:] = landmarks
+      startTime = time.time()
+      streaming.doGpa(skipScaling)
+      streaming.calcEigen()
+      logging.info(f'GPA + PCA skipScaling={skipScaling}: {batchTime:.3f}s batch, {time.time() - startTime:.3f}s streaming')
+      self.assertEqual(streaming.convergence['iterations'], batch.convergence['iterations'])
+      np.testing.assert_allclose(streaming.lm, batch.lm, atol=1e-12)
+      np.testing.assert_allclose(streaming.mShape, batch.mShape, atol=1e-12)
+      np.testing.assert_allclose(np.ravel(streaming.centriodSize), np.ravel(batch.centriodSize), rtol=1e-12)
+      # the aligned coordinates span at most coordinates-7 dimensions, compare the leading components
+      components = 20
+      np.testing.assert_allclose(np.real(streaming.val)[:components], np.real(batch.val)[:components], rtol=1e-9)
+      np.testing.assert_allclose(gpa_lib.matchEigenvectorSigns(np.real(batch.vec), np.real(streaming.vec))[:,:components],
+        np.real(batch.vec)[:,:components], atol=1e-8)
+      np.testing.assert_allclose(streaming.totalVariance, batch.totalVariance, rtol=1e-10)
+    self.delayDisplay('Test passed')
+
+  def test_PointConversion(self):
+    """ Compare the array based point conversions with the point by point loops they replace, on 100k points.
+    """
+    self.delayDisplay("Starting the point conversion test")
+    import time
+    pointNumber = 100000
+    points = np.random.default_rng(0).uniform(-100, 100, (pointNumber, 3))
+
+    startTime = time.time()
+    loopPoints = vtk.vtkPoints()
+    for i in range(pointNumber):
+      loopPoints.InsertNextPoint(points[i,0], points[i,1], points[i,2])
+    loopTime = time.time() - startTime
+    startTime = time.time()
+    arrayPoints = vtk_lib.numpyToVTKPoints(points)
+    arrayTime = time.time() - startTime
+    logging.info(f'numpy to vtkPoints: {loopTime:.3f}s point by point, {arrayTime:.6f}s shared array')
+    self.assertEqual(arrayPoints.GetNumberOfPoints(), pointNumber)
+    np.testing.assert_array_equal(vtk_lib.vtkPointsToNumpy(arrayPoints), vtk_lib.vtkPointsToNumpy(loopPoints))
+
+    markupsNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+    startTime = time.time()
+    vtk_lib.numpyToMarkups(markupsNode, points)
+    writeTime = time.time() - startTime
+    startTime = time.time()
+    markupsPoints = vtk_lib.markupsToNumpy(markupsNode)
+    readTime = time.time() - startTime
+    logging.info(f'markups control points: {writeTime:.3f}s write, {readTime:.3f}s read')
+    np.testing.assert_allclose(markupsPoints, points)
+    self.delayDisplay('Test passed')
+
+  def test_DistributedGPA(self):
+    """ Run the map-reduce GPA in process, in a local process pool and on two socket workers started as separate
+    processes, and compare with the streaming GPA.
+    """
+    self.delayDisplay("Starting the distributed GPA test")
+    import socket
+    import subprocess
+    import sys
+    import time
+    from concurrent.futures.process import BrokenProcessPool
+    import Support.gpa_distributed as gpa_distributed
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(30,3,1))*10 + rng.normal(size=(30,3,500))
+    aligned, meanShape, scatter, sizes, convergence = gpa_lib.streamingProcrustes(gpa_lib.arrayChunks(landmarks, 64),
+      True, maxIterations=10, output=np.zeros_like(landmarks))
+
+    authkey = os.urandom(16).hex()
+    addresses = []
+    for index in range(2):
+      with socket.socket() as freeSocket:
+        freeSocket.bind(('localhost', 0))
+        addresses.append(('localhost', freeSocket.getsockname()[1]))
+    workers = [subprocess.Popen([sys.executable, '-m', 'Support.gpa_distributed', '--listen', f'{host}:{port}',
+      '--authkey', authkey], cwd=os.path.dirname(__file__)) for host, port in addresses]
+    try:
+      for executorName in gpa_distributed.DISTRIBUTED_EXECUTORS:
+        executor = None
+        attempts = 50 if executorName == 'socket' else 1 # the socket workers may still be starting
+        for attempt in range(attempts):
+          try:
+            executor = gpa_distributed.makeExecutor(executorName, 2, addresses, authkey)
+            break
+          except ConnectionRefusedError:
+            if executorName != 'socket':
+              raise
+            time.sleep(0.2)
+        if executor is None:
+          self.fail(f"Could not connect to the socket workers at {addresses} after {attempts} attempts")
+        with executor:
+          startTime = time.time()
+          try:
+            result = gpa_distributed.distributedProcrustes(gpa_distributed.arrayShards(landmarks, 100), True, executor,
+              maxIterations=10, chunkSize=64, output=np.zeros_like(landmarks))
+          except BrokenProcessPool:
+            # child processes of the embedded interpreter may not be able to import the Support package
+            logging.warning(f'Could not run the distributed GPA in a {executorName} pool, skipping it')
+            continue
+          logging.info(f'{executorName} executor: {time.time() - startTime:.3f}s')
+        np.testing.assert_allclose(result[0], aligned, atol=1e-12)
+        np.testing.assert_allclose(result[1], meanShape, atol=1e-12)
+        np.testing.assert_allclose(result[2], scatter, atol=1e-10)
+        np.testing.assert_allclose(result[3], sizes)
+    finally:
+      for worker in workers:
+        worker.terminate()
+    self.delayDisplay('Test passed')
+
+  def test_ResamplingExecutors(self):
+    """ Run the bootstrap and the permutation test in a thread pool and in a process pool with the same seed, the
+    results must be identical.
+    """
+    self.delayDisplay("Starting the resampling executor test")
+    import tempfile
+    import time
+    from concurrent.futures.process import BrokenProcessPool
+    import Support.gpa_resampling as gpa_resampling
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(20,3,1))*10 + rng.normal(size=(20,3,60))
+    aligned, meanShape, scatter, sizes, convergence = gpa_lib.streamingProcrustes(gpa_lib.arrayChunks(landmarks, 64),
+      True, maxIterations=10, output=np.zeros_like(landmarks))
+    val, vec = gpa_resampling.leadingEigen(gpa_lib.makeTwoDim(aligned), 3)
+    groups = np.repeat(['a', 'b', 'c'], 20)
+
+    results = {}
+    for executor in gpa_resampling.RESAMPLING_EXECUTORS:
+      outputFolder = tempfile.mkdtemp()
+      startTime = time.time()
+      try:
+        intervals = gpa_resampling.runBootstrap(aligned, meanShape, vec, 40, outputFolder, seed=1, workers=2,
+          replicatesPerTask=7, executor=executor)
+        permutation = gpa_resampling.runPermutationTest(aligned, groups, 200, outputFolder, seed=1, workers=2,
+          replicatesPerTask=30, executor=executor)
+      except BrokenProcessPool:
+        # child processes of the embedded interpreter may not be able to import the Support package
+        logging.warning(f'Could not run the resampling in a {executor} pool, skipping it')
+        continue
+      logging.info(f'{executor} executor: {time.time() - startTime:.3f}s')
+      replicates = [np.load(os.path.join(outputFolder, name + '.npy')) for name in
+        ('bootstrapMeanShape', 'bootstrapEigenvalues', 'bootstrapEigenvectors', 'permutationDistances')]
+      results[executor] = (intervals, permutation, replicates)
+    self.assertIn('thread', results)
+    if len(results) == 2:
+      (threadIntervals, threadPermutation, threadReplicates), (processIntervals, processPermutation, processReplicates) = \
+        results['thread'], results['process']
+      for threadReplicate, processReplicate in zip(threadReplicates, processReplicates):
+        np.testing.assert_array_equal(threadReplicate, processReplicate)
+      for name in threadIntervals:
+        np.testing.assert_array_equal(threadIntervals[name], processIntervals[name])
+      self.assertEqual(threadPermutation[0], processPermutation[0])
+      np.testing.assert_array_equal(threadPermutation[1], processPermutation[1])
+      np.testing.assert_array_equal(threadPermutation[2], processPermutation[2])
+    self.delayDisplay('Test passed')
+
+  def test_TPSWarp(self):
+    """ Compare the blocked thin plate spline of tps_lib with vtkThinPlateSplineTransform on 200k points.
+    """
+    self.delayDisplay("Starting the thin plate spline test")
+    import time
+    rng = np.random.default_rng(0)
+    sourceLandmarks = rng.uniform(-50, 50, (500, 3))
+    targetLandmarks = sourceLandmarks + rng.normal(scale=2, size=sourceLandmarks.shape)
+    points = rng.uniform(-60, 60, (200000, 3))
+
+    transform = vtk.vtkThinPlateSplineTransform()
+    transform.SetSourceLandmarks(vtk_lib.numpyToVTKPoints(sourceLandmarks))
+    transform.SetTargetLandmarks(vtk_lib.numpyToVTKPoints(targetLandmarks))
+    transform.SetBasisToR()
+    vtkWarped = vtk.vtkPoints()
+    startTime = time.time()
+    transform.TransformPoints(vtk_lib.numpyToVTKPoints(points), vtkWarped)
+    vtkTime = time.time() - startTime
+    startTime = time.time()
+    warped = tps_lib.ThinPlateSpline(sourceLandmarks).transformPoints(points, targetLandmarks)
+    numpyTime = time.time() - startTime
+    logging.info(f'thin plate spline of {len(points)} points: {vtkTime:.3f}s VTK, {numpyTime:.3f}s tps_lib')
+    np.testing.assert_allclose(warped, vtk_lib.vtkPointsToNumpy(vtkWarped), atol=1e-6)
+
+    # the PC warp fields are the spline of the landmark shifts
+    shifts = rng.normal(size=(3,) + sourceLandmarks.shape)
+    fields = tps_lib.ThinPlateSpline(sourceLandmarks, workers=2).displacementBasis(points[:1000], shifts)
+    for shift, field in zip(shifts, fields):
+      transform.SetTargetLandmarks(vtk_lib.numpyToVTKPoints(sourceLandmarks + shift))
+      transform.TransformPoints(vtk_lib.numpyToVTKPoints(points[:1000]), vtkWarped)
+      np.testing.assert_allclose(points[:1000] + field, vtk_lib.vtkPointsToNumpy(vtkWarped), atol=1e-6)
+    self.delayDisplay('Test passed')
+
+  def test_SemiLandmarkSliding(self):
+    """ Slide the semi-landmarks of a curve and check that the bending energy and the Procrustes distance to the
+    reference decrease, that the conjugate gradient solve matches the dense one and that the Procrustes distance
+    slide does not depend on the directions being orthonormal.
+    """
+    self.delayDisplay("Starting the semi-landmark sliding test")
+    import time
+    import Support.gpa_sliding as gpa_sliding
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2*np.pi, 300, endpoint=False)
+    reference = np.vstack((np.column_stack((10*np.cos(angles), 10*np.sin(angles), np.sin(3*angles))),
+      rng.normal(scale=5, size=(10,3))))
+    semiLandmarks = np.arange(1, 299)
+    landmarks = reference[:,:,np.newaxis] + rng.normal(scale=0.3, size=reference.shape + (5,))
+    energyMatrix = gpa_sliding.bendingEnergyRows(reference, np.arange(len(reference)))
+    def bendingEnergy(specimen):
+      return np.einsum('ij,ij', np.dot(energyMatrix, specimen), specimen)
+
+    for criterion, measure in (('bendingEnergy', bendingEnergy),
+      ('procrustesDistance', lambda specimen: np.linalg.norm(specimen - reference))):
+      for tangents in gpa_sliding.TANGENT_MODES:
+        startTime = time.time()
+        slid = gpa_sliding.slideSemiLandmarks(np.array(landmarks), reference, semiLandmarks, criterion, tangents, workers=2)
+        logging.info(f'{criterion} sliding along {tangents} tangents: {time.time() - startTime:.3f}s')
+        np.testing.assert_array_equal(np.delete(slid, semiLandmarks, axis=0), np.delete(landmarks, semiLandmarks, axis=0))
+        for index in range(landmarks.shape[2]):
+          self.assertLess(measure(slid[:,:,index]), measure(landmarks[:,:,index]))
+
+    specimen = landmarks[:,:,0]
+    energyRows = gpa_sliding.bendingEnergyRows(reference, semiLandmarks)
+    positions, directions = gpa_sliding.slidingDirections(specimen, semiLandmarks, 'surface')
+    denseSteps = gpa_sliding.bendingEnergySteps(specimen, semiLandmarks, energyRows, positions, directions)
+    denseLimit = gpa_sliding.DENSE_DIRECTION_LIMIT
+    gpa_sliding.DENSE_DIRECTION_LIMIT = 0
+    try:
+      iterativeSteps = gpa_sliding.bendingEnergySteps(specimen, semiLandmarks, energyRows, positions, directions)
+    finally:
+      gpa_sliding.DENSE_DIRECTION_LIMIT = denseLimit
+    slidEnergies = []
+    for steps in (denseSteps, iterativeSteps):
+      slid = np.array(specimen)
+      np.add.at(slid, semiLandmarks[positions], steps[:,np.newaxis]*directions)
+      slidEnergies.append(bendingEnergy(slid))
+    np.testing.assert_allclose(slidEnergies[1], slidEnergies[0], rtol=1e-5)
+
+    def skewedTangents(specimen, semiLandmarks):
+      positions, directions = gpa_sliding.surfaceTangents(specimen, semiLandmarks)
+      directions = directions.reshape(-1,2,3)
+      directions[:,1] += 2*directions[:,0]
+      return positions, directions.reshape(-1,3)
+    orthonormal = gpa_sliding.slideSpecimen(np.array(specimen), reference, semiLandmarks, None, 'procrustesDistance', 'surface')
+    skewed = gpa_sliding.slideSpecimen(np.array(specimen), reference, semiLandmarks, None, 'procrustesDistance', skewedTangents)
+    np.testing.assert_allclose(skewed, orthonormal, atol=1e-10)
+
+    # duplicate and out of range exclusions do not shift the semi-landmark indices
+    semiIndex = GPALogic().semiLandmarkIndex(['2', '5', '7'], 6, [3, 3, 9])
+    np.testing.assert_array_equal(semiIndex, [1, 3])
+    self.delayDisplay('Test passed')
+
+  def test_PCWarpSequence(self):
+    """ Generate a PC warp sequence and check its frames, scale index, landmarks and warped model points.
+    """
+    self.delayDisplay("Starting the PC warp sequence test")
+    logic = GPALogic()
+    rng = np.random.default_rng(0)
+    meanLandmarks = rng.uniform(-20, 20, (12, 3))
+    pcShift = rng.normal(size=meanLandmarks.shape)
+    frameCount = 7
+    scaleFactors, landmarkFrames = logic.pcWarpFrames(meanLandmarks, pcShift, (-1, 1), frameCount)
+    np.testing.assert_allclose(scaleFactors, np.linspace(-1, 1, frameCount))
+    self.assertEqual(landmarkFrames.shape, (frameCount,) + meanLandmarks.shape)
+    np.testing.assert_allclose(landmarkFrames[2], meanLandmarks + scaleFactors[2]*pcShift)
+
+    sphere = vtk.vtkSphereSource()
+    sphere.SetRadius(15)
+    sphere.Update()
+    modelNode = slicer.modules.models.logic().AddModel(sphere.GetOutput())
+    meanModelPoints = np.array(slicer.util.arrayFromModelPoints(modelNode))
+    landmarkNode = vtk_lib.createMarkupsNode('Warped landmarks', meanLandmarks)
+    browserNode = logic.createPCWarpSequence('PC warp test', landmarkNode, meanLandmarks, pcShift, (-1, 1), frameCount,
+      modelNode=modelNode)
+    sequenceNode = browserNode.GetMasterSequenceNode()
+    self.assertEqual(sequenceNode.GetNumberOfDataNodes(), frameCount)
+    self.assertEqual(sequenceNode.GetIndexName(), "PC scale")
+    indexValues = [float(sequenceNode.GetNthIndexValue(item)) for item in range(frameCount)]
+    np.testing.assert_allclose(indexValues, scaleFactors, atol=1e-5)
+
+    # the model is warped by the transform of the synchronized transform sequence, its own points stay the mean
+    transformSequenceNode = slicer.mrmlScene.GetFirstNodeByName('PC warp test Transforms')
+    self.assertEqual(transformSequenceNode.GetNumberOfDataNodes(), frameCount)
+    self.assertEqual(modelNode.GetParentTransformNode(), browserNode.GetProxyNode(transformSequenceNode))
+    field = tps_lib.ThinPlateSpline(meanLandmarks).displacementBasis(meanModelPoints, [pcShift])[0]
+    for item in (5, 1):
+      browserNode.SetSelectedItemNumber(item)
+      np.testing.assert_allclose(vtk_lib.markupsToNumpy(landmarkNode), landmarkFrames[item], atol=1e-6)
+      transform = vtk.vtkGeneralTransform()
+      slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(modelNode.GetParentTransformNode(), None, transform)
+      warpedPoints = vtk.vtkPoints()
+      transform.TransformPoints(vtk_lib.numpyToVTKPoints(meanModelPoints), warpedPoints)
+      np.testing.assert_allclose(slicer.util.arrayFromModelPoints(modelNode), meanModelPoints)
+      np.testing.assert_allclose(vtk_lib.vtkPointsToNumpy(warpedPoints), meanModelPoints + scaleFactors[item]*field,
+        atol=1e-4)
+
+    # offscreen rendering of every frame, as used without a main window, and the video export when ffmpeg is set up
+    import tempfile
+    from ScreenCapture import ScreenCaptureLogic
+    outputFolder = tempfile.mkdtemp()
+    logic.renderSequenceFrames(browserNode, outputFolder, "frame-%04d.png", size=(320, 240))
+    for item in range(frameCount):
+      self.assertGreater(os.path.getsize(os.path.join(outputFolder, f"frame-{item:04d}.png")), 0)
+    with self.assertRaises(ValueError):
+      logic.exportSequenceVideo(browserNode, os.path.join(outputFolder, "warp.unknown"))
+    if ScreenCaptureLogic().isFfmpegPathValid():
+      videoPath = os.path.join(outputFolder, "warp." + logic.videoFileExtensions()[0])
+      logic.exportSequenceVideo(browserNode, videoPath, frameRate=10)
+      self.assertGreater(os.path.getsize(videoPath), 0)
+    else:
+      logging.warning('ffmpeg is not configured, skipping the video export check')
+    self.delayDisplay('Test passed')
+
+  def test_LandmarkLoader(self):
+    """ Compare the threaded landmark file reader with the pandas and fnmatch parsing it replaces, and check that the
+    excluded landmarks are removed and that unreadable files are reported together.
+    """
+    self.delayDisplay("Starting the landmark loader test")
+    import json
+    import tempfile
+    import pandas
+    import Support.landmark_io as landmark_io
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(6,3,4))*10
+    descriptions = ['', '', '', 'Semi', 'Semi', '']
+    folder = tempfile.mkdtemp()
+
+    def writeFCSV(filePath, points):
+      with open(filePath, 'w') as fcsvFile:
+        fcsvFile.write("# Markups fiducial file version = 4.11\n# CoordinateSystem = LPS\n")
+        fcsvFile.write("# columns = id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,desc,associatedNodeID\n")
+        for index, point in enumerate(points):
+          coordinates = ",".join(repr(float(value)) for value in point)
+          fcsvFile.write(f"{index+1},{coordinates},0,0,0,1,1,1,0,F-{index+1},{descriptions[index]},\n")
+
+    def writeMarkupsJSON(filePath, points):
+      controlPoints = [{'id': str(index+1), 'label': f'F-{index+1}', 'description': descriptions[index],
+        'position': point.tolist()} for index, point in enumerate(points)]
+      with open(filePath, 'w') as jsonFile:
+        json.dump({'markups': [{'type': 'Fiducial', 'coordinateSystem': 'LPS', 'controlPoints': controlPoints}]}, jsonFile)
+
+    fcsvPaths = [os.path.join(folder, f'specimen{index}.fcsv') for index in range(landmarks.shape[2])]
+    jsonPaths = [os.path.join(folder, f'specimen{index}.mrk.json') for index in range(landmarks.shape[2])]
+    for index in range(landmarks.shape[2]):
+      writeFCSV(fcsvPaths[index], landmarks[:,:,index])
+      writeMarkupsJSON(jsonPaths[index], landmarks[:,:,index])
+
+    # the parsing of the files before the threaded reader
+    for filePath in fcsvPaths:
+      rows = []
+      with open(filePath) as fcsvFile:
+        for row in fcsvFile:
+          if not fnmatch.fnmatch(row[0],"#*"):
+            rows.append(row.strip().split(','))
+      points, fileDescriptions = landmark_io.readLandmarkFile(filePath)
+      np.testing.assert_array_equal(points, np.array([row[1:4] for row in rows], dtype=np.float64))
+      self.assertEqual(landmark_io.semiLandmarkNumbers(fileDescriptions),
+        [str(index+1) for index, row in enumerate(rows) if row[12] == 'Semi'])
+    for index, filePath in enumerate(jsonPaths):
+      table = pandas.DataFrame.from_dict(pandas.read_json(filePath)['markups'][0]['controlPoints'])
+      points, fileDescriptions = landmark_io.readLandmarkFile(filePath)
+      # pandas parses the JSON floats to within a few ulp only, the json module is exact
+      np.testing.assert_allclose(points, np.array(table['position'].tolist()), rtol=1e-14)
+      np.testing.assert_array_equal(points, landmarks[:,:,index])
+      self.assertEqual(landmark_io.semiLandmarkNumbers(fileDescriptions),
+        [str(index+1) for index in range(len(table)) if table['description'][index] == 'Semi'])
+
+    logic = GPALogic()
+    for filePathList in (fcsvPaths, jsonPaths):
+      for lmToRemove in ([], [2, 5]):
+        result, landmarkTypeArray, errors, landmarkNumber = logic.readLandmarkArray(filePathList, lmToRemove, workers=2)
+        self.assertEqual(errors, [])
+        self.assertEqual(landmarkNumber, 6)
+        self.assertEqual(landmarkTypeArray, ['4', '5'])
+        np.testing.assert_array_equal(result, np.delete(landmarks, [lm-1 for lm in lmToRemove], axis=0))
+    result, landmarkTypeArray = logic.loadLandmarks(fcsvPaths + jsonPaths, [2], None)
+    np.testing.assert_array_equal(result, np.delete(np.concatenate((landmarks, landmarks), axis=2), 1, axis=0))
+
+    # unreadable files and files with a different number of landmarks are all reported, the others are loaded
+    brokenFCSVPath = os.path.join(folder, 'broken.fcsv')
+    with open(brokenFCSVPath, 'w') as fcsvFile:
+      fcsvFile.write("1,x,y,z,0,0,0,1,1,1,0,F-1,,\n")
+    brokenJSONPath = os.path.join(folder, 'broken.mrk.json')
+    with open(brokenJSONPath, 'w') as jsonFile:
+      jsonFile.write('{"markups": [')
+    shortPath = os.path.join(folder, 'short.mrk.json')
+    writeMarkupsJSON(shortPath, landmarks[:4,:,0])
+    filePathList = [fcsvPaths[0], brokenFCSVPath, jsonPaths[1], brokenJSONPath, shortPath, fcsvPaths[2]]
+    result, landmarkTypeArray, errors, landmarkNumber = logic.readLandmarkArray(filePathList, [2], workers=2)
+    self.assertEqual([path for path, error in errors], [brokenFCSVPath, brokenJSONPath, shortPath])
+    self.assertTrue(errors[0][1].startswith('ValueError'))
+    self.assertTrue(errors[1][1].startswith('JSONDecodeError'))
+    self.assertEqual(errors[2][1], "There are 4 landmarks instead of the expected 6.")
+    self.assertEqual(result.shape, (5,3,6))
+    for index, specimen in ((0, 0), (2, 1), (5, 2)):
+      np.testing.assert_array_equal(result[:,:,index], np.delete(landmarks[:,:,specimen], 1, axis=0))
+    np.testing.assert_array_equal(result[:,:,[1,3,4]], 0)
+    self.assertIsNone(logic.loadLandmarks(filePathList, [2], None))
+    self.delayDisplay('Test passed')
+
+  def test_LandmarkCache(self):
+    """ Check that cached landmark files are parsed again when they change, that the least recently used files are
+    evicted from a full cache, and the cache of the module logic.
+    """
+    self.delayDisplay("Starting the landmark cache test")
+    import tempfile
+    import time
+    import Support.landmark_cache as landmark_cache
+    import Support.landmark_io as landmark_io
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(6,3,3))*10
+    folder = tempfile.mkdtemp()
+
+    def writeFCSV(filePath, points):
+      with open(filePath, 'w') as fcsvFile:
+        fcsvFile.write("# columns = id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,desc,associatedNodeID\n")
+        for index, point in enumerate(points):
+          coordinates = ",".join(repr(float(value)) for value in point)
+          fcsvFile.write(f"{index+1},{coordinates},0,0,0,1,1,1,0,F-{index+1},,\n")
+
+    filePathList = [os.path.join(folder, f'specimen{index}.fcsv') for index in range(landmarks.shape[2])]
+    for index, filePath in enumerate(filePathList):
+      writeFCSV(filePath, landmarks[:,:,index])
+    cache = landmark_cache.LandmarkCache(os.path.join(folder, 'cache', 'landmarks.sqlite'))
+    try:
+      for index, points, descriptions, error in landmark_io.iterLandmarkFiles(filePathList, 2, cache=cache):
+        self.assertIsNone(error)
+      for index, filePath in enumerate(filePathList):
+        np.testing.assert_array_equal(cache.get(filePath)[0], landmarks[:,:,index])
+      entrySize = cache.size() // len(filePathList)
+
+      # a touched file is no longer cached, a modified file is parsed again
+      stat = os.stat(filePathList[0])
+      os.utime(filePathList[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+      self.assertIsNone(cache.get(filePathList[0]))
+      landmarks[:,:,1] += 1
+      writeFCSV(filePathList[1], landmarks[:,:,1])
+      stat = os.stat(filePathList[1])
+      os.utime(filePathList[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+      for index, points, descriptions, error in landmark_io.iterLandmarkFiles(filePathList, 2, cache=cache):
+        np.testing.assert_array_equal(points, landmarks[:,:,index])
+      np.testing.assert_array_equal(cache.get(filePathList[1])[0], landmarks[:,:,1])
+
+      # with room for two files the least recently used one is evicted
+      cache.maxSizeBytes = 2*entrySize
+      for index in (2, 0, 1):
+        time.sleep(0.05)
+        cache.get(filePathList[index])
+      cache.commit()
+      self.assertEqual(cache.size(), 2*entrySize)
+      self.assertIsNone(cache.get(filePathList[2]))
+      self.assertIsNotNone(cache.get(filePathList[0]))
+      self.assertIsNotNone(cache.get(filePathList[1]))
+      cache.clear()
+      self.assertEqual(cache.size(), 0)
+    finally:
+      cache.close()
+
+    # the cache of the logic is in the Slicer cache directory, redirect it to keep the user cache
+    logic = GPALogic()
+    settings = qt.QSettings()
+    cachePath = slicer.app.cachePath
+    maxSizeMB = settings.value('SlicerMorph/GPALandmarkCacheMaxSizeMB')
+    try:
+      slicer.app.cachePath = os.path.join(folder, 'SlicerCache')
+      settings.setValue('SlicerMorph/GPALandmarkCacheMaxSizeMB', 1)
+      cache = logic.getLandmarkCache()
+      self.assertEqual(cache.cacheFilePath, os.path.join(slicer.app.cachePath, 'SlicerMorph', 'GPALandmarkCache.sqlite'))
+      self.assertEqual(cache.maxSizeBytes, 1024*1024)
+      cache.close()
+      result, landmarkTypeArray = logic.loadLandmarks(filePathList, [], None, useCache=True)
+      np.testing.assert_array_equal(result, landmarks)
+      cache = logic.getLandmarkCache()
+      self.assertEqual(cache.size(), 3*entrySize)
+      cache.close()
+      logic.clearLandmarkCache()
+      cache = logic.getLandmarkCache()
+      self.assertEqual(cache.size(), 0)
+      cache.close()
+    finally:
+      slicer.app.cachePath = cachePath
+      if maxSizeMB is None:
+        settings.remove('SlicerMorph/GPALandmarkCacheMaxSizeMB')
+      else:
+        settings.setValue('SlicerMorph/GPALandmarkCacheMaxSizeMB', maxSizeMB)
+    self.delayDisplay('Test passed')
+
+  def test_RunAnalysis(self):
+    """ Run the analysis without the GUI on a folder of landmark files and check the output folder and its log.
+    """
+    self.delayDisplay("Starting the run analysis test")
+    import csv
+    import tempfile
+    rng = np.random.default_rng(0)
+    landmarks = rng.normal(size=(8,3,1))*10 + rng.normal(size=(8,3,12))
+    descriptions = ['', '', '', '', '', 'Semi', 'Semi', '']
+    inputFolder = tempfile.mkdtemp()
+    outputDir = tempfile.mkdtemp()
+    inputPaths = []
+    for index in range(landmarks.shape[2]):
+      inputPaths.append(os.path.join(inputFolder, f'specimen{index}.fcsv'))
+      with open(inputPaths[-1], 'w') as fcsvFile:
+        fcsvFile.write("# columns = id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,desc,associatedNodeID\n")
+        for pointIndex, point in enumerate(landmarks[:,:,index]):
+          coordinates = ",".join(repr(float(value)) for value in point)
+          fcsvFile.write(f"{pointIndex+1},{coordinates},0,0,0,1,1,1,0,F-{pointIndex+1},{descriptions[pointIndex]},\n")
+
+    logic = GPALogic()
+    for gpaMode, memmap in (('batch', False), ('streaming', True)):
+      folderName = f'{gpaMode}Analysis'
+      results = logic.runAnalysis(inputPaths, outputDir, dict(excludedLandmarks='2', gpaMode=gpaMode, memmap=memmap,
+        chunkSize=5, tolerance=1e-10, maxIterations=20, outputFolderName=folderName))
+      outputFolder = os.path.join(outputDir, folderName)
+      self.assertEqual(results.outputFolder, outputFolder)
+      self.assertEqual(results.files, [f'specimen{index}' for index in range(landmarks.shape[2])])
+      self.assertEqual(results.landmarkTypeArray, ['6', '7'])
+      outputFiles = ['eigenvector.csv', 'eigenvalues.csv', 'MeanShape.csv', 'OutputData.csv', 'pcScores.csv',
+        LMData.bundleFileName, 'analysis.log'] + (['landmarks.npy'] if memmap else [])
+      self.assertEqual(sorted(os.listdir(outputFolder)), sorted(outputFiles))
+      aligned, meanShape, convergence = gpa_lib.runGPA(np.delete(landmarks, 1, axis=0), tolerance=1e-10, maxIterations=20)
+      np.testing.assert_allclose(results.LM.lm, aligned, atol=1e-8)
+
+      with open(os.path.join(outputFolder, 'OutputData.csv')) as outputFile:
+        rows = list(csv.reader(outputFile))
+      self.assertEqual(len(rows), landmarks.shape[2] + 1)
+      self.assertEqual([row[0] for row in rows[1:]], results.files)
+      np.testing.assert_allclose(np.array([row[3:] for row in rows[1:]], dtype=float),
+        gpa_lib.landmarkRows(results.LM.lm), atol=1e-14)
+      with open(os.path.join(outputFolder, 'pcScores.csv')) as outputFile:
+        self.assertEqual(len(list(csv.reader(outputFile))), landmarks.shape[2] + 1)
+
+      log = {}
+      with open(os.path.join(outputFolder, 'analysis.log')) as logFile:
+        for line in logFile:
+          key, value = line.rstrip('\n').split('=', 1)
+          log[key] = value
+      self.assertEqual(log['InputPath'], inputFolder)
+      self.assertEqual(log['OutputPath'], outputFolder.replace("\\", "/"))
+      self.assertEqual(log['Files'], ",".join(f'specimen{index}.fcsv' for index in range(landmarks.shape[2])))
+      self.assertEqual(log['LM_format'], '.fcsv')
+      self.assertEqual(log['NumberLM'], '8')
+      self.assertEqual(log['ExcludedLM'], '2')
+      self.assertEqual(log['Scale'], 'True')
+      self.assertEqual(log['GPAMode'], gpaMode)
+      self.assertEqual(log['GPAConverged'], 'True')
+      self.assertEqual(log['ResultsBundle'], LMData.bundleFileName)
+      self.assertEqual(log['SemiLandmarks'].strip(), '6,7')
+      self.assertEqual(logic.readAnalysisLogOptions(outputFolder), (False, [2]))
+
+    with open(inputPaths[3], 'w') as fcsvFile:
+      fcsvFile.write("1,x,y,z,0,0,0,1,1,1,0,F-1,,\n")
+    with self.assertRaises(ValueError):
+      logic.runAnalysis(inputPaths, outputDir, dict(outputFolderName='brokenAnalysis'))
+    self.assertFalse(os.path.exists(os.path.join(outputDir, 'brokenAnalysis')))
+    self.delayDisplay('Test passed')
+
+  def test_DistanceFunctions(self):
+    """ Compare the blocked distance functions with scipy, including the convex hull search of the maximum distance
+    and its fallback for coplanar points.
+    """
+    self.delayDisplay("Starting the distance functions test")
+    from scipy.spatial.distance import cdist
+    rng = np.random.default_rng(0)
+    coplanar = rng.normal(size=(40,3))
+    coplanar[:,2] = 1
+    for points in (rng.normal(size=(10,3)), rng.normal(size=(200,3)), coplanar):
+      distances = cdist(points, points)
+      for blockElements in (2**20, 64):
+        np.testing.assert_allclose(gpa_lib.distanceMatrix(points, blockElements), distances, atol=1e-14)
+        self.assertAlmostEqual(gpa_lib.maximumDistance(points, blockElements), distances.max(), places=14)
+        self.assertAlmostEqual(gpa_lib.minimumDistance(points, blockElements), distances[distances > 0].min(), places=14)
+    # coincident points are skipped by the minimum distance
+    points = np.concatenate((coplanar, coplanar[:5]))
+    distances = cdist(points, points)
+    self.assertAlmostEqual(gpa_lib.minimumDistance(points, 64), distances[distances > 0].min(), places=14)
+    self.delayDisplay('Test passed')
+
+  def test_CSVOutput(self):
+    """ Compare the streamed CSV output with the np.savetxt output of the string arrays it replaces, and check that
+    the values read back unchanged.
+    """
+    self.delayDisplay("Starting the CSV output test")
+    import io
+    import tempfile
+    rng = np.random.default_rng(0)
+    values = np.concatenate((rng.normal(size=(50,4))*10.0**rng.integers(-20, 20, size=(50,4)),
+      [[0.1, 1/3, -0.0, 1e16], [2.0, np.nan, np.inf, -5e-324]]))
+    labels = [f'specimen{index}' for index in range(len(values))]
+    for rowLabels, oldArray in ((None, values), (labels, np.column_stack((np.array(labels), values)))):
+      oldFile = io.StringIO()
+      np.savetxt(oldFile, oldArray, delimiter=",", fmt='%s')
+      for chunkRows in (1024, 7):
+        outputFile = io.StringIO()
+        gpa_lib.writeCSVRows(outputFile, values, rowLabels, chunkRows=chunkRows)
+        self.assertEqual(outputFile.getvalue(), oldFile.getvalue())
+        outputFile.seek(0)
+        firstColumn = 0 if rowLabels is None else 1
+        readValues = np.loadtxt(outputFile, delimiter=",", usecols=range(firstColumn, firstColumn + values.shape[1]))
+        np.testing.assert_array_equal(readValues, values)
+    outputFile = io.StringIO()
+    gpa_lib.writeCSVRows(outputFile, values[:1], fmt="%.3f")
+    self.assertEqual(outputFile.getvalue(), ",".join(f"{value:.3f}" for value in values[0]) + "\n")
+
+    # the analysis output files as they were built with np.savetxt
+    landmarks = rng.normal(size=(6,3,1))*10 + rng.normal(size=(6,3,9))
+    LM = LMData()
+    LM.lmOrig = landmarks
+    LM.doGpa(False)
+    LM.calcEigen()
+    files = [f'specimen{index}' for index in range(landmarks.shape[2])]
+    outputFolder = tempfile.mkdtemp()
+    LM.writeOutData(outputFolder, files)
+    headerLM = gpa_lib.landmarkCoordinateHeader(landmarks.shape[0])
+    oldArrays = {
+      'MeanShape.csv': np.vstack((["", "X", "Y", "Z"],
+        np.column_stack((["LM " + str(i + 1) for i in range(len(LM.mShape))], LM.mShape)))),
+      'OutputData.csv': np.vstack((['Sample_name', 'proc_dist', 'centeroid'] + headerLM,
+        np.column_stack((files, LM.procdist, LM.centriodSize, gpa_lib.landmarkRows(LM.lm))))),
+      'pcScores.csv': np.vstack((["Sample_name"] + ["PC " + str(i + 1) for i in range(LM.vec.shape[1])],
+        np.column_stack((files, LM.pcScores())))),
+      }
+    for fileName, oldArray in oldArrays.items():
+      oldFile = io.StringIO()
+      np.savetxt(oldFile, oldArray, delimiter=",", fmt='%s')
+      with open(os.path.join(outputFolder, fileName)) as outputFile:
+        self.assertEqual(outputFile.read(), oldFile.getvalue())
+    self.delayDisplay('Test passed')
@@ -0,0 +1,78 @@
+"""
+Run a GPA + PCA analysis without the GPA module user interface, e.g. in a batch pipeline:
+
+  Slicer --no-main-window --python-script <path to this file> --input <landmark directory or files> --output <directory>
+
+Several analyses can run in parallel by starting one Slicer process per configuration, each with its own --name.
+"""
+import argparse
+import glob
+import os
+import sys
+
+def parseArguments(argv):
+  parser = argparse.ArgumentParser(description="Run GPA + PCA on a set of landmark files")
+  parser.add_argument("--input", nargs="+", required=True, help="Landmark files (.fcsv, .mrk.json) or directories containing them")
+  parser.add_argument("--output", required=True, help="Directory where the results folder is created")
+  parser.add_argument("--name", default=None, help="Name of the results folder, a date/time stamp by default")
+  parser.add_argument("--exclude", default="", help="Comma separated landmark numbers to exclude")
+  parser.add_argument("--skip-scaling", action="store_true", help="Do not scale specimens to unit centroid size")
+  parser.add_argument("--gpa-mode", default="batch", choices=("batch", "loop", "streaming", "distributed"),
+    help="streaming reads --chunk-size specimens at a time on every iteration, combine with --memmap for large cohorts. "
+    "distributed maps every iteration over shards of --chunk-size specimens with --executor")
+  parser.add_argument("--tolerance", type=float, default=0.0001)
+  parser.add_argument("--max-iterations", type=int, default=5)
+  parser.add_argument("--pca-method", default="auto", choices=("auto", "eigh", "svd", "randomized", "chunked"))
+  parser.add_argument("--pca-components", type=int, default=None)
+  parser.add_argument("--memmap", action="store_true", help="Store the landmark array on disk in the results folder")
+  parser.add_argument("--chunk-size", type=int, default=256)
+  parser.add_argument("--use-cache", action="store_true", help="Use the landmark file cache")
+  parser.add_argument("--executor", default="thread", choices=("inprocess", "thread", "process", "socket"),
+    help="Executor of the distributed GPA")
+  parser.add_argument("--workers", type=int, default=None, help="Number of local worker threads or processes")
+  parser.add_argument("--worker", action="append", default=[], metavar="HOST:PORT",
+    help="Address of a socket worker (python -m Support.gpa_distributed --listen HOST:PORT), may be repeated")
+  parser.add_argument("--authkey", default=os.environ.get("GPA_WORKER_AUTHKEY"),
+    help="Shared secret of the socket workers, GPA_WORKER_AUTHKEY by default")
+  parser.add_argument("--slide", default=None, choices=("bendingEnergy", "procrustesDistance"),
+    help="Slide the semi-landmarks during GPA, minimizing this criterion")
+  parser.add_argument("--sliding-tangents", default="curve", choices=("curve", "surface"))
+  return parser.parse_args(argv)
+
+def landmarkFilePaths(inputs):
+  filePaths = []
+  for path in inputs:
+    if os.path.isdir(path):
+      filePaths += sorted(glob.glob(os.path.join(path, "*.fcsv")) + glob.glob(os.path.join(path, "*.mrk.json")))
+    else:
+      filePaths.append(path)
+  return filePaths
+
+def main(argv):
+  args = parseArguments(argv)
+  from GPA import GPALogic
+  import Support.gpa_distributed as gpa_distributed
+  inputPaths = landmarkFilePaths(args.input)
+  if not inputPaths:
+    print("No landmark files found")
+    return 1
+  options = dict(excludedLandmarks=args.exclude, skipScaling=args.skip_scaling, gpaMode=args.gpa_mode,
+    tolerance=args.tolerance, maxIterations=args.max_iterations, pcaMethod=args.pca_method,
+    pcaComponents=args.pca_components, memmap=args.memmap, chunkSize=args.chunk_size, useCache=args.use_cache,
+    outputFolderName=args.name, slideSemiLandmarks=args.slide, slidingTangents=args.sliding_tangents,
+    executor=args.executor, workers=args.workers, workerAddresses=[gpa_distributed.parseAddress(address) for address in args.worker],
+    authkey=args.authkey)
+  try:
+    results = GPALogic().runAnalysis(inputPaths, args.output, options)
+  except ValueError as error:
+    print(error)
+    return 1
+  for phase, seconds in results.phaseTimes.items():
+    print(f"{phase}: {seconds:.3f}s")
+  if results.outputFolder is None:
+    return 1
+  print("Results written to " + results.outputFolder)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
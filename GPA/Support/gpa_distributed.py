@@ -0,0 +1,318 @@
+import os
+import queue
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import Support.gpa_lib as gpa_lib
+
+# GPA + PCA as map-reduce over shards of specimens, for cohorts that do not fit on one machine.
+# Map: a worker reads one shard, aligns it to the broadcast mean shape chunkSize specimens at a time and emits the
+# moments of the aligned coordinates (count, mean and, on the last pass, the scatter matrix around that mean).
+# Reduce: moments are merged pairwise with the update of Chan, Golub and LeVeque, which combines means and scatter
+# matrices around their own means instead of raw sums of squares, so no large terms cancel.
+# A shard is a dictionary naming its specimen range (start, stop) and its data: 'path' of a .npy landmark array
+# that every worker can open (e.g. on a shared file system), 'files' and 'keepIndex' of landmark files, or
+# 'array' holding the landmarks themselves. Shards only carry this description, the mean shape is the only
+# other data sent to the workers on every pass.
+# Workers only read the shared .npy file. Aligned landmarks are written into a memory-mapped output file by the
+# workers of same-host executors only: the array is specimens last, so every shard touches every page of the file,
+# and workers on other hosts writing back whole pages over a network file system would overwrite each other.
+# Socket workers send their aligned shards back to the driver, which writes them.
+# The executor is anything with map(function, *iterables): InProcessExecutor, a ThreadPoolExecutor (alignment is
+# LAPACK bound and releases the GIL), a ProcessPoolExecutor whose workers can import the Support package (not the
+# case for processes spawned by Slicer), or a SocketExecutor connected to workers started on other hosts with
+#   python -m Support.gpa_distributed --listen <host:port> --authkey <key>
+# from the GPA module folder. Workers unpickle the tasks they receive, so they must only listen on trusted
+# networks; the authkey authenticates the client before anything is unpickled.
+
+DISTRIBUTED_EXECUTORS = ('inprocess', 'thread', 'process', 'socket')
+
+################# Shards
+def arrayShards(monsters, shardSize):
+  """
+  Shards of a (landmarks x 3 x specimens) array, by path when it is memory-mapped from a .npy file, otherwise
+  holding a view of their specimen range. Nothing is copied for in-process and thread executors, process and
+  socket executors copy a shard when they pickle it for a task.
+  """
+  k = monsters.shape[2]
+  path = getattr(monsters, 'filename', None)
+  shards = []
+  for chunk in gpa_lib.specimenChunks(k, shardSize):
+    shard = {'start': chunk.start, 'stop': chunk.stop}
+    if path is not None and isinstance(monsters, np.memmap):
+      shard['path'] = os.fspath(path)
+    else:
+      shard['array'] = monsters[:,:,chunk]
+    shards.append(shard)
+  return shards
+
+def fileShards(filePathList, keepIndex, shardSize):
+  return [{'start': chunk.start, 'stop': chunk.stop, 'files': filePathList[chunk], 'keepIndex': np.asarray(keepIndex)}
+    for chunk in gpa_lib.specimenChunks(len(filePathList), shardSize)]
+
+def shardChunks(shard, chunkSize=None):
+  """
+  Chunk reader (see gpa_lib.streamingProcrustes) of the raw landmarks of a shard, with slices relative to the shard
+  """
+  if 'files' in shard:
+    import Support.landmark_io as landmark_io
+    return landmark_io.landmarkFileChunks(shard['files'], shard['keepIndex'], chunkSize or len(shard['files']))()
+  if 'path' in shard:
+    monsters = np.load(shard['path'], mmap_mode='r')[:,:,shard['start']:shard['stop']]
+  else:
+    monsters = shard['array']
+  return gpa_lib.arrayChunks(monsters, chunkSize)()
+
+################# Moments
+# Moments are (count, mean shape, scatter matrix of the flattened (makeTwoDim) coordinates or None)
+def blockMoments(block, withScatter):
+  i,j,k = block.shape
+  mean = block.mean(axis=2)
+  scatter = None
+  if withScatter:
+    centered = gpa_lib.makeTwoDim(block) - gpa_lib.makeTwoDim(mean.reshape(i,j,1))
+    scatter = np.dot(centered, centered.T)
+  return k, mean, scatter
+
+def combineMoments(first, second):
+  countA, meanA, scatterA = first
+  countB, meanB, scatterB = second
+  if countA == 0:
+    return second
+  if countB == 0:
+    return first
+  count = countA + countB
+  delta = meanB - meanA
+  mean = meanA + delta*(countB/float(count))
+  scatter = None
+  if scatterA is not None and scatterB is not None:
+    deltaVec = delta.T.ravel() # makeTwoDim order
+    scatter = scatterA + scatterB + np.outer(deltaVec, deltaVec)*(countA*countB/float(count))
+  return count, mean, scatter
+
+def reduceMoments(moments):
+  """
+  Pairwise (tree) reduction of a list of moments
+  """
+  moments = list(moments)
+  while len(moments) > 1:
+    pairs = [combineMoments(moments[index], moments[index+1]) for index in range(0, len(moments)-1, 2)]
+    moments = pairs + moments[len(pairs)*2:]
+  return moments[0]
+
+################# Map tasks
+def firstSpecimen(shard, scale):
+  for chunk, block in shardChunks(shard, 1):
+    block = gpa_lib.centerShapes(block)
+    return gpa_lib.scaleShapes(block)[:,:,0] if scale else block[:,:,0]
+
+def alignShard(shard, mean, scale, withScatter=False, chunkSize=None, outputPath=None, returnAligned=False):
+  """
+  Map task: align the shard to the mean shape chunk by chunk. Returns the moments of the aligned coordinates,
+  the centroid sizes of the specimens and, when returnAligned is set, the aligned landmarks. The aligned landmarks
+  are written to the specimen range of the shard in the .npy file outputPath when given.
+  """
+  normalize = (lambda block: gpa_lib.scaleShapes(gpa_lib.centerShapes(block))) if scale else gpa_lib.centerShapes
+  align = gpa_lib.procrustesAlignBatch if scale else gpa_lib.procrustesAlignBatchNoScale
+  output = np.load(outputPath, mmap_mode='r+') if outputPath is not None else None
+  moments = []
+  sizes = []
+  alignedBlocks = []
+  for chunk, block in shardChunks(shard, chunkSize):
+    sizes.append(np.linalg.norm(gpa_lib.centerShapes(block), axis=(0,1)))
+    block = align(mean, normalize(block))
+    moments.append(blockMoments(block, withScatter))
+    if output is not None:
+      output[:,:,shard['start']+chunk.start:shard['start']+chunk.stop] = block
+    if returnAligned:
+      alignedBlocks.append(block)
+  if output is not None:
+    output.flush()
+  aligned = np.concatenate(alignedBlocks, axis=2) if returnAligned else None
+  return reduceMoments(moments), np.concatenate(sizes), aligned
+
+################# Driver
+def distributedProcrustes(shards, scale, executor=None, tolerance=0.0001, maxIterations=5, callback=None,
+  chunkSize=None, output=None):
+  """
+  GPA of the specimens in the shards (in specimen order), following gpa_lib.streamingProcrustes with the passes
+  mapped over the shards by the executor (InProcessExecutor by default).
+  output receives the aligned landmarks: a .npy memory-mapped array that workers of same-host executors open by
+  path, or any array that the aligned shards are sent back to (always the case for a SocketExecutor).
+  Returns the aligned landmarks (output, or None), the mean shape, the scatter matrix of the aligned coordinates,
+  the centroid size of every specimen and a convergence record.
+  """
+  executor = executor or InProcessExecutor()
+  convergence = {'mode': 'distributed', 'scale': scale, 'tolerance': tolerance, 'maxIterations': maxIterations,
+    'iterations': 0, 'converged': False, 'meanShapeDelta': [], 'passes': 0, 'shards': len(shards), 'phaseTimes': {}}
+  phaseTimes = convergence['phaseTimes']
+  def mapShards(mean, withScatter=False, outputPath=None, returnAligned=False):
+    convergence['passes'] += 1
+    count = len(shards)
+    return list(executor.map(alignShard, shards, [mean]*count, [scale]*count, [withScatter]*count, [chunkSize]*count,
+      [outputPath]*count, [returnAligned]*count))
+
+  startTime = time.perf_counter()
+  reference = list(executor.map(firstSpecimen, shards[:1], [scale]))[0]
+  results = mapShards(reference)
+  sizes = np.concatenate([result[1] for result in results])
+  initialMeanShape = reduceMoments([result[0] for result in results])[1]
+  if scale:
+    initialMeanShape = gpa_lib.scaleShape(initialMeanShape)
+  phaseTimes['initialAlignment'] = time.perf_counter() - startTime
+  phaseStart = time.perf_counter()
+  alignedTo = reference
+  currentMeanShape = initialMeanShape
+  diff=np.inf
+  tries=0
+  while diff>tolerance and tries<maxIterations:
+    alignedTo = initialMeanShape
+    currentMeanShape = reduceMoments([result[0] for result in mapShards(initialMeanShape)])[1]
+    diff=np.linalg.norm(initialMeanShape-currentMeanShape)
+    initialMeanShape=currentMeanShape
+    tries=tries+1
+    convergence['meanShapeDelta'].append(float(diff))
+    if callback is not None:
+      callback(tries, diff, currentMeanShape)
+  phaseTimes['refinement'] = time.perf_counter() - phaseStart
+
+  phaseStart = time.perf_counter()
+  outputPath = None
+  if isinstance(output, np.memmap) and output.filename is not None and not isinstance(executor, SocketExecutor):
+    output.flush()
+    outputPath = os.fspath(output.filename)
+  results = mapShards(alignedTo, True, outputPath, output is not None and outputPath is None)
+  count, meanShape, scatter = reduceMoments([result[0] for result in results])
+  if outputPath is None and output is not None:
+    for shard, result in zip(shards, results):
+      output[:,:,shard['start']:shard['stop']] = result[2]
+  phaseTimes['output'] = time.perf_counter() - phaseStart
+  phaseTimes['total'] = time.perf_counter() - startTime
+  convergence['iterations'] = tries
+  convergence['converged'] = bool(diff<=tolerance)
+  return output, currentMeanShape, scatter, sizes, convergence
+
+################# Executors
+class InProcessExecutor:
+  """
+  Runs the map tasks one after the other in the calling process
+  """
+
+  def map(self, function, *iterables):
+    return map(function, *iterables)
+
+  def shutdown(self, wait=True):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+
+class SocketExecutor:
+  """
+  Runs the map tasks on the workers listening at addresses ((host, port) tuples, see serveWorker), one task per
+  worker at a time. Functions are sent by reference, so workers must be able to import this module.
+  """
+
+  def __init__(self, addresses, authkey):
+    if isinstance(authkey, str):
+      authkey = authkey.encode()
+    self.connections = queue.Queue()
+    self.connectionList = [Client(tuple(address), authkey=authkey) for address in addresses]
+    for connection in self.connectionList:
+      self.connections.put(connection)
+    self.pool = ThreadPoolExecutor(max_workers=len(self.connectionList))
+
+  def runTask(self, function, args):
+    connection = self.connections.get()
+    try:
+      connection.send((function, args))
+      status, result = connection.recv()
+    finally:
+      self.connections.put(connection)
+    if status == 'error':
+      raise RuntimeError("Worker task failed:\n" + result)
+    return result
+
+  def map(self, function, *iterables):
+    futures = [self.pool.submit(self.runTask, function, args) for args in zip(*iterables)]
+    return (future.result() for future in futures)
+
+  def shutdown(self, wait=True):
+    self.pool.shutdown(wait)
+    for connection in self.connectionList:
+      try:
+        connection.send(None)
+        connection.close()
+      except OSError:
+        pass
+    self.connectionList = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+
+def makeExecutor(executor='inprocess', workers=None, addresses=None, authkey=None):
+  """
+  Executor for distributedProcrustes: 'inprocess', 'thread' (a pool of workers threads), 'process' (a pool of
+  workers local processes) or 'socket' (workers listening at addresses with authkey)
+  """
+  if executor == 'inprocess':
+    return InProcessExecutor()
+  if executor == 'thread':
+    return ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+  if executor == 'process':
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+  if executor == 'socket':
+    if not addresses or not authkey:
+      raise ValueError("The socket executor needs worker addresses and an authkey")
+    return SocketExecutor(addresses, authkey)
+  raise ValueError(f"Unknown executor '{executor}', expected one of {DISTRIBUTED_EXECUTORS}")
+
+def serveWorker(address, authkey, connections=None):
+  """
+  Worker loop: accept a client at address (host, port), run the (function, args) tasks it sends and send back
+  ('result', value) or ('error', traceback) until it disconnects. Serves connections clients, or forever if None.
+  """
+  if isinstance(authkey, str):
+    authkey = authkey.encode()
+  served = 0
+  with Listener(tuple(address), authkey=authkey) as listener:
+    while connections is None or served < connections:
+      with listener.accept() as connection:
+        while True:
+          try:
+            task = connection.recv()
+          except EOFError:
+            break
+          if task is None:
+            break
+          function, args = task
+          try:
+            reply = ('result', function(*args))
+          except Exception:
+            reply = ('error', traceback.format_exc())
+          connection.send(reply)
+      served += 1
+
+def parseAddress(text):
+  host, _, port = text.rpartition(':')
+  return host or 'localhost', int(port)
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="GPA map-reduce worker")
+  parser.add_argument("--listen", required=True, help="host:port to listen on")
+  parser.add_argument("--authkey", default=os.environ.get("GPA_WORKER_AUTHKEY"),
+    help="Shared secret of the clients, GPA_WORKER_AUTHKEY by default")
+  args = parser.parse_args()
+  if not args.authkey:
+    sys.exit("An authkey is required")
+  serveWorker(parseAddress(args.listen), args.authkey)
@@ -2,33 +2,63 @@ import numpy as np
 import os
 import fnmatch
 import scipy.linalg as sp
+import time
 
 # PCA
 def makeTwoDim(monsters):
+    """
+    (landmarks*3 x specimens) array with the column of every specimen ordered as all x, all y, all z coordinates.
+    Returns a view for Fortran ordered input, otherwise a single copy.
+    """
     i,j,k=monsters.shape
-    tmp=np.zeros((i*j,k))
-    for x in range(k):
-        vec=np.reshape(monsters[:,:,x],(i*j),order='F')
-        tmp[:,x]=vec
-    return tmp
+    return np.reshape(np.transpose(monsters,(1,0,2)),(i*j,k))
 
 def calcMean(vec):
-    i,j=vec.shape
-    meanVec=np.zeros(i)
-    for x in range(j):
-        meanVec+=vec[:,x]/float(j)
-    return meanVec
+    return vec.mean(axis=1)
 
 def calcCov(vec):
     i,j=vec.shape
-    meanVec=calcMean(vec)
-    covMatrix=np.zeros((i,i))
-    for x in range(j):
-        t1=((vec[:,x]-meanVec).T).reshape(i,1)
-        t2=(vec[:,x]-meanVec).reshape(1,i)
-        covMatrix+=np.dot(t1,t2)/float(j)
+    centered=vec-calcMean(vec).reshape(i,1)
+    covMatrix=np.dot(centered,centered.T)/float(j)
     return covMatrix
 
+def calcEigenSVD(vec):
+    """
+    Eigenvalues and eigenvectors of the covariance of vec (observations x samples), sorted by decreasing
+    eigenvalue, computed from a thin SVD of the centered data so the covariance matrix is never formed.
+    Returns min(observations, samples) components, matching the eigh based calculation up to sign.
+    """
+    i,j=vec.shape
+    centered=vec-calcMean(vec).reshape(i,1)
+    u,s,v=sp.svd(centered, full_matrices=False)
+    return s**2/float(j), u
+
+def calcEigenRandomized(vec, components, powerIterations=4, oversampling=10, seed=0):
+    """
+    Leading eigenvalues and eigenvectors of the covariance of vec (observations x samples) computed with a
+    randomized truncated SVD of the centered data (Halko, Martinsson and Tropp, 2011).
+    Accuracy is controlled by powerIterations: each subspace iteration sharpens the separation of the leading
+    components from the rest of the spectrum, so the error drops geometrically with the ratio of the
+    (components+1)-th to the components-th singular value. 4 iterations with the default oversampling of 10 extra
+    basis vectors matches the exact eigenvalues to several significant digits for typical morphometric data.
+    Also returns the total variance (trace of the covariance) so percent variance can be computed from a
+    truncated spectrum.
+    """
+    i,j=vec.shape
+    centered=vec-calcMean(vec).reshape(i,1)
+    totalVariance=np.sum(centered**2)/float(j)
+    rank=min(i,j)
+    components=min(components,rank)
+    basisSize=min(components+oversampling,rank)
+    rng=np.random.default_rng(seed)
+    q,r=np.linalg.qr(np.dot(centered,rng.standard_normal((j,basisSize))))
+    for iteration in range(powerIterations):
+      q,r=np.linalg.qr(np.dot(centered.T,q))
+      q,r=np.linalg.qr(np.dot(centered,q))
+    u,s,v=sp.svd(np.dot(q.T,centered), full_matrices=False)
+    u=np.dot(q,u)
+    return s[:components]**2/float(j), u[:,:components], totalVariance
+
 def sortEig(eVal, eVec):
     i,j=eVec.shape
     ePair=list(range(j))
@@ -57,6 +87,17 @@ def makeTransformMatrix(ePair,pcA,pcB):
     transform[:,1]=vec2.reshape(i).real
     return transform
 
+def projectScores(monsters, eigVec, chunkSize=None):
+    """
+    PC scores of every specimen: the flattened (makeTwoDim) coordinates projected on the eigenvectors,
+    computed chunkSize specimens at a time.
+    """
+    i,j,k=monsters.shape
+    scores=np.zeros((k,eigVec.shape[1]))
+    for chunk in specimenChunks(k, chunkSize):
+        scores[chunk,:]=np.real(np.dot(np.transpose(makeTwoDim(monsters[:,:,chunk])),eigVec))
+    return scores
+
 def plotTanProj(monsters,pcA,pcB):
     i, j, k = monsters.shape
     twoDim=makeTwoDim(monsters)
@@ -104,36 +145,282 @@ def alignShape(refShape,shape):
     shape=np.dot(shape,rotationMatrix)
     return shape
 
-def meanShape(monsters):
-    return monsters.mean(axis=2)
+def meanShape(monsters, chunkSize=None):
+    if chunkSize is None:
+        return monsters.mean(axis=2)
+    i,j,k=monsters.shape
+    total=np.zeros((i,j))
+    for chunk in specimenChunks(k, chunkSize):
+        total+=monsters[:,:,chunk].sum(axis=2)
+    return total/float(k)
+
+def specimenChunks(specimenNumber, chunkSize=None):
+    """
+    Yield slices covering the specimen axis in blocks of chunkSize specimens (a single block if chunkSize is None).
+    Used to stream over landmark arrays that are memory-mapped from disk.
+    """
+    if chunkSize is None:
+        chunkSize=max(specimenNumber,1)
+    for start in range(0, specimenNumber, chunkSize):
+        yield slice(start, min(start+chunkSize, specimenNumber))
+
+def centroidSizes(monsters, chunkSize=None):
+    i,j,k=monsters.shape
+    sizes=np.zeros(k)
+    for chunk in specimenChunks(k, chunkSize):
+        sizes[chunk]=np.linalg.norm(centerShapes(monsters[:,:,chunk]), axis=(0,1))
+    return sizes
+
+def calcEigenChunked(monsters, chunkSize):
+    """
+    Eigenvalues and eigenvectors of the covariance of the flattened (makeTwoDim) landmark array, accumulating the
+    scatter matrix over blocks of specimens so the flattened data is never held in memory at once.
+    Returns min(observations, samples) components sorted by decreasing eigenvalue.
+    """
+    i,j,k=monsters.shape
+    meanVec=makeTwoDim(meanShape(monsters, chunkSize).reshape(i,j,1))[:,0]
+    scatter=np.zeros((i*j,i*j))
+    for chunk in specimenChunks(k, chunkSize):
+        centered=makeTwoDim(monsters[:,:,chunk])-meanVec.reshape(i*j,1)
+        scatter+=np.dot(centered,centered.T)
+    return eigenFromScatter(scatter, k)
+
+def eigenFromScatter(scatter, samples):
+    """
+    Eigenvalues and eigenvectors of the covariance given by the scatter matrix of samples samples (e.g. from
+    streamingProcrustes), min(observations, samples) components sorted by decreasing eigenvalue.
+    """
+    eigVal,eigVec=sp.eigh(scatter/float(samples))
+    components=min(len(scatter),samples)
+    return eigVal[::-1][:components], eigVec[:,::-1][:,:components]
 
-def procDist(monsters,mshape):
+def procDist(monsters,mshape,chunkSize=None):
+    # differences are only formed one specimen chunk at a time
     i,j,k=monsters.shape
     procDists=np.zeros(k)
-    for x in range(k):
-        tmp=monsters[:,:,x]-mshape
-        procDists[x]=np.linalg.norm(tmp,'fro')
+    for chunk in specimenChunks(k, chunkSize):
+        difference=monsters[:,:,chunk]-mshape[:,:,np.newaxis]
+        procDists[chunk]=np.sqrt(np.einsum('ijk,ijk->k',difference,difference))
     return procDists
 
+################# GPA batched
+# The batched engine operates on the whole (landmarks x 3 x specimens) stack at once. Specimen rotations are
+# found from the stacked 3x3 cross-covariance matrices with a single batched SVD.
+GPA_MODES = ('batch', 'loop')
+
+def centerShapes(allLandmarkSets):
+  return allLandmarkSets - allLandmarkSets.mean(axis=0, keepdims=True)
+
+def scaleShapes(allLandmarkSets):
+  return allLandmarkSets / np.linalg.norm(allLandmarkSets, axis=(0,1), keepdims=True)
+
+def alignShapes(refShape, allLandmarkSets):
+  """
+  Align every shape in the stack to the reference shape, solely by rotation.
+  Batched equivalent of alignShape.
+  """
+  stack = np.moveaxis(allLandmarkSets, 2, 0)
+  crossCov = np.matmul(np.transpose(refShape), stack)
+  u,s,v = np.linalg.svd(crossCov)
+  rotationMatrices = np.matmul(np.transpose(v, (0,2,1)), np.transpose(u, (0,2,1)))
+  return np.moveaxis(np.matmul(stack, rotationMatrices), 0, 2)
+
+# The batched steps update the stack in place, chunkSize specimens at a time when set (e.g. for memory-mapped arrays)
+def procrustesAlignBatch(mean, allLandmarkSets, chunkSize=None):
+  return procrustesAlignBatchNoScale(scaleShape(mean), allLandmarkSets, chunkSize)
+
+def procrustesAlignBatchNoScale(mean, allLandmarkSets, chunkSize=None):
+  mean = np.array(mean)
+  for chunk in specimenChunks(allLandmarkSets.shape[2], chunkSize):
+    allLandmarkSets[:,:,chunk] = alignShapes(mean, allLandmarkSets[:,:,chunk])
+  return allLandmarkSets
+
+def applyCenterScaleBatch(allLandmarkSets, chunkSize=None):
+  for chunk in specimenChunks(allLandmarkSets.shape[2], chunkSize):
+    allLandmarkSets[:,:,chunk] = scaleShapes(centerShapes(allLandmarkSets[:,:,chunk]))
+  return allLandmarkSets
+
+def applyCenterBatch(allLandmarkSets, chunkSize=None):
+  for chunk in specimenChunks(allLandmarkSets.shape[2], chunkSize):
+    allLandmarkSets[:,:,chunk] = centerShapes(allLandmarkSets[:,:,chunk])
+  return allLandmarkSets
+
+def gpaSteps(mode, scale, chunkSize=None):
+  """
+  Return the (centering, alignment) functions for the requested GPA engine.
+  'batch' processes the whole stack at once (or chunkSize specimens at a time), 'loop' is the original
+  per-specimen reference implementation.
+  """
+  if mode == 'batch':
+    if scale:
+      center, align = applyCenterScaleBatch, procrustesAlignBatch
+    else:
+      center, align = applyCenterBatch, procrustesAlignBatchNoScale
+    return (lambda allLandmarkSets: center(allLandmarkSets, chunkSize),
+      lambda mean, allLandmarkSets: align(mean, allLandmarkSets, chunkSize))
+  elif mode == 'loop':
+    if scale:
+      return applyCenterScaleLoop, procrustesAlign
+    return applyCenterLoop, procrustesAlignNoScale
+  raise ValueError(f"Unknown GPA mode '{mode}', expected one of {GPA_MODES}")
+
 ################# GPA update
-def runGPA(allLandmarkSets):
-  i,j,k=allLandmarkSets.shape
-  for index in range(k):
-    landmarkSet=allLandmarkSets[:,:,index]
-    tempSet = applyCenterScale(landmarkSet)
-    allLandmarkSets[:,:,index]=tempSet
-  allLandmarkSets = procrustesAlign(allLandmarkSets[:,:,0],allLandmarkSets)
-  initialMeanShape=meanShape(allLandmarkSets)
-  initialMeanShape = scaleShape(initialMeanShape)
-  diff=1
+# runGPA and runGPANoScale iterate the mean shape until the change between iterations drops below tolerance or
+# maxIterations is reached. callback(iteration, meanShapeDelta, meanShape) is called after every iteration.
+# slide(meanShape, allLandmarkSets), when given, moves semi-landmarks in place before every alignment to the mean
+# shape (see gpa_sliding), and the specimens are centered again afterwards.
+# Both return the aligned landmarks, the mean shape and a convergence record (see generalizedProcrustes).
+def runGPA(allLandmarkSets, mode='batch', tolerance=0.0001, maxIterations=5, callback=None, chunkSize=None,
+  slide=None):
+  return generalizedProcrustes(allLandmarkSets, True, mode, tolerance, maxIterations, callback, chunkSize, slide)
+
+def runGPANoScale(allLandmarkSets, mode='batch', tolerance=0.0001, maxIterations=5, callback=None, chunkSize=None,
+  slide=None):
+  return generalizedProcrustes(allLandmarkSets, False, mode, tolerance, maxIterations, callback, chunkSize, slide)
+
+def generalizedProcrustes(allLandmarkSets, scale, mode, tolerance, maxIterations, callback=None, chunkSize=None,
+  slide=None):
+  """
+  Returns the aligned landmarks, the mean shape and a convergence record dictionary with the number of
+  iterations used, the mean shape delta of each iteration and the wall time in seconds of each phase.
+  """
+  center, align = gpaSteps(mode, scale, chunkSize)
+  convergence = {'mode': mode, 'scale': scale, 'tolerance': tolerance, 'maxIterations': maxIterations,
+    'iterations': 0, 'converged': False, 'meanShapeDelta': [], 'phaseTimes': {}}
+  phaseTimes = convergence['phaseTimes']
+  startTime = time.perf_counter()
+  center(allLandmarkSets)
+  phaseTimes['centering'] = time.perf_counter() - startTime
+  phaseStart = time.perf_counter()
+  allLandmarkSets = align(allLandmarkSets[:,:,0],allLandmarkSets)
+  initialMeanShape=meanShape(allLandmarkSets, chunkSize)
+  if scale:
+    initialMeanShape = scaleShape(initialMeanShape)
+  phaseTimes['initialAlignment'] = time.perf_counter() - phaseStart
+  phaseStart = time.perf_counter()
+  currentMeanShape = initialMeanShape
+  diff=np.inf
   tries=0
-  while diff>0.0001 and tries<5:
-    allLandmarkSets = procrustesAlign(initialMeanShape,allLandmarkSets)
-    currentMeanShape=meanShape(allLandmarkSets)
+  if slide is not None:
+    phaseTimes['sliding'] = 0.0
+  while diff>tolerance and tries<maxIterations:
+    if slide is not None:
+      slideStart = time.perf_counter()
+      slide(initialMeanShape, allLandmarkSets)
+      center(allLandmarkSets)
+      phaseTimes['sliding'] += time.perf_counter() - slideStart
+    allLandmarkSets = align(initialMeanShape,allLandmarkSets)
+    currentMeanShape=meanShape(allLandmarkSets, chunkSize)
     diff=np.linalg.norm(initialMeanShape-currentMeanShape)
     initialMeanShape=currentMeanShape
     tries=tries+1
-  return allLandmarkSets, currentMeanShape
+    convergence['meanShapeDelta'].append(float(diff))
+    if callback is not None:
+      callback(tries, diff, currentMeanShape)
+  phaseTimes['refinement'] = time.perf_counter() - phaseStart
+  phaseTimes['total'] = time.perf_counter() - startTime
+  convergence['iterations'] = tries
+  convergence['converged'] = bool(diff<=tolerance)
+  return allLandmarkSets, currentMeanShape, convergence
+
+def convergenceSummary(convergence):
+  """
+  Format a convergence record returned by runGPA/runGPANoScale as human readable text.
+  """
+  deltas = ", ".join(f"{delta:.3g}" for delta in convergence['meanShapeDelta'])
+  times = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in convergence['phaseTimes'].items())
+  status = "converged" if convergence['converged'] else "did not converge"
+  return (f"GPA ({convergence['mode']}) {status} after {convergence['iterations']} of {convergence['maxIterations']} "
+    f"iterations (tolerance {convergence['tolerance']:g})\n"
+    f"Mean shape delta per iteration: {deltas}\n"
+    f"Phase times: {times}")
+
+################# GPA streaming
+# The streaming engine holds one chunk of specimens in memory at a time. readChunks() returns an iterable of
+# (slice, raw landmarks x 3 x specimens block) covering all specimens and is called once per pass, so specimens can
+# come from a memory-mapped array (arrayChunks) or be parsed from the landmark files on every pass
+# (landmark_io.landmarkFileChunks). Every iteration aligns the raw chunks to the current mean shape and only keeps
+# their sum, nothing is written back. The rotation to the mean does not depend on the starting orientation of a
+# specimen, so the alignment matches the batch engine with the same chunk size. A final pass aligns to the mean of
+# the last iteration, writes the aligned specimens to output when given and accumulates the scatter matrix of the
+# flattened (makeTwoDim) coordinates for the PCA (see eigenFromScatter).
+def arrayChunks(monsters, chunkSize=None):
+  return lambda: ((chunk, np.array(monsters[:,:,chunk])) for chunk in specimenChunks(monsters.shape[2], chunkSize))
+
+def streamingProcrustes(readChunks, scale, tolerance=0.0001, maxIterations=5, callback=None, output=None):
+  """
+  Returns the aligned landmarks (output, or None), the mean shape, the scatter matrix of the aligned coordinates,
+  the centroid size of every specimen and a convergence record (see generalizedProcrustes) that also counts the
+  passes over the data.
+  """
+  normalize = (lambda block: scaleShapes(centerShapes(block))) if scale else centerShapes
+  align = procrustesAlignBatch if scale else procrustesAlignBatchNoScale
+  convergence = {'mode': 'streaming', 'scale': scale, 'tolerance': tolerance, 'maxIterations': maxIterations,
+    'iterations': 0, 'converged': False, 'meanShapeDelta': [], 'passes': 0, 'phaseTimes': {}}
+  phaseTimes = convergence['phaseTimes']
+  def alignedChunks(mean):
+    convergence['passes'] += 1
+    for chunk, block in readChunks():
+      yield chunk, align(mean, normalize(block))
+  def alignedMean(mean):
+    total = 0
+    count = 0
+    for chunk, block in alignedChunks(mean):
+      total = total + block.sum(axis=2)
+      count += block.shape[2]
+    return total/float(count)
+
+  # first pass: centroid sizes and alignment to the first specimen
+  startTime = time.perf_counter()
+  sizes = []
+  total = 0
+  count = 0
+  reference = None
+  convergence['passes'] += 1
+  for chunk, block in readChunks():
+    sizes.append(np.linalg.norm(centerShapes(block), axis=(0,1)))
+    block = normalize(block)
+    if reference is None:
+      reference = np.array(block[:,:,0])
+    total = total + align(reference, block).sum(axis=2)
+    count += block.shape[2]
+  initialMeanShape = total/float(count)
+  if scale:
+    initialMeanShape = scaleShape(initialMeanShape)
+  phaseTimes['initialAlignment'] = time.perf_counter() - startTime
+  phaseStart = time.perf_counter()
+  alignedTo = reference
+  currentMeanShape = initialMeanShape
+  diff=np.inf
+  tries=0
+  while diff>tolerance and tries<maxIterations:
+    alignedTo = initialMeanShape
+    currentMeanShape=alignedMean(initialMeanShape)
+    diff=np.linalg.norm(initialMeanShape-currentMeanShape)
+    initialMeanShape=currentMeanShape
+    tries=tries+1
+    convergence['meanShapeDelta'].append(float(diff))
+    if callback is not None:
+      callback(tries, diff, currentMeanShape)
+  phaseTimes['refinement'] = time.perf_counter() - phaseStart
+
+  # final pass: aligned output and scatter matrix around the mean shape
+  phaseStart = time.perf_counter()
+  i,j = currentMeanShape.shape
+  meanVec = makeTwoDim(currentMeanShape.reshape(i,j,1))
+  scatter = np.zeros((i*j,i*j))
+  for chunk, block in alignedChunks(alignedTo):
+    if output is not None:
+      output[:,:,chunk] = block
+    centered = makeTwoDim(block) - meanVec
+    scatter += np.dot(centered, centered.T)
+  if isinstance(output, np.memmap):
+    output.flush()
+  phaseTimes['output'] = time.perf_counter() - phaseStart
+  phaseTimes['total'] = time.perf_counter() - startTime
+  convergence['iterations'] = tries
+  convergence['converged'] = bool(diff<=tolerance)
+  return output, currentMeanShape, scatter, np.concatenate(sizes), convergence
 
 def procrustesAlign(mean, allLandmarkSets):
   mean = scaleShape(mean)
@@ -147,23 +434,11 @@ def applyCenterScale(landmarkSet):
   landmarkSet=scaleShape(landmarkSet)
   return landmarkSet
 
-def runGPANoScale(allLandmarkSets):
+def applyCenterScaleLoop(allLandmarkSets):
   i,j,k=allLandmarkSets.shape
   for index in range(k):
-    landmarkSet=allLandmarkSets[:,:,index]
-    tempSet = applyCenter(landmarkSet)
-    allLandmarkSets[:,:,index]=tempSet
-  allLandmarkSets = procrustesAlignNoScale(allLandmarkSets[:,:,0],allLandmarkSets)
-  initialMeanShape=meanShape(allLandmarkSets)
-  diff=1
-  tries=0
-  while diff>0.0001 and tries<5:
-    allLandmarkSets = procrustesAlignNoScale(initialMeanShape,allLandmarkSets)
-    currentMeanShape=meanShape(allLandmarkSets)
-    diff=np.linalg.norm(initialMeanShape-currentMeanShape)
-    initialMeanShape=currentMeanShape
-    tries=tries+1
-  return allLandmarkSets, currentMeanShape
+    allLandmarkSets[:,:,index] = applyCenterScale(allLandmarkSets[:,:,index])
+  return allLandmarkSets
 
 def procrustesAlignNoScale(mean, allLandmarkSets):
   i,j,k=allLandmarkSets.shape
@@ -174,3 +449,152 @@ def procrustesAlignNoScale(mean, allLandmarkSets):
 def applyCenter(landmarkSet):
   landmarkSet=centerShape(landmarkSet)
   return landmarkSet
+
+def applyCenterLoop(allLandmarkSets):
+  i,j,k=allLandmarkSets.shape
+  for index in range(k):
+    allLandmarkSets[:,:,index] = applyCenter(allLandmarkSets[:,:,index])
+  return allLandmarkSets
+
+################# Incremental update
+# Specimens added to an existing analysis are aligned to the stored mean shape and folded into the mean and PCA
+# without revisiting the existing specimens.
+def alignToMeanShape(mean, allLandmarkSets, scale, chunkSize=None):
+  """
+  Center (and scale) the new specimens in place and align them to the mean shape of an existing analysis
+  """
+  center, align = gpaSteps('batch', scale, chunkSize)
+  center(allLandmarkSets)
+  return align(mean, allLandmarkSets)
+
+def updateEigen(mean, eigVal, eigVec, count, newVec, totalVariance=None):
+  """
+  Incremental SVD update of the PCA of count samples with the new samples in the columns of newVec
+  (observations x samples). mean, eigVal and eigVec describe the covariance of the original samples as returned
+  by calcEigen*. The updated covariance is factored from a thin SVD of the scaled eigenvectors, the centered new
+  samples and the mean shift (Ross et al., 2008), which is exact when all components of the original data are
+  kept. Returns the updated mean, eigenvalues, eigenvectors and total variance.
+  """
+  i,newCount=newVec.shape
+  total=count+newCount
+  eigVal=np.clip(np.real(eigVal),0,None)
+  eigVec=np.real(eigVec)
+  if totalVariance is None:
+    totalVariance=eigVal.sum()
+  newMean=calcMean(newVec)
+  centered=newVec-newMean.reshape(i,1)
+  meanShift=np.sqrt(count*newCount/float(total))*(newMean-mean)
+  u,s,v=sp.svd(np.column_stack((eigVec*np.sqrt(count*eigVal), centered, meanShift)), full_matrices=False)
+  components=eigVec.shape[1]
+  if components>=min(i,count):
+    # the original spectrum was complete, so the updated one can be as well
+    components=min(i,total)
+  scatter=count*totalVariance+np.sum(centered**2)+np.sum(meanShift**2)
+  updatedMean=(count*mean+newCount*newMean)/float(total)
+  return updatedMean, s[:components]**2/float(total), u[:,:components], scatter/float(total)
+
+def matchEigenvectorSigns(referenceVec, eigVec):
+  """
+  Flip eigenvectors so they point in the same direction as the corresponding reference eigenvectors
+  """
+  components=min(referenceVec.shape[1], eigVec.shape[1])
+  signs=np.ones(eigVec.shape[1])
+  signs[:components]=np.where(np.sum(np.real(referenceVec[:,:components])*np.real(eigVec[:,:components]), axis=0)<0,-1,1)
+  return eigVec*signs
+
+def specimenDisplacements(monsters, referenceMonsters, chunkSize=None):
+  """
+  Frobenius norm of the coordinate change of every specimen between two landmark arrays
+  """
+  i,j,k=referenceMonsters.shape
+  displacements=np.zeros(k)
+  for chunk in specimenChunks(k, chunkSize):
+    displacements[chunk]=np.linalg.norm(monsters[:,:,chunk]-referenceMonsters[:,:,chunk], axis=(0,1))
+  return displacements
+
+################# Distances
+# Pairwise distances of (n x 3) point sets are computed in blocks of rows so memory stays bounded for large n.
+def distanceBlocks(points, blockElements=2**20):
+  """
+  Yield (rows, distances) for consecutive row blocks of the euclidean distance matrix of the points, with at
+  most about blockElements distances per block
+  """
+  points=np.asarray(points, dtype=np.float64)
+  n=len(points)
+  blockRows=max(1, blockElements//max(n,1))
+  for start in range(0, n, blockRows):
+    rows=slice(start, min(start+blockRows, n))
+    difference=points[rows,np.newaxis,:]-points[np.newaxis,:,:]
+    yield rows, np.sqrt(np.einsum('ijk,ijk->ij', difference, difference))
+
+def distanceMatrix(points, blockElements=2**20):
+  """
+  Full n x n euclidean distance matrix of the points, computed in row blocks
+  """
+  n=len(points)
+  distances=np.zeros((n,n))
+  for rows, block in distanceBlocks(points, blockElements):
+    distances[rows]=block
+  return distances
+
+def maximumDistance(points, blockElements=2**20):
+  """
+  Largest distance between any two points (the diameter of the point set). The diameter is attained between
+  vertices of the convex hull, so only hull vertices are compared when the hull can be built.
+  """
+  points=np.asarray(points, dtype=np.float64)
+  if len(points)>16:
+    from scipy.spatial import ConvexHull
+    try:
+      points=points[ConvexHull(points).vertices]
+    except RuntimeError:
+      # degenerate (e.g. coplanar) point sets have no 3D hull, compare all points
+      pass
+  maximum=0.0
+  for rows, block in distanceBlocks(points, blockElements):
+    maximum=max(maximum, block.max())
+  return maximum
+
+def minimumDistance(points, blockElements=2**20):
+  """
+  Smallest nonzero distance between two points
+  """
+  minimum=np.inf
+  for rows, block in distanceBlocks(points, blockElements):
+    nonzero=block[block>0]
+    if nonzero.size:
+      minimum=min(minimum, nonzero.min())
+  return minimum
+
+################# CSV output
+# The writers stream numeric blocks straight to an open text file, formatting one block of rows at a time, so no
+# object arrays or stacked copies of the data are built.
+def landmarkCoordinateHeader(landmarkNumber):
+  return ["LM " + str(landmark + 1) + "_" + axis for landmark in range(landmarkNumber) for axis in ("X", "Y", "Z")]
+
+def writeCSVHeader(outputFile, header):
+  outputFile.write(",".join(header) + "\n")
+
+def writeCSVRows(outputFile, values, rowLabels=None, fmt=None, chunkRows=1024):
+  """
+  Write the rows of a 2D numeric array as comma separated values, chunkRows rows at a time. rowLabels, when
+  given, are written as a leading text column. Numbers are written in the shortest form that reads back as the
+  same double (repr, as the np.savetxt output of string arrays this replaces), or with the %-format fmt.
+  """
+  rows, columns = values.shape
+  if fmt is None:
+    formatRow = lambda row: ",".join(map(repr, row))
+  else:
+    rowFormat = ",".join([fmt]*columns)
+    formatRow = lambda row: rowFormat % tuple(row)
+  for start in range(0, rows, chunkRows):
+    lines = map(formatRow, np.asarray(values[start:start+chunkRows], dtype=np.float64).tolist())
+    if rowLabels is not None:
+      lines = (f"{label},{line}" for label, line in zip(rowLabels[start:start+chunkRows], lines))
+    outputFile.write("".join([line + "\n" for line in lines]))
+
+def landmarkRows(monsters):
+  """
+  Per specimen rows of interleaved landmark coordinates (LM 1_X, LM 1_Y, LM 1_Z, LM 2_X, ...)
+  """
+  return np.moveaxis(monsters, 2, 0).reshape(monsters.shape[2], -1)
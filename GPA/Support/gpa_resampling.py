@@ -0,0 +1,167 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import scipy.linalg as sp
+import Support.gpa_lib as gpa_lib
+
+# Bootstrap and permutation statistics on GPA aligned landmarks (landmarks x 3 x specimens).
+# Replicates are split into tasks that run in a thread pool, the work is LAPACK bound and releases the GIL. A process
+# pool is opt-in (executor='process'): its workers must be able to import the Support package, which Slicer's
+# embedded interpreter cannot provide to spawned child processes. Every replicate draws from its own
+# child of a numpy SeedSequence, so results only depend on the seed and not on the number of workers or the
+# task size. Per-replicate summaries are written to .npy files in the output folder as tasks complete.
+
+RESAMPLING_EXECUTORS = ('process', 'thread')
+
+# data shared by the tasks of a process pool, set once in every worker process. Thread pools pass it directly.
+_workerData = {}
+
+def _initializeWorker(data):
+  _workerData.clear()
+  _workerData.update(data)
+
+def _runWorkerTask(task, start, seeds):
+  return task(_workerData, start, seeds)
+
+def replicateSeeds(seed, replicates):
+  return np.random.SeedSequence(seed).spawn(replicates)
+
+def runReplicates(task, data, replicates, seed=0, workers=None, replicatesPerTask=50, executor='thread', onResult=None):
+  """
+  Run task(data, start, seeds) over all replicates in a thread or process pool. Process workers receive data once
+  (see _workerData). onResult(start, result) is called in the calling thread as every task completes.
+  """
+  if executor not in RESAMPLING_EXECUTORS:
+    raise ValueError(f"Unknown executor '{executor}', expected one of {RESAMPLING_EXECUTORS}")
+  seeds = replicateSeeds(seed, replicates)
+  workers = workers or os.cpu_count() or 1
+  if executor == 'process':
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_initializeWorker, initargs=(data,))
+    submit = lambda start, seeds: pool.submit(_runWorkerTask, task, start, seeds)
+  else:
+    pool = ThreadPoolExecutor(max_workers=workers)
+    submit = lambda start, seeds: pool.submit(task, data, start, seeds)
+  with pool:
+    futures = [submit(start, seeds[start:start+replicatesPerTask]) for start in range(0, replicates, replicatesPerTask)]
+    for future in futures:
+      start, result = future.result()
+      if onResult is not None:
+        onResult(start, result)
+
+def openReplicateFile(outputFolder, name, shape):
+  return np.lib.format.open_memmap(os.path.join(outputFolder, name + '.npy'), mode='w+', dtype=np.float64, shape=shape)
+
+################# Bootstrap
+def procrustesFromReference(allLandmarkSets, referenceMean, scale, tolerance=0.0001, maxIterations=5):
+  """
+  GPA of the stack in place, starting from the reference mean shape instead of the first specimen so the result
+  shares the orientation of the reference analysis. Returns the aligned stack and its mean shape.
+  """
+  center, align = gpa_lib.gpaSteps('batch', scale)
+  center(allLandmarkSets)
+  meanShape = referenceMean
+  for iteration in range(maxIterations):
+    align(meanShape, allLandmarkSets)
+    currentMeanShape = allLandmarkSets.mean(axis=2)
+    diff = np.linalg.norm(meanShape - currentMeanShape)
+    meanShape = currentMeanShape
+    if diff <= tolerance:
+      break
+  return allLandmarkSets, meanShape
+
+def leadingEigen(twoDim, components):
+  """
+  Leading eigenvalues and eigenvectors of the covariance of twoDim (observations x samples), from the eigh of the
+  covariance matrix when there are more samples than observations and from a thin SVD otherwise
+  """
+  i,j=twoDim.shape
+  if j>i:
+    val,vec=sp.eigh(gpa_lib.calcCov(twoDim), subset_by_index=(i-components,i-1))
+    return val[::-1], vec[:,::-1]
+  val,vec=gpa_lib.calcEigenSVD(twoDim)
+  return val[:components], vec[:,:components]
+
+def bootstrapReplicate(aligned, rng, referenceMean, referenceVec, scale, tolerance, maxIterations):
+  """
+  Mean shape, leading eigenvalues and eigenvectors of one resample of the specimens with replacement.
+  Eigenvector signs follow the reference eigenvectors.
+  """
+  k = aligned.shape[2]
+  sample = aligned[:,:,rng.integers(0, k, k)]
+  sample, meanShape = procrustesFromReference(sample, referenceMean, scale, tolerance, maxIterations)
+  val, vec = leadingEigen(gpa_lib.makeTwoDim(sample), referenceVec.shape[1])
+  return meanShape, val, gpa_lib.matchEigenvectorSigns(referenceVec, vec)
+
+def _bootstrapTask(data, start, seeds):
+  results = [bootstrapReplicate(data['aligned'], np.random.default_rng(seed), data['referenceMean'], data['referenceVec'],
+    data['scale'], data['tolerance'], data['maxIterations']) for seed in seeds]
+  return start, tuple(np.stack(summary) for summary in zip(*results))
+
+def runBootstrap(aligned, referenceMean, referenceVec, replicates, outputFolder, scale=True, seed=0, workers=None,
+  replicatesPerTask=50, executor='thread', tolerance=0.0001, maxIterations=5, confidence=0.95):
+  """
+  Bootstrap the GPA mean shape and the PCA of the aligned landmarks. referenceVec holds the eigenvectors of the
+  components to summarize. The mean shape, eigenvalues and eigenvectors of every replicate are written to
+  bootstrapMeanShape.npy, bootstrapEigenvalues.npy and bootstrapEigenvectors.npy in outputFolder.
+  Returns the percentile confidence intervals as a dictionary of (lower, upper) arrays.
+  """
+  i, j, k = aligned.shape
+  components = referenceVec.shape[1]
+  os.makedirs(outputFolder, exist_ok=True)
+  replicateFiles = (openReplicateFile(outputFolder, 'bootstrapMeanShape', (replicates, i, j)),
+    openReplicateFile(outputFolder, 'bootstrapEigenvalues', (replicates, components)),
+    openReplicateFile(outputFolder, 'bootstrapEigenvectors', (replicates, i*j, components)))
+  def writeResult(start, result):
+    for replicateFile, summary in zip(replicateFiles, result):
+      replicateFile[start:start+len(summary)] = summary
+  data = dict(aligned=np.ascontiguousarray(aligned), referenceMean=np.asarray(referenceMean),
+    referenceVec=np.real(referenceVec), scale=scale, tolerance=tolerance, maxIterations=maxIterations)
+  runReplicates(_bootstrapTask, data, replicates, seed, workers, replicatesPerTask, executor, writeResult)
+  for replicateFile in replicateFiles:
+    replicateFile.flush()
+  percentiles = [50*(1-confidence), 50*(1+confidence)]
+  meanShapes, eigenvalues, eigenvectors = replicateFiles
+  return {'meanShape': tuple(np.percentile(meanShapes, percentiles, axis=0)),
+    'eigenvalues': tuple(np.percentile(eigenvalues, percentiles, axis=0)),
+    'eigenvectors': tuple(np.percentile(eigenvectors, percentiles, axis=0))}
+
+################# Permutation test
+# Group labels do not enter the GPA, so the specimens are aligned once and only the group assignment is permuted.
+def groupMeanDistances(twoDim, groupIndex, groupNumber):
+  """
+  Procrustes distances between the mean shapes of every pair of groups, in the order of groupPairs
+  """
+  indicator = np.zeros((len(groupIndex), groupNumber))
+  indicator[np.arange(len(groupIndex)), groupIndex] = 1
+  groupMeans = np.dot(twoDim, indicator)/indicator.sum(axis=0)
+  first, second = np.triu_indices(groupNumber, 1)
+  return np.linalg.norm(groupMeans[:,first] - groupMeans[:,second], axis=0)
+
+def groupPairs(groupNames):
+  first, second = np.triu_indices(len(groupNames), 1)
+  return [(groupNames[a], groupNames[b]) for a, b in zip(first, second)]
+
+def _permutationTask(data, start, seeds):
+  distances = [groupMeanDistances(data['twoDim'], np.random.default_rng(seed).permutation(data['groupIndex']), data['groupNumber'])
+    for seed in seeds]
+  return start, np.stack(distances)
+
+def runPermutationTest(aligned, groups, replicates, outputFolder, seed=0, workers=None, replicatesPerTask=500,
+  executor='thread'):
+  """
+  Permutation test of the Procrustes distance between group mean shapes, for every pair of groups. groups holds
+  the group label of every specimen. The distances of every replicate are written to permutationDistances.npy in
+  outputFolder. Returns the group pairs, the observed distances and their p-values.
+  """
+  groupNames, groupIndex = np.unique(np.asarray(groups), return_inverse=True)
+  twoDim = gpa_lib.makeTwoDim(aligned)
+  observed = groupMeanDistances(twoDim, groupIndex, len(groupNames))
+  os.makedirs(outputFolder, exist_ok=True)
+  distances = openReplicateFile(outputFolder, 'permutationDistances', (replicates, len(observed)))
+  def writeResult(start, result):
+    distances[start:start+len(result)] = result
+  data = dict(twoDim=twoDim, groupIndex=groupIndex, groupNumber=len(groupNames))
+  runReplicates(_permutationTask, data, replicates, seed, workers, replicatesPerTask, executor, writeResult)
+  distances.flush()
+  pValues = (np.sum(distances >= observed, axis=0) + 1)/float(replicates + 1)
+  return groupPairs([str(name) for name in groupNames]), observed, pValues
@@ -0,0 +1,162 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.linalg as sp
+import scipy.sparse
+import scipy.sparse.linalg
+from scipy.spatial import cKDTree
+import Support.gpa_lib as gpa_lib
+import Support.tps_lib as tps_lib
+
+# Sliding semi-landmarks along their tangent directions, run between the alignment iterations of the GPA.
+# Every semi-landmark slides along one (curve) or two (surface) tangent directions estimated on the specimen, to
+# minimize either the bending energy of the thin plate spline from the reference to the specimen or the Procrustes
+# distance to the reference.
+# The bending energy matrix only depends on the reference, so it is computed once per iteration from a single LU
+# factorization of the spline system and shared by all specimens. The tangent constraints are block sparse (each
+# direction touches one landmark). Up to DENSE_DIRECTION_LIMIT directions, the reduced system of every specimen is
+# assembled from the semi-landmark block of the bending energy matrix with element-wise products and solved by a
+# Cholesky factorization. Above it the dense system would cost O(directions^3) per specimen and iteration, so it is
+# solved by preconditioned conjugate gradients through the sparse direction matrix instead, without assembling it.
+# The Procrustes distance is minimized independently for every semi-landmark, by projecting its offset to the
+# reference onto the span of its directions, which do not need to be orthonormal.
+# Specimens are slid in a thread pool, LAPACK releases the GIL.
+
+SLIDING_CRITERIA = ('bendingEnergy', 'procrustesDistance')
+TANGENT_MODES = ('curve', 'surface')
+DENSE_DIRECTION_LIMIT = 1000
+
+def bendingEnergyRows(reference, semiLandmarks):
+  """
+  Rows of the bending energy matrix of the reference (landmarks x 3) for the semi-landmarks,
+  a (semi-landmarks x landmarks) array. The upper left block of the inverse spline system is negative semi-definite
+  for the kernel U(r) = r, the bending energy matrix is its negative.
+  """
+  spline = tps_lib.ThinPlateSpline(reference)
+  n = len(reference)
+  unitColumns = np.zeros((n+4, len(semiLandmarks)))
+  unitColumns[semiLandmarks, np.arange(len(semiLandmarks))] = 1
+  # the spline system is symmetric, so its inverse columns are the rows
+  return -sp.lu_solve(spline.factor, unitColumns)[:n].T
+
+def curveTangents(specimen, semiLandmarks):
+  """
+  Unit tangents of semi-landmarks on curves, from the landmarks before and after them in the landmark order
+  """
+  last = len(specimen)-1
+  tangents = specimen[np.minimum(semiLandmarks+1, last)] - specimen[np.maximum(semiLandmarks-1, 0)]
+  return np.arange(len(semiLandmarks)), tangents
+
+def surfaceTangents(specimen, semiLandmarks, neighborCount=8):
+  """
+  Two unit tangents of semi-landmarks on surfaces, spanning the plane fitted to the nearest landmarks of the specimen
+  """
+  neighborCount = min(neighborCount+1, len(specimen))
+  distances, neighbors = cKDTree(specimen).query(specimen[semiLandmarks], neighborCount)
+  neighborhoods = specimen[neighbors] - specimen[neighbors].mean(axis=1, keepdims=True)
+  eigenValues, eigenVectors = np.linalg.eigh(np.matmul(np.transpose(neighborhoods, (0,2,1)), neighborhoods))
+  # the smallest eigenvector is the surface normal, the other two span the tangent plane
+  tangents = np.transpose(eigenVectors[:,:,1:], (0,2,1)).reshape(-1,3)
+  return np.repeat(np.arange(len(semiLandmarks)), 2), tangents
+
+def slidingDirections(specimen, semiLandmarks, tangents, neighborCount=8):
+  """
+  Returns the semi-landmark position (index into semiLandmarks) and the unit vector of every sliding direction.
+  tangents is 'curve', 'surface' or a function(specimen, semiLandmarks) returning the same.
+  """
+  if callable(tangents):
+    positions, directions = tangents(specimen, semiLandmarks)
+  elif tangents == 'curve':
+    positions, directions = curveTangents(specimen, semiLandmarks)
+  elif tangents == 'surface':
+    positions, directions = surfaceTangents(specimen, semiLandmarks, neighborCount)
+  else:
+    raise ValueError(f"Unknown tangent mode '{tangents}', expected one of {TANGENT_MODES}")
+  lengths = np.linalg.norm(directions, axis=1)
+  valid = lengths > 1e-12 # e.g. coincident neighbors leave no direction to slide along
+  return positions[valid], directions[valid]/lengths[valid,np.newaxis]
+
+def directionMatrix(positions, directions, semiLandmarkNumber):
+  """
+  Sparse (semi-landmarks*3 x directions) matrix mapping the steps along the directions to the displacements of the
+  semi-landmarks, flattened row by row
+  """
+  rows = 3*np.repeat(positions, 3) + np.tile(np.arange(3), len(positions))
+  columns = np.repeat(np.arange(len(positions)), 3)
+  return scipy.sparse.csr_matrix((directions.ravel(), (rows, columns)), shape=(3*semiLandmarkNumber, len(positions)))
+
+def tangentProjectors(positions, directions, semiLandmarkNumber):
+  """
+  Orthogonal projectors (semi-landmarks x 3 x 3) onto the span of the directions of every semi-landmark, zero for
+  semi-landmarks without directions
+  """
+  order = np.argsort(positions, kind='stable')
+  positions, directions = positions[order], directions[order]
+  slots = np.arange(len(positions)) - np.searchsorted(positions, positions) # rank of a direction on its landmark
+  spans = np.zeros((semiLandmarkNumber, slots.max()+1, 3))
+  spans[positions, slots] = directions
+  return np.matmul(np.linalg.pinv(spans), spans)
+
+def bendingEnergySteps(specimen, semiLandmarks, energyRows, positions, directions):
+  """
+  Steps along the directions minimizing the bending energy trace(X' Be X) over X = specimen + sum of steps * directions
+  """
+  gradient = np.einsum('ij,ij->i', np.dot(energyRows, specimen)[positions], directions)
+  if len(positions) <= DENSE_DIRECTION_LIMIT:
+    system = energyRows[np.ix_(positions, semiLandmarks[positions])] * np.dot(directions, directions.T)
+    try:
+      return sp.cho_solve(sp.cho_factor(system), -gradient)
+    except np.linalg.LinAlgError:
+      return sp.lstsq(system, -gradient)[0]
+  stepMatrix = directionMatrix(positions, directions, len(semiLandmarks))
+  displacements = np.zeros_like(specimen)
+  def energyProduct(steps):
+    displacements[semiLandmarks] = (stepMatrix @ np.ravel(steps)).reshape(-1, 3)
+    return stepMatrix.T @ np.dot(energyRows, displacements).ravel()
+  system = scipy.sparse.linalg.LinearOperator((len(positions), len(positions)), matvec=energyProduct, dtype=np.float64)
+  # Jacobi preconditioner, the diagonal of the system is the bending energy diagonal of the landmark of every direction
+  diagonal = np.maximum(energyRows[positions, semiLandmarks[positions]], np.finfo(np.float64).tiny)
+  preconditioner = scipy.sparse.linalg.LinearOperator(system.shape, matvec=lambda steps: np.ravel(steps)/diagonal,
+    dtype=np.float64)
+  # every conjugate gradient iterate lowers the energy, so the steps are used even if the solver did not converge
+  return scipy.sparse.linalg.cg(system, -gradient, M=preconditioner, maxiter=len(positions))[0]
+
+def slideSpecimen(specimen, reference, semiLandmarks, energyRows, criterion, tangents, neighborCount=8):
+  """
+  Slide the semi-landmarks of one specimen (landmarks x 3) in place
+  """
+  positions, directions = slidingDirections(specimen, semiLandmarks, tangents, neighborCount)
+  if len(positions) == 0:
+    return specimen
+  if criterion == 'procrustesDistance':
+    projectors = tangentProjectors(positions, directions, len(semiLandmarks))
+    specimen[semiLandmarks] += np.einsum('pij,pj->pi', projectors, reference[semiLandmarks] - specimen[semiLandmarks])
+    return specimen
+  steps = bendingEnergySteps(specimen, semiLandmarks, energyRows, positions, directions)
+  np.add.at(specimen, semiLandmarks[positions], steps[:,np.newaxis]*directions)
+  return specimen
+
+def slideSemiLandmarks(allLandmarkSets, reference, semiLandmarks, criterion='bendingEnergy', tangents='curve',
+  neighborCount=8, workers=None, chunkSize=None):
+  """
+  Slide the semi-landmarks (zero based landmark indices) of every specimen of the (landmarks x 3 x specimens) stack
+  in place, relative to the reference shape (landmarks x 3). Specimens are processed chunkSize at a time when set
+  (e.g. for memory-mapped arrays), by workers threads.
+  """
+  if criterion not in SLIDING_CRITERIA:
+    raise ValueError(f"Unknown sliding criterion '{criterion}', expected one of {SLIDING_CRITERIA}")
+  semiLandmarks = np.asarray(semiLandmarks, dtype=int)
+  if len(semiLandmarks) == 0:
+    return allLandmarkSets
+  reference = np.asarray(reference, dtype=np.float64)
+  energyRows = bendingEnergyRows(reference, semiLandmarks) if criterion == 'bendingEnergy' else None
+  workers = workers or os.cpu_count() or 1
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for chunk in gpa_lib.specimenChunks(allLandmarkSets.shape[2], chunkSize):
+      block = np.array(allLandmarkSets[:,:,chunk])
+      def slide(index):
+        specimen = np.array(block[:,:,index])
+        block[:,:,index] = slideSpecimen(specimen, reference, semiLandmarks, energyRows, criterion, tangents, neighborCount)
+      list(executor.map(slide, range(block.shape[2])))
+      allLandmarkSets[:,:,chunk] = block
+  return allLandmarkSets
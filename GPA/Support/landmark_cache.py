@@ -0,0 +1,83 @@
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+class LandmarkCache:
+  """
+  On-disk cache of parsed landmark files stored in a single SQLite database.
+  Entries are keyed by the absolute file path and are only valid while the file size and modification time
+  are unchanged. When the cache grows beyond maxSizeBytes the least recently used entries are evicted.
+  """
+
+  def __init__(self, cacheFilePath, maxSizeBytes=512*1024*1024):
+    self.cacheFilePath = cacheFilePath
+    self.maxSizeBytes = maxSizeBytes
+    cacheDirectory = os.path.dirname(cacheFilePath)
+    if cacheDirectory:
+      os.makedirs(cacheDirectory, exist_ok=True)
+    self.connection = sqlite3.connect(cacheFilePath)
+    self.connection.execute("""CREATE TABLE IF NOT EXISTS landmarks (
+      path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, lastAccess REAL, nbytes INTEGER,
+      points BLOB, descriptions TEXT)""")
+    self.connection.commit()
+
+  def fileKey(self, filePath):
+    stat = os.stat(filePath)
+    return os.path.abspath(filePath), stat.st_size, stat.st_mtime_ns
+
+  def get(self, filePath):
+    """
+    Returns the cached (points, descriptions) of the file or None if it is not cached or has changed
+    """
+    try:
+      path, size, mtime = self.fileKey(filePath)
+    except OSError:
+      return None
+    row = self.connection.execute("SELECT size, mtime, points, descriptions FROM landmarks WHERE path=?", (path,)).fetchone()
+    if row is None:
+      return None
+    if row[0] != size or row[1] != mtime:
+      self.connection.execute("DELETE FROM landmarks WHERE path=?", (path,))
+      return None
+    self.connection.execute("UPDATE landmarks SET lastAccess=? WHERE path=?", (time.time(), path))
+    points = np.frombuffer(row[2], dtype='<f8').reshape(-1, 3).copy()
+    return points, json.loads(row[3])
+
+  def put(self, filePath, points, descriptions):
+    path, size, mtime = self.fileKey(filePath)
+    blob = np.ascontiguousarray(points, dtype='<f8').tobytes()
+    descriptionText = json.dumps(list(descriptions))
+    self.connection.execute("INSERT OR REPLACE INTO landmarks VALUES (?,?,?,?,?,?,?)",
+      (path, size, mtime, time.time(), len(blob) + len(descriptionText), blob, descriptionText))
+
+  def commit(self):
+    self.evict()
+    self.connection.commit()
+
+  def evict(self):
+    """
+    Remove least recently used entries until the cache is within maxSizeBytes
+    """
+    totalSize = self.size()
+    if totalSize <= self.maxSizeBytes:
+      return
+    rows = self.connection.execute("SELECT path, nbytes FROM landmarks ORDER BY lastAccess ASC").fetchall()
+    for path, nbytes in rows:
+      if totalSize <= self.maxSizeBytes:
+        break
+      self.connection.execute("DELETE FROM landmarks WHERE path=?", (path,))
+      totalSize -= nbytes
+
+  def size(self):
+    return self.connection.execute("SELECT COALESCE(SUM(nbytes), 0) FROM landmarks").fetchone()[0]
+
+  def clear(self):
+    self.connection.execute("DELETE FROM landmarks")
+    self.connection.commit()
+    self.connection.execute("VACUUM")
+
+  def close(self):
+    self.connection.commit()
+    self.connection.close()
@@ -0,0 +1,103 @@
+import json
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Lightweight landmark file readers. These do not depend on Slicer so they can run in worker threads and
+# in scripts outside of the application.
+
+def readMarkupsJSON(filePath):
+  """
+  Returns a (landmarks x 3) array of control point positions and the list of control point descriptions
+  of the first markup in a .mrk.json file
+  """
+  with open(filePath) as jsonFile:
+    markup = json.load(jsonFile)['markups'][0]
+  controlPoints = markup['controlPoints']
+  points = np.array([controlPoint['position'] for controlPoint in controlPoints], dtype=np.float64).reshape(-1, 3)
+  descriptions = [controlPoint.get('description', '') for controlPoint in controlPoints]
+  return points, descriptions
+
+def readFCSV(filePath):
+  """
+  Returns a (landmarks x 3) array of point positions and the list of point descriptions of a .fcsv file
+  """
+  rows = []
+  with open(filePath) as fcsvFile:
+    for row in fcsvFile:
+      if row.startswith('#') or not row.strip():
+        continue
+      rows.append(row.rstrip('\r\n').split(','))
+  points = np.array([row[1:4] for row in rows], dtype=np.float64).reshape(-1, 3)
+  descriptions = [row[12] if len(row) > 12 else '' for row in rows]
+  return points, descriptions
+
+def readLandmarkFile(filePath):
+  if 'json' in os.path.splitext(filePath)[1]:
+    return readMarkupsJSON(filePath)
+  return readFCSV(filePath)
+
+def semiLandmarkNumbers(descriptions):
+  """
+  One based landmark numbers (as strings) of the points described as 'Semi'
+  """
+  return [str(index+1) for index, description in enumerate(descriptions) if description == 'Semi']
+
+def _readLandmarkFileSafe(filePath):
+  try:
+    points, descriptions = readLandmarkFile(filePath)
+    return points, descriptions, None
+  except Exception as error:
+    return None, None, f"{type(error).__name__}: {error}"
+
+def iterLandmarkFiles(filePathList, workers=None, batchSize=256, cache=None):
+  """
+  Read landmark files in a thread pool. Yields (index, points, descriptions, error) in file order, error is
+  None on success. Files are submitted batchSize at a time so only a bounded number of parsed files is held
+  in memory. If a LandmarkCache is given, cached files are not parsed and newly parsed files are added to it.
+  """
+  workers = workers or min(8, (os.cpu_count() or 1) + 4)
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for start in range(0, len(filePathList), batchSize):
+      batch = filePathList[start:start+batchSize]
+      results = [None]*len(batch)
+      if cache is not None:
+        for offset, filePath in enumerate(batch):
+          cached = cache.get(filePath)
+          if cached is not None:
+            results[offset] = (cached[0], cached[1], None)
+      missing = [offset for offset, result in enumerate(results) if result is None]
+      for offset, result in zip(missing, executor.map(_readLandmarkFileSafe, [batch[offset] for offset in missing])):
+        points, descriptions, error = result
+        if cache is not None and error is None:
+          cache.put(batch[offset], points, descriptions)
+        results[offset] = result
+      if cache is not None:
+        cache.commit()
+      for offset, (points, descriptions, error) in enumerate(results):
+        yield start+offset, points, descriptions, error
+
+def landmarkFileChunks(filePathList, keepIndex, chunkSize=256, workers=None, cache=None):
+  """
+  Chunk reader for gpa_lib.streamingProcrustes that parses the landmark files again on every pass. Returns a function
+  yielding (slice, landmarks x 3 x specimens block) of the landmarks in keepIndex, chunkSize files at a time.
+  Raises ValueError for a file that cannot be read or has a different number of landmarks than the first one.
+  """
+  def readChunks():
+    block = None
+    landmarkNumber = None
+    for index, points, descriptions, error in iterLandmarkFiles(filePathList, workers, chunkSize, cache):
+      if error is not None:
+        raise ValueError(f"{filePathList[index]}: {error}")
+      if landmarkNumber is None:
+        landmarkNumber = len(points)
+      elif len(points) != landmarkNumber:
+        raise ValueError(f"{filePathList[index]}: There are {len(points)} landmarks instead of the expected {landmarkNumber}.")
+      start = index - index % chunkSize
+      if block is None:
+        block = np.zeros((len(keepIndex), 3, min(chunkSize, len(filePathList)-start)))
+      block[:,:,index-start] = points[keepIndex]
+      if index-start == block.shape[2]-1:
+        yield slice(start, start+block.shape[2]), block
+        block = None
+  return readChunks
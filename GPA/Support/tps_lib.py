@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.linalg as sp
+
+def radialKernel(points, landmarks):
+  """
+  (points x landmarks) matrix of the kernel U(r) = r between every point and landmark, built in place in a
+  single buffer
+  """
+  kernel = np.dot(points, landmarks.T)
+  kernel *= -2
+  kernel += np.einsum('ij,ij->i', points, points)[:,np.newaxis]
+  kernel += np.einsum('ij,ij->i', landmarks, landmarks)[np.newaxis,:]
+  np.maximum(kernel, 0, out=kernel)
+  return np.sqrt(kernel, out=kernel)
+
+class ThinPlateSpline:
+  """
+  3D thin plate spline with the kernel U(r) = r and an affine part, the spline of vtkThinPlateSplineTransform
+  with SetBasisToR(). The system matrix only depends on the source landmarks, so it is LU factored once and
+  every new set of target landmarks only needs a back substitution.
+  Points are evaluated in blocks by workers threads (os.cpu_count() by default), the kernel and the products
+  with the coefficients release the GIL.
+  """
+
+  def __init__(self, sourceLandmarks, blockElements=2**22, workers=None):
+    self.sourceLandmarks = np.array(sourceLandmarks, dtype=np.float64)
+    self.blockElements = blockElements
+    self.workers = workers or os.cpu_count() or 1
+    n = len(self.sourceLandmarks)
+    system = np.zeros((n+4, n+4))
+    system[:n,:n] = radialKernel(self.sourceLandmarks, self.sourceLandmarks)
+    system[:n,n] = 1
+    system[:n,n+1:] = self.sourceLandmarks
+    system[n,:n] = 1
+    system[n+1:,:n] = self.sourceLandmarks.T
+    self.factor = sp.lu_factor(system)
+
+  def coefficients(self, targetLandmarks):
+    """
+    Spline coefficients mapping the source landmarks to the target landmarks ((landmarks x 3) or, for several
+    targets at once, (landmarks x 3*targets))
+    """
+    targetLandmarks = np.asarray(targetLandmarks, dtype=np.float64)
+    rightHandSide = np.zeros((targetLandmarks.shape[0]+4, targetLandmarks.shape[1]))
+    rightHandSide[:len(targetLandmarks)] = targetLandmarks
+    return sp.lu_solve(self.factor, rightHandSide)
+
+  def evaluate(self, points, coefficients):
+    """
+    Evaluate the spline with the given coefficients at the (points x 3) array, in blocks of points so the
+    kernel matrix of every thread never exceeds about blockElements entries
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(self.sourceLandmarks)
+    values = np.empty((len(points), coefficients.shape[1]))
+    blockSize = max(1, self.blockElements//n)
+    def evaluateBlock(start):
+      block = points[start:start+blockSize]
+      values[start:start+blockSize] = (np.dot(radialKernel(block, self.sourceLandmarks), coefficients[:n])
+        + coefficients[n] + np.dot(block, coefficients[n+1:]))
+    starts = range(0, len(points), blockSize)
+    if self.workers > 1 and len(starts) > 1:
+      with ThreadPoolExecutor(max_workers=min(self.workers, len(starts))) as executor:
+        list(executor.map(evaluateBlock, starts))
+    else:
+      for start in starts:
+        evaluateBlock(start)
+    return values
+
+  def transformPoints(self, points, targetLandmarks):
+    return self.evaluate(points, self.coefficients(targetLandmarks))
+
+  def displacementBasis(self, points, landmarkDisplacements):
+    """
+    Displacement of the points for every set of landmark displacements (sets x landmarks x 3), returned as
+    (sets x points x 3). The spline is linear in the targets and reproduces affine maps exactly, so moving the
+    targets by a displacement moves every point by the spline of that displacement. Any combination of the
+    displacement sets can then be applied to the points without evaluating the spline again.
+    """
+    landmarkDisplacements = np.asarray(landmarkDisplacements, dtype=np.float64)
+    sets, n, dimension = landmarkDisplacements.shape
+    coefficients = self.coefficients(np.moveaxis(landmarkDisplacements, 0, 1).reshape(n, sets*dimension))
+    displacements = self.evaluate(points, coefficients)
+    return np.moveaxis(displacements.reshape(len(points), sets, dimension), 1, 0)
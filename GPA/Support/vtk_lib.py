@@ -56,31 +56,165 @@ def createTPS( sourceLM, targetLM):
 
 
 def convertFudicialToVTKPoint(fnode):
-    import numpy as np
-    numberOfLM=fnode.GetNumberOfFiducials()
-    x=y=z=0
-    loc=[x,y,z]
-    lmData=np.zeros((numberOfLM,3))
-    #
-    for i in range(numberOfLM):
-        fnode.GetNthFiducialPosition(i,loc)
-        lmData[i,:]=np.asarray(loc)
-    #return lmData
-    #
-    points=vtk.vtkPoints()
-    for i in range(numberOfLM):
-        points.InsertNextPoint(lmData[i,0], lmData[i,1], lmData[i,2])
-#
-    return points
+    return markupsToVTKPoints(fnode)
 
 def convertNumpyToVTK(A):
-    x,y=A.shape
+    return numpyToVTKPoints(A)
+
+# Array based point conversion. vtkPoints created from numpy arrays share their memory with the array (which is
+# kept alive by the vtk array), and markups control points are read and written with the array markups API
+# instead of one control point at a time.
+def numpyToVTKPoints(array):
+    """
+    vtkPoints sharing memory with the (points x 3) array. Arrays that are not contiguous float32/float64 are
+    converted once.
+    """
+    import numpy as np
+    import vtk.util.numpy_support as vtk_np
+    array=np.asarray(array)
+    if array.dtype not in (np.float32, np.float64):
+        array=array.astype(np.float64)
+    array=np.ascontiguousarray(array.reshape(-1,3))
     points=vtk.vtkPoints()
-    for i in range(x):
-        points.InsertNextPoint(A[i,0], A[i,1], A[i,2])
-#
+    points.SetData(vtk_np.numpy_to_vtk(array, deep=False))
     return points
 
+def numpyToVTKArray(array, name=None):
+    """
+    vtkDataArray sharing memory with the array, (tuples) or (tuples x components)
+    """
+    import numpy as np
+    import vtk.util.numpy_support as vtk_np
+    vtkArray=vtk_np.numpy_to_vtk(np.ascontiguousarray(array), deep=False)
+    if name is not None:
+        vtkArray.SetName(name)
+    return vtkArray
+
+def vtkPointsToNumpy(points):
+    """
+    (points x 3) numpy view of the vtkPoints coordinates
+    """
+    import vtk.util.numpy_support as vtk_np
+    return vtk_np.vtk_to_numpy(points.GetData())
+
+def markupsToNumpy(markupsNode):
+    from __main__ import slicer
+    return slicer.util.arrayFromMarkupsControlPoints(markupsNode)
+
+def markupsToVTKPoints(markupsNode):
+    return numpyToVTKPoints(markupsToNumpy(markupsNode))
+
+def numpyToMarkups(markupsNode, array):
+    """
+    Replace the control points of the markups node with the (points x 3) array in a single update
+    """
+    setMarkupsControlPoints(markupsNode, array)
+
+def vtkPointsToMarkups(markupsNode, points):
+    setMarkupsControlPoints(markupsNode, points)
+
+def setMarkupsControlPoints(markupsNode, points, labels=None, descriptions=None):
+    """
+    Replace all control points of the markups node with points ((points x 3) array, vtkPoints, the points of a
+    vtkPointSet such as vtkPolyData, or None). labels and
+    descriptions are optional sequences applied to the points in order (points past their end keep their current
+    or default label and description), or a single string used for every point.
+    Modified events are suppressed until all points, labels and descriptions are set, so observers and
+    displayable managers only update once.
+    """
+    import numpy as np
+    from __main__ import slicer
+    if points is None:
+        points=np.zeros((0,3))
+    elif isinstance(points, vtk.vtkPointSet):
+        points=points.GetPoints()
+        points=np.zeros((0,3)) if points is None else vtkPointsToNumpy(points)
+    elif isinstance(points, vtk.vtkPoints):
+        points=vtkPointsToNumpy(points)
+    elif isinstance(points, vtk.vtkObject):
+        raise TypeError(f"Cannot set markups control points from a {points.GetClassName()}")
+    points=np.asarray(points, dtype=np.float64).reshape(-1,3)
+    wasModifying=markupsNode.StartModify()
+    try:
+        if len(points):
+            slicer.util.updateMarkupsControlPointsFromArray(markupsNode, points)
+        else:
+            markupsNode.RemoveAllControlPoints()
+        if labels is not None:
+            if isinstance(labels, str):
+                labels=[labels]*len(points)
+            for index, label in enumerate(labels):
+                markupsNode.SetNthControlPointLabel(index, label)
+        if descriptions is not None:
+            if isinstance(descriptions, str):
+                descriptions=[descriptions]*len(points)
+            for index, description in enumerate(descriptions):
+                markupsNode.SetNthControlPointDescription(index, description)
+    finally:
+        markupsNode.EndModify(wasModifying)
+
+def createMarkupsNode(name, points, labels=None, descriptions=None, className='vtkMRMLMarkupsFiducialNode'):
+    """
+    New markups node with default display nodes holding points, see setMarkupsControlPoints
+    """
+    from __main__ import slicer
+    markupsNode=slicer.mrmlScene.AddNewNodeByClass(className, name)
+    markupsNode.CreateDefaultDisplayNodes()
+    setMarkupsControlPoints(markupsNode, points, labels, descriptions)
+    return markupsNode
+
+def setTableNodeColumns(tableNode, columnNames, columns):
+    """
+    Replace the columns of the table node. Numeric columns are copied from numpy in bulk, any other column is
+    stored as strings. The table node is only modified once.
+    """
+    import numpy as np
+    import vtk.util.numpy_support as vtk_np
+    wasModifying=tableNode.StartModify()
+    try:
+        tableNode.RemoveAllColumns()
+        table=tableNode.GetTable()
+        for columnName, column in zip(columnNames, columns):
+            column=np.asarray(column)
+            if column.dtype.kind in 'iuf':
+                array=vtk_np.numpy_to_vtk(np.ascontiguousarray(column), deep=True)
+            else:
+                array=vtk.vtkStringArray()
+                array.SetNumberOfValues(len(column))
+                for index, value in enumerate(column):
+                    array.SetValue(index, str(value))
+            array.SetName(columnName)
+            table.AddColumn(array)
+        table.Modified()
+    finally:
+        tableNode.EndModify(wasModifying)
+
+def scoreTableKey(files, data, pcNumber):
+    """
+    Digest of the file names and the scores of the first pcNumber PCs (specimens x PCs) shown in a PCA scatter plot
+    table
+    """
+    import hashlib
+    import numpy as np
+    key=hashlib.md5(np.ascontiguousarray(data[:,:pcNumber]).tobytes())
+    key.update('\n'.join(map(str, files)).encode())
+    return key.hexdigest()
+
+def setScoreTable(tableNode, files, data, pcNumber):
+    """
+    Fill the table node with a 'Subject ID' column of the file names and PC1 to PC<pcNumber> columns of the scores
+    (specimens x PCs). The digest of the content is stored on the table, so it is only filled again when the
+    content changes and not when the plotted PCs change.
+    """
+    import numpy as np
+    key=scoreTableKey(files, data, pcNumber)
+    if tableNode.GetAttribute('ScoreTableKey') == key:
+        return
+    columnNames=['Subject ID'] + ["PC" + str(i+1) for i in range(pcNumber)]
+    scores=np.asarray(data[:,:pcNumber], dtype=np.float32)
+    setTableNodeColumns(tableNode, columnNames, [np.asarray(files)] + list(scores.T))
+    tableNode.SetAttribute('ScoreTableKey', key)
+
 
 # def test():
 #     mrml=slicer.mrmlScene
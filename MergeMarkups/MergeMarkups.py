@@ -404,20 +404,15 @@ class MergeMarkupsLogic(ScriptedLoadableModuleLogic):
     # merges semilandmarks into the fixed landmark set
     # if there are no landmark descriptions, these will be set according to the
     # fixed/semiLM box they were entered in
-    for index in range(fixedLM.GetNumberOfControlPoints()):
-      fiducialDescription = fixedLM.GetNthControlPointDescription(index)
-      if fiducialDescription == "":
-        fixedLM.SetNthControlPointDescription(index,"Fixed")
-    for index in range(semiLM.GetNumberOfControlPoints()):
-      pt = semiLM.GetNthControlPointPositionVector(index)
-      fiducialLabel = semiLM.GetNthControlPointLabel(index)
-      fiducialDescription = semiLM.GetNthControlPointDescription(index)
-      fixedLM.AddControlPoint(pt,fiducialLabel)
-      mergedIndex = fixedLM.GetNumberOfControlPoints()-1
-      if fiducialDescription == "":
-        fixedLM.SetNthControlPointDescription(mergedIndex,"Semi")
-      else:
-        fixedLM.SetNthControlPointDescription(mergedIndex,fiducialDescription)
+    import Support.vtk_lib as vtk_lib
+    labels = []
+    descriptions = []
+    for landmarkNode, defaultDescription in ((fixedLM, "Fixed"), (semiLM, "Semi")):
+      for index in range(landmarkNode.GetNumberOfControlPoints()):
+        labels.append(landmarkNode.GetNthControlPointLabel(index))
+        descriptions.append(landmarkNode.GetNthControlPointDescription(index) or defaultDescription)
+    points = np.concatenate([vtk_lib.markupsToNumpy(fixedLM).reshape(-1,3), vtk_lib.markupsToNumpy(semiLM).reshape(-1,3)])
+    vtk_lib.setMarkupsControlPoints(fixedLM, points, labels, descriptions)
 
   def runApplyLandmarksType(self, markupsTreeView, label):
     nodeIDs=markupsTreeView.selectedIndexes()
@@ -427,8 +422,10 @@ class MergeMarkupsLogic(ScriptedLoadableModuleLogic):
         self.setAllLandmarkDescriptions(currentNode, label)
 
   def setAllLandmarkDescriptions(self,landmarkNode, landmarkDescription):
+    wasModifying = landmarkNode.StartModify()
     for controlPointIndex in range(landmarkNode.GetNumberOfControlPoints()):
       landmarkNode.SetNthControlPointDescription(controlPointIndex, landmarkDescription)
+    landmarkNode.EndModify(wasModifying)
 
   def runFiducials(self, markupsTreeView):
     nodeIDs=markupsTreeView.selectedIndexes()
@@ -459,22 +456,25 @@ class MergeMarkupsLogic(ScriptedLoadableModuleLogic):
     return True
 
   def mergeList(self, nodeList,mergedNode, continuousCurveOption=False):
+    import Support.vtk_lib as vtk_lib
     pointList=[]
+    labelList=[]
+    descriptionList=[]
+    seenPoints=set()
     connectingNode=False
     # Add semi-landmark points within triangle patches
     for currentNode in nodeList:
-      for index in range(currentNode.GetNumberOfControlPoints()):
+      currentPoints = vtk_lib.markupsToNumpy(currentNode).reshape(-1,3)
+      for index in range(len(currentPoints)):
         if not(index==0 and continuousCurveOption and connectingNode):
-          pt = currentNode.GetNthControlPointPositionVector(index)
-          pt_array = [pt.GetX(), pt.GetY(), pt.GetZ()]
-          if pt_array not in pointList:
-            pointList.append(pt_array)
-            fiducialLabel = currentNode.GetNthControlPointLabel(index)
-            fiducialDescription = currentNode.GetNthControlPointDescription(index)
-            mergedNode.AddControlPoint(pt,fiducialLabel)
-            mergedIndex = mergedNode.GetNumberOfControlPoints()-1
-            mergedNode.SetNthControlPointDescription(mergedIndex,fiducialDescription)
+          pt_tuple = tuple(currentPoints[index])
+          if pt_tuple not in seenPoints:
+            seenPoints.add(pt_tuple)
+            pointList.append(pt_tuple)
+            labelList.append(currentNode.GetNthControlPointLabel(index))
+            descriptionList.append(currentNode.GetNthControlPointDescription(index))
       connectingNode=True
+    vtk_lib.setMarkupsControlPoints(mergedNode, pointList, labelList, descriptionList)
     return True
 
   def process(self, inputVolume, outputVolume, imageThreshold, invert=False, showResult=True):
@@ -265,8 +265,8 @@ class ProjectSemiLMLogic(ScriptedLoadableModuleLogic):
     for i in range(25):
       semiLMNode.GetMarkupPoint(0,i,point)
       sampleArray[i,:]=point
-    sampleDistances = self.distanceMatrix(sampleArray)
-    minimumMeshSpacing = sampleDistances[sampleDistances.nonzero()].min(axis=0)
+    import Support.gpa_lib as gpa_lib
+    minimumMeshSpacing = gpa_lib.minimumDistance(sampleArray)
     rayLength = minimumMeshSpacing * (scaleProjection)
 
 
@@ -339,12 +339,8 @@ class ProjectSemiLMLogic(ScriptedLoadableModuleLogic):
     Computes the euclidean distance matrix for n points in a 3D space
     Returns a nXn matrix
      """
-    id,jd=a.shape
-    fnx = lambda q : q - np.reshape(q, (id, 1))
-    dx=fnx(a[:,0])
-    dy=fnx(a[:,1])
-    dz=fnx(a[:,2])
-    return (dx**2.0+dy**2.0+dz**2.0)**0.5
+    import Support.gpa_lib as gpa_lib
+    return gpa_lib.distanceMatrix(a)
 
   def takeScreenshot(self,name,description,type=-1):
     # show the message even if not taking a screen shot
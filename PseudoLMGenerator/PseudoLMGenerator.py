@@ -359,17 +359,15 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     landmarkDescription = "Semi"
     if setToSemiType is False:
       landmarkDescription = "Fixed"
+    wasModifying = landmarkNode.StartModify()
     for controlPointIndex in range(landmarkNode.GetNumberOfControlPoints()):
       landmarkNode.SetNthControlPointDescription(controlPointIndex, landmarkDescription)
+    landmarkNode.EndModify(wasModifying)
 
   def runCleaningPointCloud(self, projectedLM, sphere, spacingPercentage):
+    import Support.vtk_lib as vtk_lib
     # Convert projected surface points to a VTK array for transform
-    p=[0,0,0]
-    targetPoints = vtk.vtkPoints()
-    for i in range(projectedLM.GetNumberOfFiducials()):
-      projectedLM.GetMarkupPoint(0,i,p)
-      targetPoints.InsertNextPoint(p)
-      print("inserting vtk point: ", p)
+    targetPoints = vtk_lib.markupsToVTKPoints(projectedLM)
 
     pointPD=vtk.vtkPolyData()
     pointPD.SetPoints(targetPoints)
@@ -385,24 +383,13 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     cleanFilter.Update()
     outputPoints = cleanFilter.GetOutput()
 
-    sphereSampleLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"PseudoLandmarks")
-    sphereSampleLMNode.CreateDefaultDisplayNodes()
-    for i in range(outputPoints.GetNumberOfPoints()):
-      point = outputPoints.GetPoint(i)
-      sphereSampleLMNode.AddFiducialFromArray(point)
-      print("inserting fiducial point: ", p)
-
-    landmarkTypeSemi=True
-    self.setAllLandmarksType(sphereSampleLMNode, landmarkTypeSemi)
+    sphereSampleLMNode = vtk_lib.createMarkupsNode("PseudoLandmarks", outputPoints.GetPoints(), descriptions="Semi")
     return sphereSampleLMNode
 
   def runCleaningFast(self, projectedLM, sphere, spacingPercentage):
+    import Support.vtk_lib as vtk_lib
     # Convert projected surface points to a VTK array for transform
-    p=[0,0,0]
-    targetPoints = vtk.vtkPoints()
-    for i in range(projectedLM.GetNumberOfFiducials()):
-      projectedLM.GetMarkupPoint(0,i,p)
-      targetPoints.InsertNextPoint(p)
+    targetPoints = vtk_lib.markupsToVTKPoints(projectedLM)
 
     templateData = sphere.GetPolyData()
     templateData.SetPoints(targetPoints)
@@ -416,23 +403,13 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     cleanPolyData=filter.GetOutput()
 
     # Create a landmark node from the cleaned polyData
-    sphereSampleLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"PseudoLandmarks")
-    sphereSampleLMNode.CreateDefaultDisplayNodes()
-    for i in range(cleanPolyData.GetNumberOfPoints()):
-      point = cleanPolyData.GetPoint(i)
-      sphereSampleLMNode.AddFiducialFromArray(point)
-
-    landmarkTypeSemi=True
-    self.setAllLandmarksType(sphereSampleLMNode, landmarkTypeSemi)
+    sphereSampleLMNode = vtk_lib.createMarkupsNode("PseudoLandmarks", cleanPolyData.GetPoints(), descriptions="Semi")
     return sphereSampleLMNode
 
   def runCleaning(self, projectedLM, sphere, spacingPercentage):
+    import Support.vtk_lib as vtk_lib
     # Convert projected surface points to a VTK array for transform
-    p=[0,0,0]
-    targetPoints = vtk.vtkPoints()
-    for i in range(projectedLM.GetNumberOfFiducials()):
-      projectedLM.GetMarkupPoint(0,i,p)
-      targetPoints.InsertNextPoint(p)
+    targetPoints = vtk_lib.markupsToVTKPoints(projectedLM)
 
     # Set up a transform between the sphere and the points projected to the surface
     transform = vtk.vtkThinPlateSplineTransform()
@@ -456,14 +433,7 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     cleanPolyData=filter.GetOutput()
 
     # Create a landmark node from the cleaned polyData
-    sphereSampleLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"PseudoLandmarks")
-    sphereSampleLMNode.CreateDefaultDisplayNodes()
-    for i in range(cleanPolyData.GetNumberOfPoints()):
-      point = cleanPolyData.GetPoint(i)
-      sphereSampleLMNode.AddFiducialFromArray(point)
-
-    landmarkTypeSemi=True
-    self.setAllLandmarksType(sphereSampleLMNode, landmarkTypeSemi)
+    sphereSampleLMNode = vtk_lib.createMarkupsNode("PseudoLandmarks", cleanPolyData.GetPoints(), descriptions="Semi")
     return sphereSampleLMNode
 
   def runPointProjection(self, sphere, model, spherePoints, maxProjectionFactor, isOriginalGeometry, symmetryPlane=None):
@@ -471,20 +441,13 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     print('max projection: ', maxProjection)
     # project landmarks from template to model
     projectedPoints = self.projectPointsPolydata(sphere, model, spherePoints, maxProjection)
-    projectedLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"projectedLM")
-    projectedLMNode.CreateDefaultDisplayNodes()
+    import Support.vtk_lib as vtk_lib
     if(isOriginalGeometry):
-      for i in range(projectedPoints.GetNumberOfPoints()):
-        point = projectedPoints.GetPoint(i)
-        projectedLMNode.AddFiducialFromArray(point)
-      return projectedLMNode
+      return vtk_lib.createMarkupsNode("projectedLM", projectedPoints.GetPoints())
     else:
       #project landmarks from model to model external surface
       projectedPointsExternal = self.projectPointsPolydata(model, model, projectedPoints, maxProjection)
-      for i in range(projectedPointsExternal.GetNumberOfPoints()):
-        point = projectedPointsExternal.GetPoint(i)
-        projectedLMNode.AddFiducialFromArray(point)
-      return projectedLMNode
+      return vtk_lib.createMarkupsNode("projectedLM", projectedPointsExternal.GetPoints())
 
   def projectPointsPolydata(self, sourcePolydata, targetPolydata, originalPoints, rayLength):
     #set up polydata for projected points to return
@@ -552,12 +515,8 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     return projectedPointData
 
   def getTemplateLandmarks(self, spherePolyData):
-    semiLMNode= slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode',"templatePoints")
-    semiLMNode.CreateDefaultDisplayNodes()
-    for i in range(spherePolyData.GetNumberOfPoints()):
-      point = spherePolyData.GetPoint(i)
-      semiLMNode.AddFiducialFromArray(point)
-
+    import Support.vtk_lib as vtk_lib
+    semiLMNode = vtk_lib.createMarkupsNode("templatePoints", spherePolyData.GetPoints())
     return semiLMNode
 
   def addTemplateToScene(self, spherePolyData):
@@ -762,13 +721,12 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
     return reverseNormalFilter.GetOutput()
 
   def symmetrizeLandmarks(self, modelNode, landmarkNode, plane, samplingPercentage):
+    import Support.vtk_lib as vtk_lib
     # clip and mirror model and points
-    pointsVTK = vtk.vtkPoints()
+    pointsVTK = vtk_lib.markupsToVTKPoints(landmarkNode)
     pointPolyData = vtk.vtkPolyData()
     pointPolyData.SetPoints(pointsVTK)
     model = modelNode.GetPolyData()
-    for i in range(landmarkNode.GetNumberOfFiducials()):
-      pointsVTK.InsertNextPoint(landmarkNode.GetNthControlPointPositionVector(i))
     geometryFilter = vtk.vtkVertexGlyphFilter()
     geometryFilter.SetInputData(pointPolyData)
     geometryFilter.Update()
@@ -816,29 +774,36 @@ class PseudoLMGeneratorLogic(ScriptedLoadableModuleLogic):
 
     samplingDistance = model.GetLength()*samplingPercentage
     spatialConstraint = samplingDistance*samplingDistance
-    mergedPoint = [0,0,0]
-    for i in range(projectedPoints.GetNumberOfPoints()):
-      clippedPoint = clippedPoints.GetPoint(i)
-      projectedPoint = projectedPoints.GetPoint(i)
-      distance = vtk.vtkMath().Distance2BetweenPoints(clippedPoint, projectedPoint)
-      if distance > spatialConstraint:
-        clippedLMNode.AddFiducialFromArray(clippedPoint, 'n_'+str(i))
-        projectedLMNode.AddFiducialFromArray(projectedPoint, 'i_'+str(i))
-        totalLMNode.AddFiducialFromArray(clippedPoint, 'n_'+str(i))
-        totalLMNode.AddFiducialFromArray(projectedPoint, 'i_'+str(i))
+    pointNumber = projectedPoints.GetNumberOfPoints()
+    clippedArray = np.zeros((0,3))
+    projectedArray = np.zeros((0,3))
+    if pointNumber > 0:
+      clippedArray = vtk_lib.vtkPointsToNumpy(clippedPoints.GetPoints())[:pointNumber].astype(np.float64)
+      projectedArray = vtk_lib.vtkPointsToNumpy(projectedPoints.GetPoints()).astype(np.float64)
+    separated = np.sum((clippedArray-projectedArray)**2, axis=1) > spatialConstraint
+    mergedArray = (clippedArray+projectedArray)/2
+    separatedIndex = np.flatnonzero(separated)
+    mergedIndex = np.flatnonzero(~separated)
+
+    # separated points contribute both the clipped and the projected point to the total, merged points their midpoint
+    counts = np.where(separated, 2, 1)
+    totalIndex = np.cumsum(counts) - counts
+    totalArray = np.empty((counts.sum(),3))
+    totalArray[totalIndex[separated]] = clippedArray[separated]
+    totalArray[totalIndex[separated]+1] = projectedArray[separated]
+    totalArray[totalIndex[~separated]] = mergedArray[~separated]
+    totalLabels = []
+    for i in range(pointNumber):
+      if separated[i]:
+        totalLabels += ['n_'+str(i), 'i_'+str(i)]
       else:
-        mergedPoint[0] = (clippedPoint[0]+projectedPoint[0])/2
-        mergedPoint[1] = (clippedPoint[1]+projectedPoint[1])/2
-        mergedPoint[2] = (clippedPoint[2]+projectedPoint[2])/2
-        totalLMNode.AddFiducialFromArray(mergedPoint, 'm_'+str(i))
-        midlineLMNode.AddFiducialFromArray(mergedPoint, 'm_'+str(i))
+        totalLabels.append('m_'+str(i))
 
     # set pseudo landmarks created to type II
-    landmarkTypeSemi=True
-    self.setAllLandmarksType(totalLMNode, landmarkTypeSemi)
-    self.setAllLandmarksType(midlineLMNode, landmarkTypeSemi)
-    self.setAllLandmarksType(projectedLMNode, landmarkTypeSemi)
-    self.setAllLandmarksType(clippedLMNode, landmarkTypeSemi)
+    vtk_lib.setMarkupsControlPoints(clippedLMNode, clippedArray[separated], ['n_'+str(i) for i in separatedIndex], "Semi")
+    vtk_lib.setMarkupsControlPoints(projectedLMNode, projectedArray[separated], ['i_'+str(i) for i in separatedIndex], "Semi")
+    vtk_lib.setMarkupsControlPoints(totalLMNode, totalArray, totalLabels, "Semi")
+    vtk_lib.setMarkupsControlPoints(midlineLMNode, mergedArray[~separated], ['m_'+str(i) for i in mergedIndex], "Semi")
 
     return projectedLMNode
 